@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Сравнение бэкендов OCR на наборе документов: скорость (страниц/сек) и точность.
+
+Документы (PDF, JPG) берутся из папки; эталонный текст документа — файл с тем же
+именем и расширением .txt рядом с ним (без эталона считается только скорость).
+
+    python benchmark_ocr.py --docs data/ocr_benchmark --backends tesseract,doctr
+    python benchmark_ocr.py --docs data/ocr_benchmark --steps crop,deskew,scale,enhance,binarize
+"""
+
+import argparse
+import difflib
+import os
+import time
+
+from extractor.ocr import OCR_RESOLUTION, render_pdf_page_gray
+from extractor.preprocess import OCR_PREPROCESS_STEPS, preprocess
+from extractor.ocr_backends import BACKENDS, get_backend
+
+
+def load_pages(file_path, resolution, steps=None):
+    """Подготовленные серые изображения страниц документа (steps — шаги предобработки, по умолчанию OCR_PREPROCESS_STEPS)"""
+    import cv2
+    if file_path.lower().endswith('.pdf'):
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(file_path)
+        page_count = len(pdf)
+        pdf.close()
+        pages = []
+        for page_index in range(page_count):
+            bitmap, gray = render_pdf_page_gray(file_path, page_index, resolution)
+            pages.append(preprocess(gray.copy(), steps)[0])
+            bitmap.close()
+        return pages
+    return [preprocess(cv2.imread(file_path, cv2.IMREAD_GRAYSCALE), steps)[0]]
+
+
+def char_accuracy(reference, text):
+    """Доля символов эталона, совпавших с распознанным текстом (пробелы нормализуются)"""
+    reference = " ".join(reference.split())
+    text = " ".join(text.split())
+    if not reference:
+        return None
+    matcher = difflib.SequenceMatcher(None, reference, text, autojunk=False)
+    return sum(block.size for block in matcher.get_matching_blocks()) / len(reference)
+
+
+def run_backend(name, documents):
+    backend = get_backend(name)
+    # Прогрев: загрузка модели не входит в замер
+    backend.recognize(documents[0][1][0])
+    pages = 0
+    elapsed = 0.0
+    accuracies = []
+    for file_path, images in documents:
+        texts = []
+        for i in range(0, len(images), backend.batch_size):
+            batch = images[i:i + backend.batch_size]
+            started = time.perf_counter()
+            texts.extend(result.text for result in backend.recognize_batch(batch))
+            elapsed += time.perf_counter() - started
+        pages += len(images)
+        reference_path = os.path.splitext(file_path)[0] + '.txt'
+        if os.path.exists(reference_path):
+            with open(reference_path, encoding='utf-8') as f:
+                accuracy = char_accuracy(f.read(), "\n".join(texts))
+            if accuracy is not None:
+                accuracies.append(accuracy)
+    return {
+        'backend': name,
+        'pages': pages,
+        'seconds': elapsed,
+        'pages_per_sec': pages / elapsed if elapsed else 0.0,
+        'accuracy': sum(accuracies) / len(accuracies) if accuracies else None,
+        'documents_with_reference': len(accuracies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сравнение бэкендов OCR')
+    parser.add_argument('--docs', required=True, help='Папка с документами (PDF, JPG) и эталонами .txt')
+    parser.add_argument('--backends', default=','.join(BACKENDS),
+                        help=f'Бэкенды через запятую (доступны: {", ".join(BACKENDS)})')
+    parser.add_argument('--resolution', type=int, default=OCR_RESOLUTION, help='Разрешение растеризации PDF, dpi')
+    parser.add_argument('--steps', help='Шаги предобработки через запятую (по умолчанию OCR_PREPROCESS_STEPS), '
+                                        'например crop,deskew,enhance')
+
+    args = parser.parse_args()
+
+    files = sorted(
+        os.path.join(args.docs, name) for name in os.listdir(args.docs)
+        if name.lower().endswith(('.pdf', '.jpg', '.jpeg'))
+    )
+    if not files:
+        print(f"В папке {args.docs} нет PDF/JPG")
+        return
+
+    print(f"Подготовка страниц: {len(files)} документов, {args.resolution} dpi, шаги: {args.steps or OCR_PREPROCESS_STEPS}...")
+    documents = [(file_path, load_pages(file_path, args.resolution, args.steps)) for file_path in files]
+
+    print(f"{'Бэкенд':<12} {'Страниц':>8} {'Сек':>8} {'Стр/сек':>8} {'Точность':>9}")
+    for name in args.backends.split(','):
+        stats = run_backend(name.strip(), documents)
+        accuracy = f"{stats['accuracy']:.1%}" if stats['accuracy'] is not None else '—'
+        print(f"{stats['backend']:<12} {stats['pages']:>8} {stats['seconds']:>8.1f} "
+              f"{stats['pages_per_sec']:>8.2f} {accuracy:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,16 @@ from analytics import Analytics
 from validator import validator
 from document_processor import processor
 from rag import get_rag_index
+from storage import task_queue
 
 TEMP_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "temp")
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+# По умолчанию документы обрабатывает отдельный воркер (python -m document_processor worker);
+# EMBEDDED_WORKER=1 запускает обработку в процессе бота, как раньше
+EMBEDDED_WORKER = os.getenv("EMBEDDED_WORKER", "0") in ("1", "true", "True")
+NOTIFICATION_POLL_INTERVAL = float(os.getenv("NOTIFICATION_POLL_INTERVAL", "1"))
+
 def _escape_html(text: str) -> str:
     return (
         text.replace("&", "&amp;")
@@ -37,6 +43,21 @@ async def notification_callback(user_id: int, message: str):
 
 global_bot = None  # Глобальная переменная для доступа к боту из callback
 
+async def relay_notifications():
+    """Пересылает пользователям уведомления, поставленные воркерами в общую очередь"""
+    while True:
+        try:
+            rows = await processor.execution.run_io(task_queue.claim_notifications, 50)
+            for row in rows:
+                await notification_callback(row['user_id'], row['message'])
+            if not rows:
+                await asyncio.sleep(NOTIFICATION_POLL_INTERVAL)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Ошибка получения уведомлений: {e}")
+            await asyncio.sleep(NOTIFICATION_POLL_INTERVAL)
+
 async def main():
     global global_bot
     bot = Bot(token=os.getenv("TELEGRAM_TOKEN"))
@@ -104,11 +125,17 @@ async def main():
             task_id = await processor.add_task(message.from_user.id, filename, file_path)
             await message.answer(f"Фото получено и добавлено в очередь обработки (ID: {task_id[:8]})")
 
-    # --- Запуск процессора документов ---
+    # --- Бот только ставит задачи в очередь; обработка — в воркере ---
     processor.set_notification_callback(notification_callback)
-    await processor.start()
+    if EMBEDDED_WORKER:
+        await processor.start()
+    relay = asyncio.create_task(relay_notifications())
 
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        relay.cancel()
+        await processor.stop()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
@@ -1 +1,5 @@
- 
\ No newline at end of file
+from .document_type import (
+    CLASSIFY_MIN_CONFIDENCE, DOC_TYPES, UNKNOWN_TYPE, Classification,
+    classify_document, classify_by_keywords, classify_document_llm, refine_with_llm, normalize_doc_type
+)
+from .model import CLASSIFIER_MODEL_PATH, DocTypeModel, get_doc_type_model, train_model
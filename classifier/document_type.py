@@ -0,0 +1,131 @@
+"""
+Определение типа документа.
+
+Ключевые слова всех типов собраны в один шаблон: текст проходится один раз,
+каждое найденное слово добавляет свой вес своему типу (в заголовке — с множителем
+HEADER_WEIGHT). Уверенность — доля лучшего типа в сумме весов. Слова ищутся
+целиком: «факт» и «контакт» не считаются актом; «расчётный счёт» и ссылки
+на другие документы («по договору № …») не считаются вовсе.
+Если уверенность ниже CLASSIFY_MIN_CONFIDENCE, спрашивается обученная модель
+(classifier/model.py), и только если не уверена и она — LLM.
+"""
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict
+
+CLASSIFY_MIN_CONFIDENCE = float(os.getenv("CLASSIFY_MIN_CONFIDENCE", "0.6"))
+HEADER_CHARS = 300   # заголовок документа — первые символы текста
+HEADER_WEIGHT = 3.0  # слово в заголовке весит больше, чем упоминание в тексте
+UNKNOWN_TYPE = "иной"
+DOC_TYPES = ("упд", "счёт-фактура", "счёт", "акт", "накладная", "договор", UNKNOWN_TYPE)
+
+# (шаблон, тип, вес). Порядок важен: в одной позиции срабатывает первый шаблон,
+# поэтому длинные обороты стоят раньше слов, которые в них входят.
+# Тип None — оборот поглощается без веса («расчётный счёт» в реквизитах любого документа)
+KEYWORDS = [
+    (r"универсальн\w* передаточн\w* документ\w*", "упд", 5.0),
+    (r"упд", "упд", 4.0),
+    (r"сч[её]т[-\s]?фактур\w*", "счёт-фактура", 3.0),
+    (r"(?:расч[её]тн\w*|корреспондентск\w*|корр\.|лицев\w*|банковск\w*)\s+сч[её]т\w*", None, 0.0),
+    # Ссылки на другие документы: «по договору № …», «согласно акта»
+    (r"(?:по|к|согласно|на основании|основание:?)\s+(?:договор\w*|акт\w*|сч[её]т\w*)", None, 0.0),
+    (r"сч[её]т\w{0,2} на оплату", "счёт", 4.0),
+    (r"сч[её]т(?:а|у|ом|е)?", "счёт", 1.5),
+    (r"invoice", "счёт", 3.0),
+    (r"передаточн\w* акт\w*", "акт", 3.0),
+    (r"акт(?:а|у|ом|е|ы|ов)?", "акт", 2.0),
+    (r"товарн\w* накладн\w*|торг-12", "накладная", 4.0),
+    (r"накладн\w*", "накладная", 2.0),
+    (r"договор\w*|contract", "договор", 2.0),
+    (r"именуем\w*", "договор", 2.0),
+]
+KEYWORDS_RE = re.compile(
+    r"(?<!\w)(?:" + "|".join(f"(?P<k{i}>{pattern})" for i, (pattern, _, _) in enumerate(KEYWORDS)) + r")(?!\w)"
+)
+KEYWORD_TYPES = {f"k{i}": (doc_type, weight) for i, (_, doc_type, weight) in enumerate(KEYWORDS)}
+
+
+@dataclass
+class Classification:
+    """Тип документа, уверенность (0–1) и кто его определил: rules, model или llm"""
+    doc_type: str
+    confidence: float
+    source: str = "rules"
+    scores: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def uncertain(self) -> bool:
+        return self.confidence < CLASSIFY_MIN_CONFIDENCE
+
+    def to_dict(self) -> dict:
+        return {"doc_type": self.doc_type, "confidence": round(self.confidence, 3), "source": self.source}
+
+
+def normalize_doc_type(value: str) -> str:
+    """Приводит ответ LLM («Счет», «счёт-фактура.», «УПД») к одному из DOC_TYPES"""
+    value = (value or "").strip().lower().replace("ё", "е").strip(".,:;\"'«»")
+    for doc_type in DOC_TYPES:
+        if value == doc_type.replace("ё", "е"):
+            return doc_type
+    return UNKNOWN_TYPE
+
+
+def score_document_type(text: str) -> Dict[str, float]:
+    """Суммарные веса ключевых слов по типам за один проход по тексту"""
+    scores: Dict[str, float] = {}
+    for m in KEYWORDS_RE.finditer((text or "").lower()):
+        doc_type, weight = KEYWORD_TYPES[m.lastgroup]
+        if doc_type is None:
+            continue
+        if m.start() < HEADER_CHARS:
+            weight *= HEADER_WEIGHT
+        scores[doc_type] = scores.get(doc_type, 0.0) + weight
+    return scores
+
+
+def classify_by_keywords(text: str) -> Classification:
+    """Тип документа по ключевым словам с уверенностью; без совпадений — «иной» с нулевой уверенностью"""
+    scores = score_document_type(text)
+    if not scores:
+        return Classification(doc_type=UNKNOWN_TYPE, confidence=0.0, scores=scores)
+    doc_type = max(scores, key=scores.get)
+    confidence = scores[doc_type] / sum(scores.values())
+    return Classification(doc_type=doc_type, confidence=confidence, scores=scores)
+
+
+def classify_document(text: str) -> Classification:
+    """Ключевые слова, а если они не уверены — обученная модель (если она есть)"""
+    from .model import classify_with_model
+    return classify_with_model(text, classify_by_keywords(text))
+
+
+def classify_document_llm(text: str) -> str:
+    from extractor.ollama_client import query_ollama, CLASSIFY_PROMPT_TEMPLATE
+    prompt = CLASSIFY_PROMPT_TEMPLATE.format(text=text[:2000])
+    logging.info(f"Prompt to LLM for classification: {prompt}")
+    try:
+        response = query_ollama(prompt)
+        # Берём только первое слово из ответа
+        return normalize_doc_type(response.strip().split()[0])
+    except Exception as e:
+        logging.error(f"Error classifying document: {e}")
+        return UNKNOWN_TYPE
+
+
+def refine_with_llm(text: str, classification: Classification) -> Classification:
+    """
+    Уточняет неуверенную классификацию через LLM. Ответ LLM принимается с уверенностью
+    на пороге; если LLM не ответил или ответил «иной», остаётся тип по ключевым словам.
+    """
+    if not classification.uncertain:
+        return classification
+    doc_type = classify_document_llm(text)
+    logging.info(
+        f"[CLASSIFY] По ключевым словам: {classification.doc_type} ({classification.confidence:.2f}), LLM: {doc_type}"
+    )
+    if doc_type == UNKNOWN_TYPE:
+        return classification
+    return Classification(doc_type=doc_type, confidence=CLASSIFY_MIN_CONFIDENCE, source="llm",
+                          scores=classification.scores)
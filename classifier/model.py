@@ -0,0 +1,124 @@
+"""
+Обученная модель типа документа: TF-IDF по символьным n-граммам + логистическая регрессия.
+
+Обучается на сохранённых документах (documents.doc_type и их файлы) скриптом
+train_classifier.py и лежит рядом с индексом RAG (data/). Предсказание занимает
+доли миллисекунды на CPU, поэтому модель спрашивается раньше LLM: если ключевые
+слова не дали уверенного типа, а модель уверена — LLM не нужен.
+"""
+import logging
+import os
+import pickle
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+
+from .document_type import CLASSIFY_MIN_CONFIDENCE, Classification, normalize_doc_type
+
+CLASSIFIER_MODEL_PATH = os.getenv("CLASSIFIER_MODEL_PATH", "data/doc_type_model.pkl")  # пусто — модель не используется
+NGRAM_RANGE = (2, 5)
+MAX_FEATURES = 100_000
+MODEL_TEXT_CHARS = 2000  # как MAX_CHARS извлечения: модель видит тот же фрагмент, что и правила
+
+
+def build_pipeline():
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+    # char_wb: n-граммы внутри слов устойчивы к ошибкам OCR и падежным окончаниям
+    return make_pipeline(
+        TfidfVectorizer(analyzer="char_wb", ngram_range=NGRAM_RANGE, max_features=MAX_FEATURES,
+                        sublinear_tf=True, lowercase=True),
+        LogisticRegression(max_iter=1000, class_weight="balanced"),
+    )
+
+
+class DocTypeModel:
+    """Обученный классификатор и сведения об обучении"""
+
+    def __init__(self, pipeline, info: Optional[Dict] = None):
+        self.pipeline = pipeline
+        self.info = info or {}
+
+    @property
+    def labels(self) -> List[str]:
+        return list(self.pipeline.classes_)
+
+    def predict(self, text: str) -> Classification:
+        probabilities = self.pipeline.predict_proba([text[:MODEL_TEXT_CHARS]])[0]
+        scores = dict(zip(self.labels, (float(p) for p in probabilities)))
+        doc_type = max(scores, key=scores.get)
+        return Classification(doc_type=doc_type, confidence=scores[doc_type], source="model", scores=scores)
+
+    def predict_many(self, texts: Sequence[str]) -> List[str]:
+        return list(self.pipeline.predict([text[:MODEL_TEXT_CHARS] for text in texts]))
+
+    def save(self, path: str = CLASSIFIER_MODEL_PATH):
+        """Записывает модель атомарно: работающие воркеры не прочитают недописанный файл"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"pipeline": self.pipeline, "info": self.info}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str = CLASSIFIER_MODEL_PATH) -> "DocTypeModel":
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        return cls(data["pipeline"], data.get("info"))
+
+
+def train_model(texts: Sequence[str], labels: Sequence[str], info: Optional[Dict] = None) -> DocTypeModel:
+    pipeline = build_pipeline()
+    pipeline.fit([text[:MODEL_TEXT_CHARS] for text in texts], [normalize_doc_type(label) for label in labels])
+    info = dict(info or {})
+    info.update(samples=len(texts), trained_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+    return DocTypeModel(pipeline, info)
+
+
+_model: Optional[DocTypeModel] = None
+_model_mtime: Optional[float] = None
+_model_lock = threading.Lock()
+
+
+def get_doc_type_model() -> Optional[DocTypeModel]:
+    """
+    Модель текущего процесса или None, если она не обучена (или нет scikit-learn).
+    Файл перечитывается после переобучения (по времени изменения).
+    """
+    global _model, _model_mtime
+    if not CLASSIFIER_MODEL_PATH:
+        return None
+    try:
+        mtime = os.path.getmtime(CLASSIFIER_MODEL_PATH)
+    except OSError:
+        return None
+    with _model_lock:
+        if _model is None or _model_mtime != mtime:
+            try:
+                _model = DocTypeModel.load(CLASSIFIER_MODEL_PATH)
+                _model_mtime = mtime
+                logging.info(f"[CLASSIFY] Загружена модель типа документа: {_model.info}")
+            except Exception as e:
+                logging.error(f"[CLASSIFY] Модель типа документа недоступна: {e}")
+                _model, _model_mtime = None, mtime
+        return _model
+
+
+def classify_with_model(text: str, classification: Classification) -> Classification:
+    """Неуверенную классификацию по ключевым словам заменяет уверенный ответ модели"""
+    if not classification.uncertain:
+        return classification
+    model = get_doc_type_model()
+    if model is None:
+        return classification
+    try:
+        predicted = model.predict(text)
+    except Exception as e:
+        logging.error(f"[CLASSIFY] Ошибка модели типа документа: {e}")
+        return classification
+    logging.info(
+        f"[CLASSIFY] По ключевым словам: {classification.doc_type} ({classification.confidence:.2f}), "
+        f"модель: {predicted.doc_type} ({predicted.confidence:.2f})"
+    )
+    return predicted if predicted.confidence >= CLASSIFY_MIN_CONFIDENCE else classification
@@ -1,17 +1,23 @@
+import argparse
 import asyncio
 import logging
 import os
+import signal
 import uuid
 from datetime import datetime
 from typing import Dict, List, Optional, Callable
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 import json
 
-from extractor import extract_fields_from_text, process_file_with_classification, classify_document_universal
-from storage import storage
+from extractor import extract_fields_scored, extract_fields_llm, fields_for_llm, process_file_with_classification, release_document, get_ocr_stats, detect_bundle, split_bundle
+from classifier import Classification, refine_with_llm
+from storage import storage, compute_file_hash, task_queue as default_task_queue
+from storage.task_queue import PostgresTaskQueue, default_worker_id
+from extractor.archives import is_archive, iter_archive_members
 from validator import validator
 from rag import get_rag_index
+from execution import ExecutionLayer, get_execution_layer, set_execution_layer
 
 class ProcessingStatus(Enum):
     """Статусы обработки документа"""
@@ -36,15 +42,92 @@ class ProcessingTask:
     error: Optional[str] = None
     validation_errors: List[str] = None
     validation_warnings: List[str] = None
+    attempts: int = 0
+    content_hash: Optional[str] = None
+    # Промежуточные данные, передаваемые между этапами конвейера
+    stage: Optional[str] = None
+    text: Optional[str] = None
+    doc_type: Optional[str] = None
+    classification: Optional[Classification] = None
+    fields: Optional[Dict] = None
+    field_confidence: Optional[Dict[str, float]] = None
+    llm_fields: Optional[List[str]] = None  # поля, которые быстрый путь нашёл неуверенно
+    ocr_pages: Optional[List[Dict]] = None
+
+# Этапы конвейера обработки
+STAGE_EXTRACT = "extract"      # загрузка и извлечение текста
+STAGE_CLASSIFY = "classify"    # классификация и быстрый путь извлечения полей
+STAGE_LLM = "llm"              # LLM для полей, не найденных или неуверенных на быстром пути
+STAGE_STORE = "store"          # валидация и сохранение
+STAGE_INDEX = "index"          # индексация в RAG
+
+STAGE_QUEUE_SIZE = int(os.getenv("STAGE_QUEUE_SIZE", "10"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "2"))  # по числу параллельных слотов Ollama
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", "2"))  # пауза опроса пустой очереди, сек
+
+@dataclass
+class PipelineStage:
+    """Этап конвейера: своя ограниченная очередь и свой лимит параллельности"""
+    name: str
+    handler: Callable
+    concurrency: int
+    queue: asyncio.Queue = field(repr=False, default=None)
+
+def task_from_row(row: Dict) -> ProcessingTask:
+    """Создаёт ProcessingTask из строки таблицы processing_tasks"""
+    return ProcessingTask(
+        id=str(row['id']),
+        user_id=row['user_id'],
+        filename=row['filename'],
+        file_path=row['file_path'],
+        status=ProcessingStatus(row['status']),
+        created_at=row['created_at'],
+        started_at=row.get('started_at'),
+        completed_at=row.get('completed_at'),
+        result=row.get('result'),
+        error=row.get('error'),
+        validation_errors=row.get('validation_errors'),
+        validation_warnings=row.get('validation_warnings'),
+        attempts=row.get('attempts') or 0,
+        content_hash=row.get('content_hash')
+    )
 
 class DocumentProcessor:
-    """Асинхронный процессор документов"""
+    """Асинхронный процессор документов (конвейер этапов с ограниченными очередями)"""
     
-    def __init__(self, max_workers: int = 3):
+    def __init__(self, max_workers: int = 3, execution: Optional[ExecutionLayer] = None,
+                 stage_concurrency: Optional[Dict[str, int]] = None, queue_size: int = STAGE_QUEUE_SIZE,
+                 task_queue: Optional[PostgresTaskQueue] = None, worker_id: Optional[str] = None):
         self.max_workers = max_workers
-        self.task_queue = asyncio.Queue()
+        # Задачи хранятся в PostgreSQL: переживают рестарт и разбираются несколькими хостами
+        self.task_queue = task_queue or default_task_queue
+        self.worker_id = worker_id or default_worker_id()
+        # Блокирующие этапы выполняются в пулах, а не в event loop. Переданный слой становится
+        # слоем процесса: extractor (OCR, парсинг) берёт пул процессов из get_execution_layer()
+        self.execution = set_execution_layer(execution) if execution else get_execution_layer()
+        concurrency = {
+            STAGE_EXTRACT: max_workers,
+            STAGE_CLASSIFY: 1,
+            STAGE_LLM: LLM_CONCURRENCY,
+            STAGE_STORE: 2,
+            # FAISS-индекс сохраняется целиком на диск — только последовательно
+            STAGE_INDEX: 1,
+        }
+        concurrency.update(stage_concurrency or {})
+        handlers = {
+            STAGE_EXTRACT: self._stage_extract,
+            STAGE_CLASSIFY: self._stage_classify,
+            STAGE_LLM: self._stage_llm,
+            STAGE_STORE: self._stage_store,
+            STAGE_INDEX: self._stage_index,
+        }
+        # Очереди ограничены: при заполнении put() ждёт — это и есть backpressure до add_task
+        self.stages: Dict[str, PipelineStage] = {
+            name: PipelineStage(name, handler, max(1, concurrency[name]), asyncio.Queue(maxsize=queue_size))
+            for name, handler in handlers.items()
+        }
+        # Задачи, которые этот процесс сейчас обрабатывает (их аренда продлевается)
         self.active_tasks: Dict[str, ProcessingTask] = {}
-        self.completed_tasks: Dict[str, ProcessingTask] = {}
         self.workers: List[asyncio.Task] = []
         self.notification_callback: Optional[Callable] = None
         self.is_running = False
@@ -54,6 +137,11 @@ class DocumentProcessor:
             'total_processed': 0,
             'total_failed': 0,
             'total_validation_failed': 0,
+            'total_retried': 0,
+            'dedup_hits': 0,
+            'dedup_misses': 0,
+            'archives_expanded': 0,
+            'bundles_split': 0,
             'average_processing_time': 0.0
         }
     
@@ -61,20 +149,32 @@ class DocumentProcessor:
         """Устанавливает callback для уведомлений"""
         self.notification_callback = callback
     
+    async def queue_notification(self, user_id: int, message: str):
+        """Callback для отдельного воркера: уведомления отправляет процесс бота из общей очереди"""
+        try:
+            await self.execution.run_io(self.task_queue.push_notification, user_id, message)
+        except Exception as e:
+            logging.error(f"Не удалось поставить уведомление в очередь: {e}")
+    
     async def start(self):
         """Запускает процессор"""
         if self.is_running:
             return
         
         self.is_running = True
-        logging.info(f"Запуск DocumentProcessor с {self.max_workers} воркерами")
+        logging.info(f"Запуск DocumentProcessor: " + ", ".join(f"{s.name}={s.concurrency}" for s in self.stages.values()))
+        
+        # Запускаем воркеры каждого этапа
+        for stage in self.stages.values():
+            for i in range(stage.concurrency):
+                worker = asyncio.create_task(self._worker(stage, f"{stage.name}-{i}"))
+                self.workers.append(worker)
         
-        # Запускаем воркеры
-        for i in range(self.max_workers):
-            worker = asyncio.create_task(self._worker(f"worker-{i}"))
-            self.workers.append(worker)
+        # Забор задач из общей очереди и продление аренды
+        self.workers.append(asyncio.create_task(self._claim_loop()))
+        self.workers.append(asyncio.create_task(self._lease_loop()))
         
-        logging.info("DocumentProcessor запущен")
+        logging.info(f"DocumentProcessor запущен (воркер {self.worker_id})")
     
     async def stop(self):
         """Останавливает процессор"""
@@ -92,27 +192,20 @@ class DocumentProcessor:
         await asyncio.gather(*self.workers, return_exceptions=True)
         self.workers.clear()
         
+        # Останавливаем пулы исполнения
+        self.execution.shutdown(wait=False)
+        
         logging.info("DocumentProcessor остановлен")
     
     async def add_task(self, user_id: int, filename: str, file_path: str) -> str:
-        """Добавляет задачу в очередь"""
-        task_id = str(uuid.uuid4())
-        task = ProcessingTask(
-            id=task_id,
-            user_id=user_id,
-            filename=filename,
-            file_path=file_path,
-            status=ProcessingStatus.PENDING,
-            created_at=datetime.now()
-        )
-        
-        self.active_tasks[task_id] = task
-        await self.task_queue.put(task)
-        
-        logging.info(f"Добавлена задача {task_id} для пользователя {user_id}: {filename}")
+        """
+        Добавляет задачу в общую очередь PostgreSQL.
+        file_path должен быть доступен всем воркерам (общий том data/).
+        """
+        task_id, duplicate = await self._enqueue_file(user_id, filename, file_path)
         
         # Уведомляем о добавлении в очередь
-        if self.notification_callback:
+        if self.notification_callback and not duplicate:
             await self.notification_callback(
                 user_id, 
                 f"📋 Документ '{filename}' добавлен в очередь обработки (ID: {task_id[:8]})"
@@ -120,58 +213,180 @@ class DocumentProcessor:
         
         return task_id
     
+    async def _enqueue_file(self, user_id: int, filename: str, file_path: str, task_id: Optional[str] = None,
+                            content_hash: Optional[str] = None, notify_duplicate: bool = True):
+        """
+        Ставит файл в очередь или, если такой документ уже обработан, сразу завершает задачу.
+        Если тот же файл пользователя ещё в очереди или обрабатывается, новая задача не
+        создаётся: возвращается ID уже идущей задачи, результат придёт по ней.
+        Returns:
+            (task_id, True если файл оказался дубликатом)
+        """
+        task_id = task_id or str(uuid.uuid4())
+        
+        # Повторно присланный файл не обрабатываем: возвращаем сохранённый результат
+        duplicate = None
+        active = None
+        try:
+            if content_hash is None:
+                content_hash = await self.execution.run_io(compute_file_hash, file_path)
+            duplicate = await self.execution.run_io(storage.find_document_by_hash, content_hash)
+            if not duplicate:
+                # Документ ещё не сохранён, но тот же файл может быть в очереди (прислан дважды подряд)
+                active = await self.execution.run_io(
+                    self.task_queue.find_active_by_hash, user_id, content_hash, task_id
+                )
+        except Exception as e:
+            logging.warning(f"Не удалось проверить дубликат {filename}: {e}")
+        if duplicate:
+            await self._complete_duplicate(task_id, user_id, filename, file_path, content_hash, duplicate,
+                                           notify=notify_duplicate)
+            return task_id, True
+        if active:
+            return await self._attach_to_active(user_id, filename, file_path, active, notify=notify_duplicate), True
+        self.stats['dedup_misses'] += 1
+        
+        await self.execution.run_io(self.task_queue.enqueue, task_id, user_id, filename, file_path, content_hash)
+        
+        logging.info(f"Добавлена задача {task_id} для пользователя {user_id}: {filename}")
+        return task_id, False
+    
+    async def _complete_duplicate(self, task_id: str, user_id: int, filename: str, file_path: str,
+                                  content_hash: str, duplicate: Dict, notify: bool = True) -> str:
+        """Завершает задачу результатом ранее обработанного документа с тем же содержимым"""
+        self.stats['dedup_hits'] += 1
+        fields = duplicate['fields']
+        result = {
+            'doc_id': duplicate['doc_id'],
+            'fields': fields,
+            'processing_time': 0.0,
+            'duplicate': True
+        }
+        await self.execution.run_io(
+            self.task_queue.add_completed, task_id, user_id, filename, file_path, result, content_hash
+        )
+        
+        logging.info(f"Задача {task_id}: {filename} совпадает с документом {duplicate['doc_id']}")
+        
+        if self.notification_callback and notify:
+            await self.notification_callback(user_id, f"""
+♻️ Документ '{filename}' уже был обработан ранее (ID в базе: {duplicate['doc_id']})
+
+Сохранённые данные:
+- Тип: {fields['doc_type']}
+- Контрагент: {fields['counterparty']}
+- Номер: {fields['doc_number']}
+- Сумма: {fields['amount']}
+- Дата: {fields['date']}
+            """)
+        
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        except Exception as cleanup_error:
+            logging.warning(f"Не удалось удалить временный файл {file_path}: {cleanup_error}")
+        
+        return task_id
+    
+    async def _attach_to_active(self, user_id: int, filename: str, file_path: str, active: Dict,
+                                notify: bool = True) -> str:
+        """Присоединяет повторно присланный файл к задаче, которая уже обрабатывает то же содержимое"""
+        self.stats['dedup_hits'] += 1
+        active_id = str(active['id'])
+        logging.info(f"{filename} совпадает с незавершённой задачей {active_id} ({active['filename']})")
+        
+        if self.notification_callback and notify:
+            await self.notification_callback(
+                user_id,
+                f"⏳ Документ '{filename}' уже обрабатывается как '{active['filename']}' "
+                f"(ID: {active_id[:8]}), результат придёт по этой задаче"
+            )
+        
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        except Exception as cleanup_error:
+            logging.warning(f"Не удалось удалить временный файл {file_path}: {cleanup_error}")
+        
+        return active_id
+    
     async def get_task_status(self, task_id: str) -> Optional[ProcessingTask]:
         """Получает статус задачи"""
         if task_id in self.active_tasks:
             return self.active_tasks[task_id]
-        elif task_id in self.completed_tasks:
-            return self.completed_tasks[task_id]
-        return None
+        row = await self.execution.run_io(self.task_queue.get_task, task_id)
+        return task_from_row(row) if row else None
     
     async def get_user_tasks(self, user_id: int) -> List[ProcessingTask]:
-        """Получает все задачи пользователя"""
-        tasks = []
-        
-        # Активные задачи
-        for task in self.active_tasks.values():
-            if task.user_id == user_id:
-                tasks.append(task)
-        
-        # Завершенные задачи (последние 10)
-        user_completed = [t for t in self.completed_tasks.values() if t.user_id == user_id]
-        tasks.extend(sorted(user_completed, key=lambda x: x.completed_at, reverse=True)[:10])
-        
-        return tasks
+        """Получает незавершённые и последние 10 завершённых задач пользователя"""
+        rows = await self.execution.run_io(self.task_queue.get_user_tasks, user_id, 10)
+        return [self.active_tasks.get(str(row['id'])) or task_from_row(row) for row in rows]
     
-    async def _worker(self, worker_name: str):
-        """Воркер для обработки задач"""
+    async def _claim_loop(self):
+        """Забирает задачи из общей очереди, пока в первом этапе конвейера есть место"""
+        extract_queue = self.stages[STAGE_EXTRACT].queue
+        while self.is_running:
+            try:
+                free = extract_queue.maxsize - extract_queue.qsize()
+                if free <= 0:
+                    await asyncio.sleep(0.2)
+                    continue
+                rows = await self.execution.run_io(self.task_queue.claim, self.worker_id, free)
+                if not rows:
+                    await asyncio.sleep(TASK_POLL_INTERVAL)
+                    continue
+                for row in rows:
+                    task = task_from_row(row)
+                    self.active_tasks[task.id] = task
+                    await extract_queue.put(task)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Ошибка получения задач из очереди: {e}")
+                await asyncio.sleep(TASK_POLL_INTERVAL)
+    
+    async def _lease_loop(self):
+        """Продлевает аренду задач, которые ещё обрабатываются этим процессом"""
+        interval = max(1.0, self.task_queue.visibility_timeout / 3)
+        while self.is_running:
+            await asyncio.sleep(interval)
+            try:
+                await self.execution.run_io(self.task_queue.extend_lease, list(self.active_tasks), self.worker_id)
+            except Exception as e:
+                logging.error(f"Ошибка продления аренды задач: {e}")
+    
+    async def _worker(self, stage: PipelineStage, worker_name: str):
+        """Воркер этапа: берёт задачу из очереди этапа и передаёт её следующему"""
         logging.info(f"Воркер {worker_name} запущен")
         
         while self.is_running:
             try:
-                # Получаем задачу из очереди
-                task = await asyncio.wait_for(self.task_queue.get(), timeout=1.0)
-                
-                # Обрабатываем задачу
-                await self._process_task(task, worker_name)
-                
-                # Отмечаем задачу как выполненную
-                self.task_queue.task_done()
-                
+                task = await asyncio.wait_for(stage.queue.get(), timeout=1.0)
             except asyncio.TimeoutError:
                 continue
+            
+            try:
+                task.stage = stage.name
+                next_stage = await stage.handler(task)
+                # Если следующий этап переполнен, ждём — давление передаётся назад по конвейеру
+                if next_stage:
+                    await self.stages[next_stage].queue.put(task)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logging.error(f"Ошибка в воркере {worker_name}: {e}")
+                logging.error(f"Ошибка в воркере {worker_name} (задача {task.id}): {e}")
+                await self._fail_task(task, e)
+            finally:
+                stage.queue.task_done()
         
         logging.info(f"Воркер {worker_name} остановлен")
     
-    async def _process_task(self, task: ProcessingTask, worker_name: str):
-        """Обрабатывает одну задачу"""
-        start_time = datetime.now()
-        task.started_at = start_time
+    async def _stage_extract(self, task: ProcessingTask) -> Optional[str]:
+        """Этап 1: извлечение текста"""
+        task.started_at = datetime.now()
         task.status = ProcessingStatus.PROCESSING
         
-        logging.info(f"Воркер {worker_name} обрабатывает задачу {task.id}: {task.filename}")
+        logging.info(f"Обработка задачи {task.id}: {task.filename}")
         
         # Уведомляем о начале обработки
         if self.notification_callback:
@@ -180,84 +395,230 @@ class DocumentProcessor:
                 f"⚙️ Начата обработка документа '{task.filename}' (ID: {task.id[:8]})"
             )
         
-        try:
-            # Извлекаем текст из документа
-            text = process_file_with_classification(task.file_path)
-            if not text:
-                raise Exception("Не удалось извлечь текст из документа")
-
-            # Явно определяем тип документа
-            doc_type = classify_document_universal(text)
-            if self.notification_callback:
-                await self.notification_callback(task.user_id, f"Определён тип документа: {doc_type}")
-
-            # Извлекаем поля, передаём doc_type для контекстного поиска даты и других полей
-            rag_results = get_rag_index().search(text, top_k=3)
-            rag_context = [doc['text'] for doc in rag_results]
-            fields = extract_fields_from_text(text, rag_context=rag_context, doc_type=doc_type) if 'doc_type' in extract_fields_from_text.__code__.co_varnames else extract_fields_from_text(text, rag_context=rag_context)
-
-            if not fields:
-                raise Exception("Не удалось извлечь ключевые поля из документа")
+        # Архив не обрабатывается сам: его файлы становятся отдельными задачами
+        if is_archive(task.file_path):
+            await self._fan_out_archive(task)
+            return None
+        
+        # Пачка сканов из нескольких документов делится на задачи по документам
+        ranges = await self.execution.run_io(detect_bundle, task.file_path)
+        if len(ranges) > 1:
+            await self._fan_out_bundle(task, ranges)
+            return None
+        
+        # Извлекаем текст и определяем тип: оркестрация в потоке, парсинг и OCR страниц — в пуле процессов.
+        # Классификация выполняется здесь один раз и дальше передаётся с задачей
+        task.text, task.classification = await self.execution.run_io(process_file_with_classification, task.file_path)
+        if not task.text:
+            raise Exception("Не удалось извлечь текст из документа")
+        task.doc_type = task.classification.doc_type
+        # Разрешение и уверенность OCR по страницам сохраняются с результатом задачи
+        task.ocr_pages = await self.execution.run_io(get_ocr_stats, task.file_path)
+        return STAGE_CLASSIFY
+    
+    def _member_task_id(self, task: ProcessingTask, index: int) -> str:
+        """ID задачи части: детерминирован, поэтому повтор родительской задачи не дублирует части"""
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{task.id}/{index}"))
+    
+    async def _enqueue_parts(self, task: ProcessingTask, parts) -> List[Dict]:
+        """
+        Ставит части задачи (файлы архива, документы пачки) в общую очередь по мере получения.
+        Часть без файла (file_path None) уже в очереди с прошлой попытки и только попадает в список.
+        """
+        queued = []
+        while True:
+            # Получение следующей части — блокирующее чтение, выполняется в пуле потоков
+            part = await self.execution.run_io(next, parts, None)
+            if part is None:
+                break
+            index, filename, file_path, content_hash = part
+            if file_path is None:
+                # Часть поставлена в очередь при прошлой попытке — в списке частей она остаётся
+                queued.append({'filename': filename, 'task_id': self._member_task_id(task, index),
+                               'duplicate': False, 'already_queued': True})
+                continue
+            task_id, duplicate = await self._enqueue_file(
+                task.user_id, filename, file_path, task_id=self._member_task_id(task, index),
+                content_hash=content_hash, notify_duplicate=False
+            )
+            queued.append({'filename': filename, 'task_id': task_id, 'duplicate': duplicate})
+        return queued
+    
+    def _complete_fan_out(self, task: ProcessingTask, kind: str, queued: List[Dict], message: str) -> str:
+        """Помечает родительскую задачу выполненной (результат — список частей) и дополняет итоговое сообщение"""
+        task.status = ProcessingStatus.COMPLETED
+        task.completed_at = datetime.now()
+        task.result = {
+            kind: True,
+            'members': queued,
+            'processing_time': (task.completed_at - task.started_at).total_seconds()
+        }
+        duplicates = sum(1 for item in queued if item['duplicate'])
+        message += f": в очередь поставлено документов — {len(queued) - duplicates}"
+        requeued = sum(1 for item in queued if item.get('already_queued'))
+        if requeued:
+            message += f" (из них при прошлой попытке — {requeued})"
+        if duplicates:
+            message += f", уже обработаны ранее — {duplicates}"
+        return message
+    
+    async def _fan_out_archive(self, task: ProcessingTask):
+        """
+        Читает ZIP по одному файлу и сразу ставит каждый в общую очередь:
+        их разбирают все воркеры параллельно, пока архив ещё дочитывается.
+        """
+        skipped: List[str] = []
+        members = iter_archive_members(
+            task.file_path, os.path.dirname(task.file_path) or ".", task.id[:8], skipped,
+            already_queued=lambda index: self.task_queue.get_task(self._member_task_id(task, index)) is not None
+        )
+        parts = ((m.index, m.filename, m.file_path, m.content_hash) for m in members)
+        queued = await self._enqueue_parts(task, parts)
+        message = self._complete_fan_out(task, 'archive', queued, f"📦 Архив '{task.filename}'")
+        task.result['skipped'] = skipped
+        self.stats['archives_expanded'] += 1
+        logging.info(f"Архив {task.filename}: в очередь {len(queued)} файлов, пропущено {len(skipped)}")
+        
+        if self.notification_callback:
+            if skipped:
+                message += f"\nПропущены (неподдерживаемый формат или слишком большой размер): {', '.join(skipped[:10])}"
+                if len(skipped) > 10:
+                    message += f" и ещё {len(skipped) - 10}"
+            await self.notification_callback(task.user_id, message)
+        
+        await self._finish_task(task)
+    
+    async def _fan_out_bundle(self, task: ProcessingTask, ranges: List):
+        """Делит PDF из нескольких документов на отдельные PDF и ставит каждый в очередь"""
+        # При повторе задачи уже поставленные в очередь документы не пересохраняются
+        indices = []
+        for i in range(len(ranges)):
+            if await self.execution.run_io(self.task_queue.get_task, self._member_task_id(task, i)) is None:
+                indices.append(i)
+        paths = await self.execution.run_io(
+            split_bundle, task.file_path, [ranges[i] for i in indices],
+            os.path.dirname(task.file_path) or ".", task.id[:8], indices
+        )
+        stem = os.path.splitext(task.filename)[0]
+        # Документы, поставленные в очередь при прошлой попытке, идут в список частей без файла
+        split_paths = dict(zip(indices, paths))
+        parts = iter([
+            (i, f"{stem} (стр. {start + 1}–{end}).pdf", split_paths.get(i), None)
+            for i, (start, end) in enumerate(ranges)
+        ])
+        queued = await self._enqueue_parts(task, parts)
+        message = self._complete_fan_out(task, 'bundle', queued, f"📑 Файл '{task.filename}' разделён на документы (найдено: {len(ranges)})")
+        task.result['ranges'] = [[start + 1, end] for start, end in ranges]
+        self.stats['bundles_split'] += 1
+        
+        if self.notification_callback:
+            await self.notification_callback(task.user_id, message)
+        
+        await self._finish_task(task)
+    
+    async def _stage_classify(self, task: ProcessingTask) -> Optional[str]:
+        """Этап 2: быстрый путь извлечения полей по типу, определённому при извлечении текста"""
+        if task.classification.uncertain:
+            # Тип уточняет LLM — на этапе LLM, с его ограничением параллельности
+            return STAGE_LLM
+        return await self._fast_path(task)
+    
+    async def _fast_path(self, task: ProcessingTask) -> Optional[str]:
+        if self.notification_callback:
+            await self.notification_callback(task.user_id, f"Определён тип документа: {task.doc_type}")
+        
+        # Поиск полей по всему тексту — в пуле потоков, чтобы не блокировать цикл событий
+        task.fields, task.field_confidence = await self.execution.run_io(
+            extract_fields_scored, task.text, doc_type=task.doc_type
+        )
+        task.llm_fields = fields_for_llm(task.field_confidence, task.doc_type)
+        if not task.llm_fields:
+            return STAGE_STORE
+        return STAGE_LLM
+    
+    async def _stage_llm(self, task: ProcessingTask) -> Optional[str]:
+        """Этап 3: LLM для неуверенно классифицированных документов и неуверенных полей быстрого пути"""
+        if task.fields is None:
+            # Сюда пришли с этапа классификации: сначала уточняем тип, затем быстрый путь
+            task.classification = await self.execution.run_io(refine_with_llm, task.text, task.classification)
+            task.doc_type = task.classification.doc_type
+            next_stage = await self._fast_path(task)
+            if next_stage != STAGE_LLM:
+                return next_stage
+        rag_results = await self.execution.run_io(get_rag_index().search, task.text, top_k=3)
+        rag_context = [doc['text'] for doc in rag_results]
+        # Запросы к Ollama блокирующие — выполняем в пуле потоков
+        task.fields = await self.execution.run_io(
+            extract_fields_llm, task.text, task.fields, rag_context=rag_context, doc_type=task.doc_type,
+            fields=task.llm_fields
+        )
+        return STAGE_STORE
+    
+    async def _stage_store(self, task: ProcessingTask) -> Optional[str]:
+        """Этап 4: валидация и сохранение"""
+        fields = task.fields
+        if not fields:
+            raise Exception("Не удалось извлечь ключевые поля из документа")
 
-            # Добавляем тип документа и упорядочиваем поля
-            fields['doc_type'] = doc_type
-            ordered_fields = {
-                'doc_type': fields['doc_type'],
-                'counterparty': fields['counterparty'],
-                'inn': fields['inn'],
-                'doc_number': fields['doc_number'],
-                'date': fields['date'],
-                'amount': fields['amount'],
-                'subject': fields['subject'],
-                'contract_number': fields['contract_number']
-            }
+        # Добавляем тип документа и упорядочиваем поля
+        fields['doc_type'] = task.doc_type
+        ordered_fields = {
+            'doc_type': fields['doc_type'],
+            'counterparty': fields['counterparty'],
+            'inn': fields['inn'],
+            'doc_number': fields['doc_number'],
+            'date': fields['date'],
+            'amount': fields['amount'],
+            'subject': fields['subject'],
+            'contract_number': fields['contract_number']
+        }
 
-            # Валидируем данные с учётом типа документа
-            is_valid, errors, warnings = validator.validate_document_data(ordered_fields, doc_type=doc_type)
-            task.validation_errors = errors
-            task.validation_warnings = warnings
-            
-            if not is_valid:
-                task.status = ProcessingStatus.VALIDATION_FAILED
-                task.error = f"Ошибки валидации: {', '.join(errors)}"
-                task.result = ordered_fields
-                
-                # Уведомляем об ошибках валидации
-                if self.notification_callback:
-                    validation_message = f"❌ Ошибки валидации документа '{task.filename}':\n\n"
-                    for error in errors:
-                        validation_message += f"- {error}\n"
-                    if warnings:
-                        validation_message += "\n⚠️ Предупреждения:\n"
-                        for warning in warnings:
-                            validation_message += f"- {warning}\n"
-                    await self.notification_callback(task.user_id, validation_message)
-                
-                self.stats['total_validation_failed'] += 1
-                return
-            
-            # Сохраняем документ в базу данных
-            doc_id = storage.save_document(task.file_path, ordered_fields, task.user_id)
-            
-            # Индексируем документ
-            try:
-                doc_text = " ".join(str(v) for v in ordered_fields.values() if v)
-                get_rag_index().add_document(str(doc_id), doc_text, meta=ordered_fields)
-            except Exception as e:
-                logging.warning(f"RAG indexing failed: {e}")
-            
-            # Завершаем задачу
-            task.status = ProcessingStatus.COMPLETED
-            task.completed_at = datetime.now()
-            task.result = {
-                'doc_id': doc_id,
-                'fields': ordered_fields,
-                'processing_time': (task.completed_at - start_time).total_seconds()
-            }
+        # Валидируем данные с учётом типа документа
+        is_valid, errors, warnings = validator.validate_document_data(ordered_fields, doc_type=task.doc_type)
+        task.validation_errors = errors
+        task.validation_warnings = warnings
+        
+        if not is_valid:
+            task.status = ProcessingStatus.VALIDATION_FAILED
+            task.error = f"Ошибки валидации: {', '.join(errors)}"
+            task.result = ordered_fields
             
-            # Уведомляем об успешном завершении
+            # Уведомляем об ошибках валидации
             if self.notification_callback:
-                success_message = f"""
+                validation_message = f"❌ Ошибки валидации документа '{task.filename}':\n\n"
+                for error in errors:
+                    validation_message += f"- {error}\n"
+                if warnings:
+                    validation_message += "\n⚠️ Предупреждения:\n"
+                    for warning in warnings:
+                        validation_message += f"- {warning}\n"
+                await self.notification_callback(task.user_id, validation_message)
+            
+            self.stats['total_validation_failed'] += 1
+            await self._finish_task(task)
+            return None
+        
+        # Сохраняем документ в базу данных
+        doc_id = await self.execution.run_io(
+            storage.save_document, task.file_path, ordered_fields, task.user_id, content_hash=task.content_hash
+        )
+        
+        # Завершаем задачу
+        task.status = ProcessingStatus.COMPLETED
+        task.completed_at = datetime.now()
+        task.result = {
+            'doc_id': doc_id,
+            'fields': ordered_fields,
+            'processing_time': (task.completed_at - task.started_at).total_seconds(),
+            'ocr_pages': task.ocr_pages or [],
+            'classification': task.classification.to_dict() if task.classification else None,
+            'field_confidence': task.field_confidence or {},
+            'llm_fields': task.llm_fields or []
+        }
+        
+        # Уведомляем об успешном завершении
+        if self.notification_callback:
+            success_message = f"""
 ✅ Документ '{task.filename}' успешно обработан!
 
 Извлеченные данные:
@@ -268,29 +629,57 @@ class DocumentProcessor:
 - Дата: {ordered_fields['date']}
 
 ID в базе: {doc_id}
-Время обработки: {(task.completed_at - start_time).total_seconds():.1f} сек
-                """
-                
-                if warnings:
-                    success_message += "\n⚠️ Предупреждения:\n"
-                    for warning in warnings:
-                        success_message += f"- {warning}\n"
-                
-                await self.notification_callback(task.user_id, success_message)
+Время обработки: {task.result['processing_time']:.1f} сек
+            """
             
-            self.stats['total_processed'] += 1
+            if warnings:
+                success_message += "\n⚠️ Предупреждения:\n"
+                for warning in warnings:
+                    success_message += f"- {warning}\n"
             
+            await self.notification_callback(task.user_id, success_message)
+        
+        self.stats['total_processed'] += 1
+        await self._finish_task(task)
+        return STAGE_INDEX
+    
+    async def _stage_index(self, task: ProcessingTask) -> Optional[str]:
+        """Этап 5: индексация документа в RAG (ошибки не влияют на результат задачи)"""
+        try:
+            ordered_fields = task.result['fields']
+            doc_text = " ".join(str(v) for v in ordered_fields.values() if v)
+            await self.execution.run_io(get_rag_index().add_document, str(task.result['doc_id']), doc_text, meta=ordered_fields)
         except Exception as e:
-            # Обрабатываем ошибку
-            task.status = ProcessingStatus.FAILED
-            task.completed_at = datetime.now()
-            task.error = str(e)
-            
-            logging.error(f"Ошибка обработки задачи {task.id}: {e}")
-            
-            # Уведомляем об ошибке
-            if self.notification_callback:
-                error_message = f"""
+            logging.warning(f"RAG indexing failed: {e}")
+        return None
+    
+    async def _fail_task(self, task: ProcessingTask, e: Exception):
+        """Возвращает задачу в очередь на повтор или, если попытки исчерпаны, помечает проваленной"""
+        task.error = str(e)
+        logging.error(f"Ошибка обработки задачи {task.id} (попытка {task.attempts}): {e}")
+        
+        try:
+            status = await self.execution.run_io(self.task_queue.retry, task.id, self.worker_id, task.error)
+        except Exception as queue_error:
+            # Аренда истечёт, и задачу заберут повторно
+            logging.error(f"Не удалось вернуть задачу {task.id} в очередь: {queue_error}")
+            status = 'pending'
+        # None: аренда истекла, задачей и её файлом уже занимается другой воркер
+        if status != 'failed':
+            if status == 'pending':
+                self.stats['total_retried'] += 1
+            task.text = None
+            # Повтор может достаться другому воркеру: разобранные страницы здесь больше не нужны
+            release_document(task.file_path)
+            self.active_tasks.pop(task.id, None)
+            return
+        
+        task.status = ProcessingStatus.FAILED
+        task.completed_at = datetime.now()
+        
+        # Уведомляем об ошибке
+        if self.notification_callback:
+            error_message = f"""
 ❌ Ошибка обработки документа '{task.filename}':
 
 Причина: {str(e)}
@@ -299,42 +688,101 @@ ID в базе: {doc_id}
 - Проверьте качество изображения/PDF
 - Убедитесь, что документ читаемый
 - Попробуйте отправить документ позже
-                """
-                
-                await self.notification_callback(task.user_id, error_message)
+            """
             
-            self.stats['total_failed'] += 1
+            await self.notification_callback(task.user_id, error_message)
         
-        finally:
-            # Перемещаем задачу в завершенные
-            self.completed_tasks[task.id] = task
-            if task.id in self.active_tasks:
-                del self.active_tasks[task.id]
-            
-            # Очищаем временный файл
+        self.stats['total_failed'] += 1
+        await self._finish_task(task, persist=False)
+    
+    async def _finish_task(self, task: ProcessingTask, persist: bool = True):
+        """Фиксирует финальный статус задачи в очереди, удаляет временный файл и обновляет статистику"""
+        # Промежуточные данные этапов больше не нужны
+        task.text = None
+        release_document(task.file_path)
+        
+        if persist:
             try:
-                if os.path.exists(task.file_path):
-                    os.remove(task.file_path)
-            except Exception as cleanup_error:
-                logging.warning(f"Не удалось удалить временный файл {task.file_path}: {cleanup_error}")
-            
-            # Обновляем статистику
-            if task.status == ProcessingStatus.COMPLETED:
-                processing_time = (task.completed_at - start_time).total_seconds()
-                total_processed = self.stats['total_processed']
-                current_avg = float(self.stats['average_processing_time'])
-                processing_time = float(processing_time)
-                self.stats['average_processing_time'] = (current_avg * (total_processed - 1) + processing_time) / total_processed
+                owned = await self.execution.run_io(
+                    self.task_queue.complete, task.id, self.worker_id, task.status.value, result=task.result,
+                    error=task.error, validation_errors=task.validation_errors,
+                    validation_warnings=task.validation_warnings
+                )
+            except Exception as e:
+                logging.error(f"Не удалось сохранить статус задачи {task.id}: {e}")
+                owned = True
+            if not owned:
+                # Аренда истекла: задачу обрабатывает другой воркер, его файл не трогаем
+                self.active_tasks.pop(task.id, None)
+                return
+        self.active_tasks.pop(task.id, None)
+        
+        # Очищаем временный файл
+        try:
+            if os.path.exists(task.file_path):
+                os.remove(task.file_path)
+        except Exception as cleanup_error:
+            logging.warning(f"Не удалось удалить временный файл {task.file_path}: {cleanup_error}")
+        
+        # Обновляем статистику
+        if task.status == ProcessingStatus.COMPLETED and not (task.result.get('archive') or task.result.get('bundle')):
+            processing_time = float(task.result['processing_time'])
+            total_processed = self.stats['total_processed']
+            current_avg = float(self.stats['average_processing_time'])
+            self.stats['average_processing_time'] = (current_avg * (total_processed - 1) + processing_time) / total_processed
     
     def get_stats(self) -> Dict:
         """Получает статистику процессора"""
         return {
             **self.stats,
             'active_tasks': len(self.active_tasks),
-            'completed_tasks': len(self.completed_tasks),
-            'queue_size': self.task_queue.qsize(),
-            'workers': len(self.workers)
+            'worker_id': self.worker_id,
+            'queue_size': sum(stage.queue.qsize() for stage in self.stages.values()),
+            'stages': {
+                stage.name: {
+                    'queue_size': stage.queue.qsize(),
+                    'queue_limit': stage.queue.maxsize,
+                    'concurrency': stage.concurrency
+                }
+                for stage in self.stages.values()
+            },
+            'workers': len(self.workers),
+            'cpu_workers': self.execution.cpu_workers,
+            'io_workers': self.execution.io_workers
         }
 
 # Глобальный экземпляр процессора
-processor = DocumentProcessor() 
\ No newline at end of file
+processor = DocumentProcessor()
+
+
+async def run_worker(concurrency: int, cpu_workers: Optional[int] = None):
+    """Запускает отдельный воркер: забирает задачи из общей очереди до SIGINT/SIGTERM"""
+    worker = DocumentProcessor(max_workers=concurrency, execution=ExecutionLayer(cpu_workers=cpu_workers))
+    worker.set_notification_callback(worker.queue_notification)
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    await worker.start()
+    await stop_event.wait()
+    # Незавершённые задачи вернутся в очередь по истечении аренды
+    await worker.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воркер обработки документов")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker_parser = subparsers.add_parser("worker", help="обрабатывать задачи из общей очереди PostgreSQL")
+    worker_parser.add_argument("--concurrency", type=int, default=3, help="параллельных задач на этапе извлечения текста")
+    worker_parser.add_argument("--cpu-workers", type=int, default=None, help="процессов для OCR/pdfplumber (по умолчанию CPU_WORKERS или число ядер)")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "worker":
+        asyncio.run(run_worker(args.concurrency, args.cpu_workers))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,8 @@ import json
 
 # Импорты для обработки документов (без storage)
 try:
-    from extractor import extract_fields_from_text, process_file_with_classification, classify_document_universal
+    from extractor import extract_fields_from_text, process_file_with_classification
+    from classifier import refine_with_llm
     from validator import validator
     EXTRACTOR_AVAILABLE = True
 except ImportError as e:
@@ -265,15 +266,17 @@ class DocumentProcessor:
             else:
                 # Реальная обработка с extractor
                 # Извлекаем текст из документа
-                text = process_file_with_classification(task.file_path)
+                # Извлекаем текст и тип документа
+                text, classification = process_file_with_classification(task.file_path)
                 if not text:
                     raise Exception("Не удалось извлечь текст из документа")
-                
-                # Определяем тип документа
-                doc_type = classify_document_universal(text)
+                if classification.uncertain:
+                    # Ключевые слова и модель не уверены в типе — уточняем у LLM
+                    classification = refine_with_llm(text, classification)
+                doc_type = classification.doc_type
                 
                 # Извлекаем поля
-                fields = extract_fields_from_text(text)
+                fields = extract_fields_from_text(text, doc_type=doc_type)
                 if not fields:
                     raise Exception("Не удалось извлечь ключевые поля из документа")
                 
@@ -0,0 +1,107 @@
+"""
+Слой исполнения блокирующих этапов обработки документов.
+
+CPU-bound этапы (pdfplumber, OpenCV, Tesseract) уходят в пул процессов,
+I/O-bound этапы (Ollama, PostgreSQL, копирование файлов) — в пул потоков.
+Event loop (и polling Telegram) при этом остаётся свободным.
+"""
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", "0"))  # 0 — по числу воркеров процессора/ядер
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+# spawn безопаснее fork для процесса с потоками (psycopg2, torch)
+CPU_POOL_START_METHOD = os.getenv("CPU_POOL_START_METHOD", "spawn")
+
+
+def in_worker_process() -> bool:
+    """True, если код выполняется внутри дочернего процесса пула"""
+    return multiprocessing.parent_process() is not None
+
+
+class ExecutionLayer:
+    """Пулы исполнения для CPU- и I/O-bound этапов"""
+
+    def __init__(self, cpu_workers: Optional[int] = None, io_workers: Optional[int] = None):
+        self.cpu_workers = cpu_workers or CPU_WORKERS or (os.cpu_count() or 2)
+        self.io_workers = io_workers or IO_WORKERS
+        self._cpu_pool: Optional[ProcessPoolExecutor] = None
+        self._io_pool: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def cpu_pool(self) -> ProcessPoolExecutor:
+        # Пулы создаются лениво, чтобы импорт модуля не порождал процессы
+        if self._cpu_pool is None:
+            ctx = multiprocessing.get_context(CPU_POOL_START_METHOD)
+            self._cpu_pool = ProcessPoolExecutor(max_workers=self.cpu_workers, mp_context=ctx)
+            logging.info(f"Создан пул процессов: {self.cpu_workers} ({CPU_POOL_START_METHOD})")
+        return self._cpu_pool
+
+    @property
+    def io_pool(self) -> ThreadPoolExecutor:
+        if self._io_pool is None:
+            self._io_pool = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="io")
+            logging.info(f"Создан пул потоков: {self.io_workers}")
+        return self._io_pool
+
+    def submit_cpu(self, func: Callable, *args, **kwargs) -> Future:
+        """
+        Отправляет CPU-bound функцию в пул процессов из синхронного кода.
+        Внутри дочернего процесса выполняет её на месте, не порождая вложенных пулов.
+        """
+        if in_worker_process():
+            future: Future = Future()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self.cpu_pool.submit(func, *args, **kwargs)
+
+    def call_cpu(self, func: Callable, *args, **kwargs):
+        """Выполняет CPU-bound функцию в пуле процессов и ждёт результата (для синхронного кода)"""
+        return self.submit_cpu(func, *args, **kwargs).result()
+
+    async def run_io(self, func: Callable, *args, **kwargs):
+        """Выполняет блокирующую I/O-функцию в пуле потоков"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.io_pool, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True):
+        """Останавливает пулы"""
+        if self._cpu_pool is not None:
+            self._cpu_pool.shutdown(wait=wait, cancel_futures=True)
+            self._cpu_pool = None
+        if self._io_pool is not None:
+            self._io_pool.shutdown(wait=wait, cancel_futures=True)
+            self._io_pool = None
+
+
+# Ленивая инициализация singleton
+_execution_layer = None
+
+
+def get_execution_layer() -> ExecutionLayer:
+    global _execution_layer
+    if _execution_layer is None:
+        _execution_layer = ExecutionLayer()
+    return _execution_layer
+
+
+def set_execution_layer(layer: ExecutionLayer) -> ExecutionLayer:
+    """
+    Делает layer слоем исполнения процесса: extractor отправляет CPU-bound работу
+    в get_execution_layer(), поэтому настройки воркера (--cpu-workers) задаются здесь.
+    Прежний слой, если он уже создал пулы, останавливается.
+    """
+    global _execution_layer
+    if _execution_layer is not None and _execution_layer is not layer:
+        _execution_layer.shutdown(wait=False)
+    _execution_layer = layer
+    return layer
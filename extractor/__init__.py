@@ -1,88 +1,41 @@
-from .ollama_client import query_ollama, EXTRACTION_PROMPT_TEMPLATE, CLASSIFY_PROMPT_TEMPLATE, ROLE_PROMPT_TEMPLATE, OUR_COMPANY
+from .ollama_client import query_ollama, LLM_MAX_IN_FLIGHT, EXTRACTION_PROMPT_TEMPLATE, CLASSIFY_PROMPT_TEMPLATE
+from .ocr import ocr_pdf_pages, ocr_image_file, OCR_FIELDS_ONLY
+from .document import PdfDocument, load_document, release_document, read_xlsx_text, pdf_page_count
+from .splitter import SPLIT_BUNDLES, split_ranges, write_pdf_parts
+from .scanner import (
+    DATE_KEYWORDS, INN_KEYWORDS, INN_CONTEXT, DOC_NUMBER_KEYWORDS,
+    clean_text, scan_text, find_counterparty, find_contract_number
+)
+from .excerpts import plan_excerpt_windows
+from .confidence import (
+    low_confidence_fields, inn_confidence, date_confidence, amount_confidence,
+    doc_number_confidence, counterparty_confidence, contract_number_confidence
+)
+from classifier import Classification, classify_document
+from execution import get_execution_layer
 import json
 import logging
+import os
 import re
-from io import BytesIO
-from typing import Optional
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
 
 MAX_CHARS = 2000  # Максимальная длина текста для LLM (уменьшено для ускорения)
 OVERLAP = 500     # Перекрытие между окнами (уменьшено)
-
-# --- Классификация типа документа через LLM ---
-# CLASSIFY_PROMPT_TEMPLATE теперь импортируется из ollama_client.py
-
-def classify_document_llm(text: str) -> str:
-    prompt = CLASSIFY_PROMPT_TEMPLATE.format(text=text[:2000])
-    logging.info(f"Prompt to LLM for classification: {prompt}")
-    try:
-        response = query_ollama(prompt)
-        # Берём только первое слово из ответа
-        doc_type = response.strip().split()[0].lower()
-        return doc_type
-    except Exception as e:
-        logging.error(f"Error classifying document: {e}")
-        return "иной"
+LLM_MAX_WINDOWS = 10
 
 # --- Извлечение текста для разных типов документов ---
-def extract_full_text_from_pdf(file_path):
+def extract_full_text_from_pdf(file_path, max_chars=None, fields_only=False):
+    """
+    Текст PDF; если текстового слоя нет — OCR страниц.
+    max_chars: ленивый режим — страницы читаются и распознаются по порядку,
+    пока не наберётся max_chars символов (для классификации и быстрого пути).
+    fields_only: на сканах распознавать только шапку, реквизиты и итоги.
+    """
     try:
-        import pdfplumber
-        with pdfplumber.open(file_path) as pdf:
-            text = "\n".join(page.extract_text() or "" for page in pdf.pages)
-            logging.info(f"[PDF] Извлечённый текст (первые 200 символов): {text[:200]}")
-            if text.strip():
-                return text
-            # Если текст пустой — пробуем OCR
-            logging.info("[PDF] Текст не найден, пробую OCR для сканированного PDF...")
-            from PIL import Image
-            import pytesseract
-            import cv2
-            import numpy as np
-            import traceback
-            import subprocess
-            import os
-            ocr_text = ""
-            for i, page in enumerate(pdf.pages):
-                img = page.to_image(resolution=400).original
-                buf = BytesIO()
-                img.save(buf, format='PNG')
-                buf.seek(0)
-                pil_img = Image.open(buf)
-                img_array = np.array(pil_img)
-                if len(img_array.shape) == 3:
-                    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-                else:
-                    gray = img_array
-                clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-                gray = clahe.apply(gray)
-                gray = cv2.medianBlur(gray, 3)
-                enhanced_img = Image.fromarray(gray)
-                # Сохраняем PNG для диагностики
-                png_path = f"/tmp/ocr_page_{i+1}.png"
-                enhanced_img.save(png_path)
-                logging.info(f"[PDF][OCR] Saved {png_path} for manual OCR test")
-                custom_config = r'--oem 3 --psm 6'
-                logging.info(f"[PDF][OCR] config: {custom_config}")
-                try:
-                    # Сначала пробуем pytesseract
-                    page_text = pytesseract.image_to_string(enhanced_img, lang='rus', config=custom_config)
-                except Exception as ocr_e:
-                    logging.error(f"[PDF][OCR] Ошибка pytesseract: {ocr_e}")
-                    logging.error(traceback.format_exc())
-                    # Пробуем через subprocess
-                    try:
-                        result = subprocess.run([
-                            'tesseract', png_path, 'stdout', '-l', 'rus', '--oem', '3', '--psm', '6'
-                        ], capture_output=True, text=True)
-                        logging.error(f"[PDF][OCR][subprocess] stderr: {result.stderr}")
-                        page_text = result.stdout
-                    except Exception as sub_e:
-                        logging.error(f"[PDF][OCR][subprocess] Ошибка: {sub_e}")
-                        logging.error(traceback.format_exc())
-                        page_text = ''
-                ocr_text += page_text + "\n"
-            logging.info(f"[PDF][OCR] Извлечённый текст (первые 200 символов): {ocr_text[:200]}")
-            return ocr_text.strip()
+        text = load_document(file_path).text(max_chars, fields_only)
+        logging.info(f"[PDF] Извлечённый текст (первые 200 символов): {text[:200]}")
+        return text
     except Exception as e:
         import traceback
         logging.error(f"[PDF] Ошибка при извлечении текста: {e}")
@@ -91,96 +44,67 @@ def extract_full_text_from_pdf(file_path):
 
 def extract_text_from_pdf_contract(file_path):
     try:
-        with pdfplumber.open(file_path) as pdf:
-            first_page_text = pdf.pages[0].extract_text() or ""
-            requisites_text = ""
-            for page in pdf.pages:
-                text = page.extract_text() or ""
-                if "реквизит" in text.lower():
-                    requisites_text += text + "\n"
-            return (first_page_text + "\n" + requisites_text).strip()
+        return load_document(file_path).contract_text()
     except Exception:
         return ""
 
-def extract_full_text_from_docx(file_path):
+def extract_full_text_from_docx(file_path, max_chars=None):
+    """max_chars: остановиться, как только из абзацев набрано столько символов"""
     try:
-        from docx import Document
-        doc = Document(file_path)
-        return "\n".join([p.text for p in doc.paragraphs if p.text.strip()])
+        return load_document(file_path).text(max_chars)
     except Exception:
         return ""
 
 def extract_text_from_docx_contract(file_path):
     try:
-        from docx import Document
-        doc = Document(file_path)
-        first_paragraphs = [p.text for p in doc.paragraphs[:20] if p.text.strip()]
-        requisites = [p.text for p in doc.paragraphs if "реквизит" in p.text.lower()]
-        return ("\n".join(first_paragraphs) + "\n" + "\n".join(requisites)).strip()
+        return load_document(file_path).contract_text()
     except Exception:
         return ""
 
-def extract_text_from_jpg(file_path):
+def extract_text_from_xlsx(file_path, max_chars=None):
+    """Текст XLSX (потоковое чтение в пуле процессов)"""
     try:
-        from PIL import Image
-        import pytesseract
-        import cv2
-        import numpy as np
-        import traceback
-        pil_img = Image.open(file_path)
-        img_array = np.array(pil_img)
-        if len(img_array.shape) == 3:
-            gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-        else:
-            gray = img_array
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
-        gray = clahe.apply(gray)
-        gray = cv2.medianBlur(gray, 3)
-        enhanced_img = Image.fromarray(gray)
-        custom_config = r'--oem 3 --psm 6'
-        logging.info(f"[JPG][OCR] config: {custom_config}")
-        try:
-            return pytesseract.image_to_string(enhanced_img, lang='rus', config=custom_config)
-        except Exception as ocr_e:
-            logging.error(f"[JPG][OCR] Ошибка pytesseract: {ocr_e}")
-            logging.error(traceback.format_exc())
-            return ""
+        return get_execution_layer().call_cpu(read_xlsx_text, file_path, max_chars)
+    except Exception as e:
+        logging.error(f"[XLSX] Ошибка при извлечении текста: {e}")
+        return ""
+
+def extract_text_from_jpg(file_path, fields_only=False):
+    try:
+        return ocr_image_file(file_path, fields_only).text
     except Exception as e:
         import traceback
         logging.error(f"[JPG] Ошибка при извлечении текста: {e}")
         logging.error(traceback.format_exc())
         return ""
 
-# --- Универсальная эвристика для классификации типа документа ---
-def classify_document_universal(text: str) -> str:
-    text_lower = text.lower()
-    if "упд" in text_lower or "универсальный передаточный" in text_lower:
-        return "упд"
-    if "акт" in text_lower:
-        return "акт"
-    if "накладная" in text_lower:
-        return "накладная"
-    if "счёт-фактура" in text_lower or "счет-фактура" in text_lower:
-        return "счёт-фактура"
-    if "передаточный" in text_lower:
-        return "передаточный"
-    if "счет" in text_lower or "счёт" in text_lower:
-        return "счёт"
-    if "договор" in text_lower:
-        return "договор"
-    if "invoice" in text_lower:
-        return "счёт"
-    if "contract" in text_lower:
-        return "договор"
-    if re.search(r"\bакт[а-я]*\b", text_lower):
-        return "акт"
-    if re.search(r"\bдоговор[а-я]*\b", text_lower):
-        return "договор"
-    if re.search(r"\bнакладн[а-я]*\b", text_lower):
-        return "накладная"
-    if re.search(r"\bупд\b", text_lower):
-        return "упд"
-    return "иной"
+def get_ocr_stats(file_path):
+    """Разрешение и уверенность OCR по страницам уже разобранного документа"""
+    document = load_document(file_path) if os.path.exists(file_path) else None
+    return document.ocr_stats() if isinstance(document, PdfDocument) else []
+
+def detect_bundle(file_path):
+    """
+    Диапазоны страниц [start, end) документов, отсканированных в один PDF.
+    Один диапазон — файл является одним документом.
+    """
+    if not SPLIT_BUNDLES or not file_path.lower().endswith(".pdf"):
+        return []
+    try:
+        if pdf_page_count(file_path) <= 1:
+            return []
+        # Только дешёвые признаки: текстовый слой и OCR полос заголовка сканов, без OCR страниц целиком
+        ranges = split_ranges(load_document(file_path).boundary_texts())
+    except Exception as e:
+        logging.error(f"[PDF] Не удалось определить границы документов: {e}")
+        return []
+    if len(ranges) > 1:
+        logging.info(f"[PDF] В {file_path} найдено документов: {len(ranges)} {ranges}")
+    return ranges
+
+def split_bundle(file_path, ranges, dest_dir, prefix, indices=None):
+    """Сохраняет документы пачки отдельными PDF; возвращает их пути"""
+    return get_execution_layer().call_cpu(write_pdf_parts, file_path, ranges, dest_dir, prefix, indices)
 
 # --- Список нужных полей для каждого типа документа ---
 def get_fields_for_doc_type(doc_type: str):
@@ -199,34 +123,60 @@ def get_fields_for_doc_type(doc_type: str):
 
 # --- Универсальная функция для bot/main.py ---
 def process_file_with_classification(file_path):
+    """
+    Извлекает текст документа и определяет его тип (один раз на документ —
+    дальше по конвейеру классификация передаётся вместе с текстом).
+    Возвращает (текст, Classification) или (None, None) для неподдерживаемых файлов.
+    Вызывается из потока: тяжёлые части (парсинг, OCR страниц) сама отправляет в пул процессов.
+    Файл разбирается один раз — все функции извлечения берут его из load_document.
+    """
+    execution = get_execution_layer()
     ext = file_path.rsplit(".", 1)[-1].lower()
+    # Для классификации и быстрого пути достаточно первых MAX_CHARS символов:
+    # дальше страницы не читаются и не распознаются. Полный текст нужен только договорам (реквизиты)
     if ext == "pdf":
-        full_text = extract_full_text_from_pdf(file_path)
-        doc_type = classify_document_universal(full_text[:MAX_CHARS])
-        logging.info(f"Document type (universal): {doc_type}")
-        if doc_type == "договор":
-            return extract_text_from_pdf_contract(file_path)
-        else:
-            return full_text[:MAX_CHARS]
+        full_text = extract_full_text_from_pdf(file_path, max_chars=MAX_CHARS, fields_only=OCR_FIELDS_ONLY)
+        classification = classify_document(full_text[:MAX_CHARS])
+        if load_document(file_path).has_fields_only_pages and classification.doc_type != "договор" \
+                and not _fields_found(full_text, classification.doc_type):
+            logging.info("[PDF] Областей с полями недостаточно, распознаём страницы целиком")
+            full_text = extract_full_text_from_pdf(file_path, max_chars=MAX_CHARS)
+            classification = classify_document(full_text[:MAX_CHARS])
+        _log_classification(classification)
+        if classification.doc_type == "договор":
+            return extract_text_from_pdf_contract(file_path), classification
+        return full_text[:MAX_CHARS], classification
     elif ext == "docx":
-        full_text = extract_full_text_from_docx(file_path)
-        doc_type = classify_document_universal(full_text[:MAX_CHARS])
-        logging.info(f"Document type (universal): {doc_type}")
-        if doc_type == "договор":
-            return extract_text_from_docx_contract(file_path)
-        else:
-            return full_text[:MAX_CHARS]
+        full_text = extract_full_text_from_docx(file_path, max_chars=MAX_CHARS)
+        classification = classify_document(full_text[:MAX_CHARS])
+        _log_classification(classification)
+        if classification.doc_type == "договор":
+            return extract_text_from_docx_contract(file_path), classification
+        return full_text[:MAX_CHARS], classification
+    elif ext == "xlsx":
+        text = extract_text_from_xlsx(file_path, max_chars=MAX_CHARS)[:MAX_CHARS]
+        return text, _log_classification(classify_document(text))
     elif ext in ("jpg", "jpeg"):
-        return extract_text_from_jpg(file_path)
+        if OCR_FIELDS_ONLY:
+            text = execution.call_cpu(extract_text_from_jpg, file_path, True)
+            classification = classify_document(text)
+            if _fields_found(text, classification.doc_type):
+                return text, _log_classification(classification)
+            logging.info("[JPG] Областей с полями недостаточно, распознаём изображение целиком")
+        text = execution.call_cpu(extract_text_from_jpg, file_path)
+        return text, _log_classification(classify_document(text))
     else:
-        return None
+        return None, None
+
 
+def _log_classification(classification: Classification) -> Classification:
+    logging.info(f"Document type: {classification.doc_type} (confidence {classification.confidence:.2f})")
+    return classification
 
-def clean_text(text: str) -> str:
-    # Удаляем лишние пробелы, пустые строки, оставляем только буквы, цифры, знаки препинания
-    text = re.sub(r'[^\w\d\s.,:;!?@#№\-_/\\()\[\]{}"\'\n]', '', text, flags=re.UNICODE)
-    lines = [line.strip() for line in text.splitlines() if line.strip()]
-    return ' '.join(lines)
+
+def _fields_found(text: str, doc_type: str) -> bool:
+    """Хватает ли текста для быстрого пути (проверка режима OCR «только поля»)"""
+    return bool(text) and not fields_for_llm(extract_fields_scored(text, doc_type)[1], doc_type)
 
 
 def merge_fields(base: dict, new: dict) -> dict:
@@ -239,191 +189,117 @@ def merge_fields(base: dict, new: dict) -> dict:
     return result
 
 
-def determine_company_role(text: str) -> str:
+# --- Быстрый путь для извлечения ключевых полей ---
+def extract_fields_fast(doc_text: str, doc_type: Optional[str] = None) -> dict:
     """
-    Определяет роль нашей компании в документе.
-    Возвращает: 'поставщик', 'покупатель' или 'не указана'.
+    Извлекает ключевые поля регулярками/паттернами (быстрый путь), без обращения к LLM.
+    doc_type: если передан, используется для контекстного поиска даты и других полей
     """
-    try:
-        prompt = ROLE_PROMPT_TEMPLATE.format(text=text[:MAX_CHARS], our_company=OUR_COMPANY)
-        logging.info(f"Prompt to LLM for role determination: {prompt[:200]}...")
-        response = query_ollama(prompt)
-        role = response.strip().split()[0].lower()
-        logging.info(f"Company role determined: {role}")
-        return role
-    except Exception as e:
-        logging.error(f"Error determining company role: {e}")
-        return "не указана"
-
-def is_suspicious(value, field):
-    if not value or value == "-":
-        return True
-    if field == "amount":
-        try:
-            normalized = re.sub(r"[^0-9.,]", "", value)
-            normalized = normalized.replace(" ", "").replace("\xa0", " ")
-            # Если и точка, и запятая — считаем, что запятая разделяет копейки
-            if "," in normalized and "." in normalized:
-                # Убираем пробелы тысяч, оставляем запятую как десятичный
-                normalized = normalized.replace(".", "").replace(",", ".")
-            else:
-                normalized = normalized.replace(",", ".")
-            amount = float(normalized)
-            return amount < 10
-        except Exception:
-            return True
-    if field == "doc_number":
-        token = value.strip()
-        return len(token) < 3 or not re.search(r"[0-9]", token)
-    if field == "date":
-        # Можно добавить проверку на слишком старую/будущую дату
-        return False
-    return False
+    return extract_fields_scored(doc_text, doc_type=doc_type)[0]
 
-# --- Быстрый путь для извлечения ключевых полей ---
-def extract_fields_from_text(doc_text: str, rag_context: Optional[list] = None, doc_type: Optional[str] = None) -> dict:
+
+def extract_fields_scored(doc_text: str, doc_type: Optional[str] = None) -> Tuple[dict, Dict[str, float]]:
     """
-    Сначала пытаемся извлечь ключевые поля регулярками/паттернами (быстрый путь).
-    Если не удалось — используем LLM (медленный путь).
-    doc_type: если передан, используется для контекстного поиска даты и других полей
+    Быстрый путь с уверенностью каждого найденного поля (0–1, см. extractor.confidence).
+    Текст сканируется один раз (scan_text), поля выбираются по позициям кандидатов и якорей.
+    Возвращает (поля, уверенность); ненайденных полей в уверенности нет.
     """
-    import re
     clean = clean_text(doc_text)
-    total_len = len(clean)
+    scan = scan_text(clean)
     result = {k: "-" for k in ["inn", "counterparty", "doc_number", "date", "amount", "subject", "contract_number"]}
+    confidence = {}
 
     # --- Контекстный поиск даты (prioritize "от" после типа/заголовка) ---
-    date_patterns = [r"\b\d{2}[./]\d{2}[./]\d{4}\b", r"\b\d{2} [а-я]+ \d{4}\b"]
-    date_candidates = []
-    for pat in date_patterns:
-        for m in re.finditer(pat, clean):
-            date_candidates.append((m.start(), m.group(0)))
+    date_candidates = scan.dates
     # Если есть doc_type, ищем дату рядом с ключевым словом
     if doc_type and date_candidates:
-        doc_type_keywords = {
-            "акт": ["акт", "акта"],
-            "договор": ["договор", "contract"],
-            "счёт": ["счёт", "счет", "invoice"],
-            "упд": ["упд", "универсальный передаточный"],
-            "накладная": ["накладная"]
-        }
-        keywords = doc_type_keywords.get(doc_type.lower(), [])
-        best = None
-        best_dist = 99999
-        for kw in keywords:
-            for m in re.finditer(kw, clean.lower()):
-                kw_pos = m.start()
-                for date_pos, date_val in date_candidates:
-                    dist = abs(date_pos - kw_pos)
-                    if dist < best_dist:
-                        best_dist = dist
-                        best = date_val
-        if best:
-            result["date"] = best
-        else:
-            result["date"] = date_candidates[0][1]
+        nearest = scan.nearest_date(DATE_KEYWORDS.get(doc_type.lower(), []))
+        result["date"] = (nearest or date_candidates[0]).value
+        confidence["date"] = date_confidence(result["date"], near_keyword=nearest is not None)
     elif date_candidates:
-        result["date"] = date_candidates[0][1]
-    # Быстрый путь: регулярки для ИНН, даты, суммы, номера документа
+        result["date"] = date_candidates[0].value
+        confidence["date"] = date_confidence(result["date"], near_keyword=False)
     # ИНН (10 или 12 цифр)
     # Исключаем случайные 10-12-значные номера счёта/телефона, ищем рядом с ключами
-    inn_match = None
-    for m in re.finditer(r"\b\d{10}\b|\b\d{12}\b", clean):
-        left = max(0, m.start()-20)
-        ctx = clean[left:m.start()].lower()
-        if any(k in ctx for k in ["инн", "inn", "налогопл"]):
-            inn_match = m
+    for inn in scan.inns:
+        if scan.has_anchor(INN_KEYWORDS, max(0, inn.start - INN_CONTEXT), inn.start):
+            result["inn"] = inn.value
+            confidence["inn"] = inn_confidence(inn.value)
             break
-    if inn_match:
-        result["inn"] = inn_match.group(0)
-    # Сумма: выбираем кандидата из строк с якорями
-    amount_candidates = []
-    for m in re.finditer(r"\b\d{1,3}(?:[\s\.\,]\d{3})*(?:[\.,]\d{2})?\b", clean):
-        # Окно вокруг числа
-        left = max(0, m.start()-30)
-        right = min(len(clean), m.end()+30)
-        ctx = clean[left:right].lower()
-        score = 0
-        if any(k in ctx for k in ["итого", "всего к оплате", "к оплате", "сумма к оплате", "amount due"]):
-            score += 3
-        if any(k in ctx for k in ["с ндс", "без ндс", "nds", "налог"]):
-            score += 1
-        # штраф, если рядом "шт", "кол-во"
-        if any(k in ctx for k in [" шт", "кол-во", "ед."]):
-            score -= 1
-        amount_candidates.append((score, m.group(0)))
-    if amount_candidates:
-        amount_candidates.sort(key=lambda x: x[0], reverse=True)
-        result["amount"] = amount_candidates[0][1]
-    # Номер документа: приоритет близко к символу № или словам "Счёт", "Акт", "Накладная"
-    docnum_candidates = []
-    # Варианты: "№ 123", "N123", после ключевых слов
-    for pat in [r"№\s*([A-Za-zА-Яа-я0-9\-_/]{3,})", r"\bN\s*([A-Za-zА-Яа-я0-9\-_/]{3,})"]:
-        for m in re.finditer(pat, clean):
-            docnum_candidates.append((2, m.group(1)))
-    for kw in ["счёт", "счет", "акт", "накладная", "упд", "invoice", "contract", "договор"]:
-        for m in re.finditer(kw, clean.lower()):
-            left = m.end()
-            tail = clean[left:left+30]
-            m2 = re.search(r"№\s*([A-Za-zА-Яа-я0-9\-_/]{3,})", tail)
-            if m2:
-                docnum_candidates.append((3, m2.group(1)))
-    if docnum_candidates:
-        docnum_candidates.sort(key=lambda x: x[0], reverse=True)
-        result["doc_number"] = docnum_candidates[0][1]
-    # --- Новый быстрый путь: поиск counterparty ---
-    # Ищем строки с ключевыми словами и паттернами организаций
-    counterparty_patterns = [
-        r"(Общество с ограниченной ответственностью [\"'«][^\"'»]+[\"'»])",
-        r"(Акционерное общество [\"'«][^\"'»]+[\"'»])",
-        r"(Публичное акционерное общество [\"'«][^\"'»]+[\"'»])",
-        r"(Индивидуальный предприниматель [А-ЯЁ][а-яё]+ [А-ЯЁ][а-яё]+)",
-        r"(ООО\s+[\"'«][^\"'»]+[\"'»])",
-        r"(АО\s+[\"'«][^\"'»]+[\"'»])",
-        r"(ПАО\s+[\"'«][^\"'»]+[\"'»])",
-        r"(ИП\s+[А-ЯЁ][а-яё]+\s[А-ЯЁ][а-яё]+)",
-        r"(Заказчик:?\s*.+)",
-        r"(Исполнитель:?\s*.+)",
-        r"(Поставщик:?\s*.+)",
-        r"(Получатель:?\s*.+)",
-        r"(Продавец:?\s*.+)",
-        r"(Покупатель:?\s*.+)",
-        r"(Контрагент:?\s*.+)"
-    ]
-    for pat in counterparty_patterns:
-        m = re.search(pat, clean)
-        if m:
-            val = m.group(1).strip()
-            # Обрезаем лишнее после запятой/скобки/конца строки
-            val = re.split(r'[\n\r,\(\)]', val)[0].strip()
-            if 3 < len(val) < 100:
-                result["counterparty"] = val
+    # Сумма: выбираем кандидата из строк с якорями (при равных баллах — первого)
+    if scan.amounts:
+        scores = scan.amount_scores()
+        best = int(scores.argmax())
+        result["amount"] = scan.amounts[best].value
+        confidence["amount"] = amount_confidence(result["amount"], int(scores[best]))
+    # Номер документа: приоритет — «№» сразу после слов "Счёт", "Акт", "Накладная"…,
+    # затем первый «№ 123», затем «N123»
+    doc_number = None
+    for kw in DOC_NUMBER_KEYWORDS:
+        for kw_pos in scan.anchor_positions(kw):
+            doc_number = scan.number_after(kw_pos + len(kw))
+            if doc_number:
                 break
-    # --- Новый быстрый путь: поиск contract_number ---
-    contract_patterns = [
-        r"Договор\s*№\s*([A-Za-zА-Яа-я0-9\-_/]+)",
-        r"Contract\s*No\.?\s*([A-Za-zА-Яа-я0-9\-_/]+)",
-        r"Соглашение\s*№\s*([A-Za-zА-Яа-я0-9\-_/]+)",
-        r"№\s*([A-Za-zА-Яа-я0-9\-_/]+)",
-        r"N\s*([A-Za-zА-Яа-я0-9\-_/]+)"
-    ]
-    for pat in contract_patterns:
-        m = re.search(pat, clean)
-        if m:
-            val = m.group(1).strip()
-            if 2 < len(val) < 50:
-                result["contract_number"] = val
-                break
-    # Если хотя бы 3 поля найдены — считаем быстрый путь успешным
-    found_fields = sum(1 for v in [result["inn"], result["date"], result["amount"], result["doc_number"], result["counterparty"], result["contract_number"]] if v != "-")
-    suspicious = any(is_suspicious(result[f], f) for f in ["amount", "doc_number", "date"])
-    if found_fields >= 3 and not suspicious:
-        return result
+        if doc_number:
+            break
+    after_keyword = doc_number is not None
+    if not doc_number and (scan.numbers or scan.latin_numbers):
+        doc_number = (scan.numbers or scan.latin_numbers)[0].value
+    if doc_number:
+        result["doc_number"] = doc_number
+        confidence["doc_number"] = doc_number_confidence(doc_number, after_keyword)
+    # Контрагент: строки с ключевыми словами и паттернами организаций
+    counterparty = find_counterparty(clean)
+    if counterparty:
+        result["counterparty"] = counterparty
+        confidence["counterparty"] = counterparty_confidence(counterparty)
+    contract_number = find_contract_number(clean)
+    if contract_number:
+        result["contract_number"] = contract_number
+        confidence["contract_number"] = contract_number_confidence(contract_number)
+    return result, confidence
+
+
+def fields_for_llm(confidence: Dict[str, float], doc_type: Optional[str] = None) -> List[str]:
+    """Поля типа документа, которые быстрый путь не нашёл или нашёл неуверенно — их спрашиваем у LLM"""
+    return low_confidence_fields(confidence, get_fields_for_doc_type(doc_type))
+
+
+# --- Медленный путь: LLM ---
+def _window_offsets(total_len: int) -> List[int]:
+    """Начала окон текста для LLM: шаг OVERLAP, не больше LLM_MAX_WINDOWS окон"""
+    return list(range(0, total_len, OVERLAP))[:LLM_MAX_WINDOWS]
+
+
+def _query_window(prompt: str, window_text: str, position: str) -> dict:
+    """Поля из одного окна; при ошибке или ответе без JSON — пустой результат"""
+    full_prompt = prompt + f'"{window_text}"'
+    logging.info(f"Prompt to LLM (window {position}): {full_prompt[:200]}...")
+    try:
+        response = query_ollama(full_prompt)
+    except Exception as e:
+        logging.error(f"Error querying Ollama LLM (window {position}): {e}")
+        return {}
+    start = response.find('{')
+    end = response.rfind('}') + 1
+    if start == -1 or end == 0:
+        logging.warning(f"LLM did not return JSON (window {position}).")
+        return {}
+    try:
+        fields = json.loads(response[start:end])
+    except ValueError as e:
+        logging.error(f"Error parsing LLM JSON (window {position}): {e}")
+        return {}
+    if not isinstance(fields, dict):
+        return {}
+    return {k: str(v) for k, v in fields.items() if v is not None}
+
+
+def _fields_filled(result: dict, fields: List[str]) -> bool:
+    return all(result.get(k) and result[k] != "-" and result[k].lower() not in ("not specified", "none", "-") for k in fields)
 
-    # --- Медленный путь: LLM ---
-    # (остальной код как раньше)
-    # Сначала определяем роль нашей компании
-    our_role = determine_company_role(clean[:MAX_CHARS])
+
+def _fields_prompt(fields: List[str], doc_type: Optional[str], rag_context: Optional[list]) -> str:
     # Формируем RAG-контекст
     rag_block = ""
     if rag_context:
@@ -432,40 +308,92 @@ def extract_fields_from_text(doc_text: str, rag_context: Optional[list] = None,
             rag_block += f"Пример {i}:\n{frag}\n\n"
         rag_block += "----\n"
     # Формируем список нужных полей
-    fields_needed = get_fields_for_doc_type(doc_type)
-    fields_list = "\n- " + "\n- ".join(fields_needed)
-    # Формируем prompt
-    prompt = f"""
+    fields_list = "\n- " + "\n- ".join(fields)
+    return f"""
 {rag_block}Это документ типа: {doc_type or '-'}.
 Извлеки только следующие поля:{fields_list}
-Верни результат в формате JSON с ключами: {', '.join(fields_needed)}.
+Верни результат в формате JSON с ключами: {', '.join(fields)}.
 Текст документа:
 """
-    windows = 0
-    i = 0
-    while i < total_len and windows < 10:
-        window_text = clean[i:i+MAX_CHARS]
-        full_prompt = prompt + f'"{window_text}"'
-        logging.info(f"Prompt to LLM (window {windows+1}, chars {i}-{i+MAX_CHARS}): {full_prompt[:200]}...")
-        try:
-            response = query_ollama(full_prompt)
-            start = response.find('{')
-            end = response.rfind('}') + 1
-            if start == -1 or end == -1:
-                logging.warning("LLM did not return JSON.")
-                continue
-            json_str = response[start:end]
-            fields = json.loads(json_str)
-            result = merge_fields(result, fields)
-            if all(result.get(k) and result[k] != "-" and result[k].lower() not in ("not specified", "none", "-") for k in fields_needed):
+
+
+def _ask_windows(prompt: str, windows: List[Tuple[str, str]], fields: List[str], result: dict) -> Tuple[dict, int]:
+    """
+    Отправляет окна (подпись, текст) параллельно, не больше LLM_MAX_IN_FLIGHT одновременно;
+    ответы объединяются по порядку окон (при расхождении побеждает более раннее окно),
+    и как только окна без пропусков с начала дают все поля, оставшиеся не отправляются —
+    результат тот же, что при последовательном опросе, независимо от порядка ответов.
+    Возвращает (результат, сколько окон получило ответ).
+    """
+    answers: Dict[int, dict] = {}
+    pending = {}
+    next_window = 0
+    pool = ThreadPoolExecutor(max_workers=LLM_MAX_IN_FLIGHT, thread_name_prefix="llm-window")
+    try:
+        while next_window < len(windows) or pending:
+            # Каждое окно отправляется ровно один раз: номер следующего растёт при отправке
+            while next_window < len(windows) and len(pending) < LLM_MAX_IN_FLIGHT:
+                position, window_text = windows[next_window]
+                pending[pool.submit(_query_window, prompt, window_text, position)] = next_window
+                next_window += 1
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                answers[pending.pop(future)] = future.result()
+            # Более раннее окно ещё может ответить иначе: останавливаемся только по ответившим подряд с начала
+            merged = result
+            for window in range(len(windows)):
+                if window not in answers:
+                    break
+                merged = merge_fields(merged, answers[window])
+            if _fields_filled(merged, fields):
                 break
-        except Exception as e:
-            logging.error(f"Error querying Ollama LLM or parsing JSON: {e}")
-            continue
-        windows += 1
-        i += OVERLAP
-    logging.info(f"LLM windows used: {windows}, result: {result}")
-    return result
+    finally:
+        # Ответы ещё выполняющихся окон не ждём: они всё равно попадут в кэш LLM
+        pool.shutdown(wait=False, cancel_futures=True)
+    for window in sorted(answers):
+        result = merge_fields(result, answers[window])
+    return result, len(answers)
+
+
+def extract_fields_llm(doc_text: str, result: dict, rag_context: Optional[list] = None, doc_type: Optional[str] = None,
+                       fields: Optional[List[str]] = None) -> dict:
+    """
+    Дополняет результат быстрого пути полями, извлечёнными LLM.
+    fields: какие поля спросить (по умолчанию все поля типа документа); их значения
+    от быстрого пути неуверенные — ответ LLM заменяет их, а без ответа они остаются.
+    LLM получает выдержки вокруг якорей этих полей (extractor.excerpts), а не весь текст;
+    окна по всему тексту — только для полей, у которых в тексте нет ни одного якоря.
+    """
+    fast_result = result
+    fields_needed = fields or get_fields_for_doc_type(doc_type)
+    result = {**fast_result, **{field: "-" for field in fields_needed}}
+    clean = clean_text(doc_text)
+    excerpts, covered, unanchored = plan_excerpt_windows(clean, fields_needed, MAX_CHARS, LLM_MAX_WINDOWS)
+    windows = [(f"excerpt {n + 1}, {len(text)} chars", text) for n, text in enumerate(excerpts)]
+    result, asked = _ask_windows(_fields_prompt(fields_needed, doc_type, rag_context), windows, fields_needed, result)
+    # Якоря поля не нашлись, а часть текста LLM не видел — прежние окна по всему тексту
+    missing = [field for field in fields_needed if field in unanchored and not _fields_filled(result, [field])]
+    if missing and covered < len(clean):
+        windows = [(f"chars {i}-{i + MAX_CHARS}", clean[i:i + MAX_CHARS]) for i in _window_offsets(len(clean))]
+        result, fallback = _ask_windows(_fields_prompt(missing, doc_type, rag_context), windows, missing, result)
+        asked += fallback
+        logging.info(f"LLM windows over the whole text for fields without anchors {missing}: {fallback}")
+    logging.info(f"LLM windows used: {asked}, excerpts: {len(excerpts)} ({covered} of {len(clean)} chars), "
+                 f"fields asked: {fields_needed}, result: {result}")
+    return merge_fields(result, fast_result)
+
+
+def extract_fields_from_text(doc_text: str, rag_context: Optional[list] = None, doc_type: Optional[str] = None) -> dict:
+    """
+    Сначала пытаемся извлечь ключевые поля регулярками/паттернами (быстрый путь).
+    Поля, найденные неуверенно или не найденные, спрашиваем у LLM (медленный путь).
+    doc_type: если передан, используется для контекстного поиска даты и других полей
+    """
+    result, confidence = extract_fields_scored(doc_text, doc_type=doc_type)
+    fields = fields_for_llm(confidence, doc_type)
+    if not fields:
+        return result
+    return extract_fields_llm(doc_text, result, rag_context=rag_context, doc_type=doc_type, fields=fields)
 
 # Пример использования:
 # fields = extract_fields_from_text("Текст документа ...")
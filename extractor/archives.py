@@ -0,0 +1,138 @@
+"""
+Потоковое чтение ZIP-архивов.
+
+Архив не распаковывается целиком: файлы читаются по одному прямо из ZIP
+(zipfile читает только центральный каталог и нужный элемент), каждый
+записывается на общий том и сразу ставится в очередь отдельной задачей.
+"""
+import hashlib
+import logging
+import os
+import zipfile
+from dataclasses import dataclass
+from typing import Callable, Iterator, List, Optional, Tuple
+
+ZIP_MAX_MEMBERS = int(os.getenv("ZIP_MAX_MEMBERS", "1000"))
+ZIP_MAX_MEMBER_MB = int(os.getenv("ZIP_MAX_MEMBER_MB", "50"))
+# Сколько всего распаковывается из одного архива (защита от zip-бомб с тысячами элементов)
+ZIP_MAX_TOTAL_MB = int(os.getenv("ZIP_MAX_TOTAL_MB", "500"))
+# Форматы, которые умеет обрабатывать конвейер; вложенные архивы не распаковываются
+SUPPORTED_EXTENSIONS = ("pdf", "docx", "xlsx", "jpg", "jpeg")
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass
+class ArchiveMember:
+    """Файл из архива, записанный на диск (file_path None — поставлен в очередь при прошлой попытке)"""
+    index: int
+    filename: str
+    file_path: Optional[str]
+    content_hash: Optional[str]
+
+
+def is_archive(file_path: str) -> bool:
+    return file_path.rsplit(".", 1)[-1].lower() == "zip"
+
+
+def member_filename(info: zipfile.ZipInfo) -> str:
+    """
+    Имя файла элемента без каталогов. Архиваторы Windows пишут кириллицу в cp866
+    без флага UTF-8, а zipfile в этом случае декодирует имя как cp437.
+    """
+    name = info.filename
+    if not info.flag_bits & 0x800:
+        try:
+            name = name.encode("cp437").decode("cp866")
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return os.path.basename(name.rstrip("/"))
+
+
+def _is_supported(info: zipfile.ZipInfo, filename: str) -> bool:
+    if info.is_dir() or not filename or filename.startswith(".") or "__MACOSX" in info.filename:
+        return False
+    return filename.rsplit(".", 1)[-1].lower() in SUPPORTED_EXTENSIONS
+
+
+def _copy_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, dest_path: str,
+                 limit: int) -> Tuple[Optional[str], int]:
+    """
+    Копирует элемент на диск кусками, считая SHA-256 на лету.
+    Возвращает (хэш, записано байт); хэш None, если элемент больше limit байт
+    (проверяется по фактически распакованным байтам, а не по заголовку) — тогда файл удаляется.
+    Если элемент повреждён (ошибка CRC, обрыв данных), недописанный файл тоже удаляется.
+    """
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        with archive.open(info) as source, open(dest_path, "wb") as target:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > limit:
+                    break
+                digest.update(chunk)
+                target.write(chunk)
+    except Exception:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    if written > limit:
+        os.remove(dest_path)
+        return None, 0
+    return digest.hexdigest(), written
+
+
+def iter_archive_members(zip_path: str, dest_dir: str, prefix: str,
+                         skipped: Optional[List[str]] = None,
+                         already_queued: Optional[Callable[[int], bool]] = None) -> Iterator[ArchiveMember]:
+    """
+    Перебирает поддерживаемые файлы архива, записывая на диск по одному:
+    следующий элемент распаковывается, только когда вызывающий забрал предыдущий.
+    prefix: префикс имён файлов на диске (имена в разных архивах совпадают).
+    skipped: сюда добавляются имена пропущенных элементов.
+    already_queued: проверка по номеру элемента — такой элемент не распаковывается
+    и возвращается с file_path None (повторная попытка задачи архива, часть файлов уже в очереди).
+    Всего распаковывается не больше ZIP_MAX_TOTAL_MB: после этого остальные элементы пропускаются.
+    """
+    skipped = skipped if skipped is not None else []
+    member_limit = ZIP_MAX_MEMBER_MB * 1024 * 1024
+    remaining = ZIP_MAX_TOTAL_MB * 1024 * 1024
+    with zipfile.ZipFile(zip_path) as archive:
+        members = 0
+        for info in archive.infolist():
+            filename = member_filename(info)
+            if not _is_supported(info, filename):
+                if filename and not info.is_dir():
+                    skipped.append(filename)
+                continue
+            if members >= ZIP_MAX_MEMBERS or remaining <= 0:
+                skipped.append(filename)
+                continue
+            index = members
+            members += 1
+            if already_queued and already_queued(index):
+                # Распакован при прошлой попытке — входит в общий лимит архива
+                remaining -= info.file_size
+                yield ArchiveMember(index=index, filename=filename, file_path=None, content_hash=None)
+                continue
+            dest_path = os.path.join(dest_dir, f"{prefix}_{index}_{filename}")
+            try:
+                content_hash, written = _copy_member(archive, info, dest_path, min(member_limit, remaining))
+            except Exception as e:
+                logging.error(f"[ZIP] Не удалось прочитать {filename} из {zip_path}: {e}")
+                skipped.append(filename)
+                continue
+            if content_hash is None:
+                if remaining < member_limit:
+                    # Элемент не уместился в общий лимит — дальше архив не распаковывается
+                    logging.warning(f"[ZIP] {zip_path}: распаковано больше {ZIP_MAX_TOTAL_MB} МБ, остальные файлы пропущены")
+                    remaining = 0
+                else:
+                    logging.warning(f"[ZIP] {filename} больше {ZIP_MAX_MEMBER_MB} МБ, пропущен")
+                skipped.append(filename)
+                continue
+            remaining -= written
+            yield ArchiveMember(index=index, filename=filename, file_path=dest_path, content_hash=content_hash)
@@ -0,0 +1,98 @@
+"""
+Уверенность полей быстрого пути (0–1).
+
+Каждое поле оценивается по тому, как оно найдено (рядом с ключевым словом или
+первым попавшимся кандидатом), и по проверкам значения из валидатора: контрольная
+сумма ИНН, разбираемая дата, положительная сумма. LLM спрашивается только
+о полях ниже FIELD_MIN_CONFIDENCE — остальные остаются от быстрого пути.
+"""
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from validator import DocumentValidator
+
+FIELD_MIN_CONFIDENCE = float(os.getenv("FIELD_MIN_CONFIDENCE", "0.6"))
+MIN_AMOUNT = 10  # суммы меньше — обычно номер пункта или количество
+MIN_YEAR = 1990
+MONTHS = ("января", "февраля", "марта", "апреля", "мая", "июня",
+          "июля", "августа", "сентября", "октября", "ноября", "декабря")
+ORG_FORMS_RE = re.compile(r"\b(?:ООО|ОАО|ЗАО|ПАО|АО|ИП|НКО|ГУП|МУП)\b|ответственностью|обществ", re.IGNORECASE)
+
+_validator = DocumentValidator()
+
+
+def parse_date(value: str) -> Optional[datetime]:
+    """«31.12.2024», «31/12/2024» или «31 декабря 2024»"""
+    value = value.strip()
+    for fmt in ("%d.%m.%Y", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    parts = value.lower().split()
+    if len(parts) == 3 and parts[1] in MONTHS:
+        try:
+            return datetime(int(parts[2]), MONTHS.index(parts[1]) + 1, int(parts[0]))
+        except ValueError:
+            return None
+    return None
+
+
+def parse_amount(value: str) -> Optional[float]:
+    """Сумма в числе: «1 234,56», «1.234,56», «1 234.56»"""
+    normalized = re.sub(r"[^0-9.,]", "", value)
+    if "," in normalized and "." in normalized:
+        # И точка, и запятая — запятая разделяет копейки
+        normalized = normalized.replace(".", "").replace(",", ".")
+    else:
+        normalized = normalized.replace(",", ".")
+    try:
+        return float(normalized)
+    except ValueError:
+        return None
+
+
+def inn_confidence(value: str) -> float:
+    """ИНН найден рядом с «ИНН»; контрольные цифры сходятся — поле надёжно"""
+    return 1.0 if _validator._check_inn_checksum(value) else 0.3
+
+
+def date_confidence(value: str, near_keyword: bool) -> float:
+    parsed = parse_date(value)
+    if parsed is None or not MIN_YEAR <= parsed.year <= datetime.now().year + 1:
+        return 0.2
+    return 1.0 if near_keyword else 0.5
+
+
+def amount_confidence(value: str, score: int) -> float:
+    """score — балл кандидата: +3 «итого»/«к оплате», +1 НДС, −1 «шт»/«кол-во»"""
+    amount = parse_amount(value)
+    if amount is None or amount <= 0:
+        return 0.0
+    if amount < MIN_AMOUNT:
+        return 0.2
+    if score >= 3:
+        return 1.0
+    return 0.5 if score > 0 else 0.3
+
+
+def doc_number_confidence(value: str, after_keyword: bool) -> float:
+    """Номер сразу после «Счёт», «Акт»… надёжнее первого «№» в тексте"""
+    if len(value) < 3 or not re.search(r"[0-9]", value):
+        return 0.2
+    return 0.9 if after_keyword else 0.5
+
+
+def counterparty_confidence(value: str) -> float:
+    return 0.8 if ORG_FORMS_RE.search(value) else 0.5
+
+
+def contract_number_confidence(value: str) -> float:
+    return 0.7 if re.search(r"[0-9]", value) else 0.4
+
+
+def low_confidence_fields(confidence: Dict[str, float], fields: List[str]) -> List[str]:
+    """Поля из fields, которые быстрый путь не нашёл или нашёл неуверенно"""
+    return [field for field in fields if confidence.get(field, 0.0) < FIELD_MIN_CONFIDENCE]
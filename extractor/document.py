@@ -0,0 +1,324 @@
+"""
+Разобранный документ, общий для всех функций извлечения текста.
+
+Файл разбирается один раз за задачу: тексты страниц (абзацев) читаются в пуле
+процессов по мере надобности и кэшируются, а представления (первая страница,
+страницы с реквизитами, полный текст) строятся из уже прочитанного.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from execution import get_execution_layer
+from .ocr import ocr_pdf_boundaries, ocr_pdf_pages
+
+DOCUMENT_CACHE_SIZE = int(os.getenv("DOCUMENT_CACHE_SIZE", "16"))
+CONTRACT_FIRST_PARAGRAPHS = 20
+# Порог решения «текстовый слой или OCR» для отдельной страницы
+OCR_MIN_PAGE_CHARS = int(os.getenv("OCR_MIN_PAGE_CHARS", "50"))
+OCR_IMAGE_COVERAGE = float(os.getenv("OCR_IMAGE_COVERAGE", "0.6"))
+
+
+def read_pdf_page_texts(file_path: str, start: int = 0, max_chars: Optional[int] = None) -> Tuple[List[Tuple[str, float]], int]:
+    """
+    Текстовый слой страниц PDF начиная со start (выполняется в процессе пула).
+    Для каждой страницы возвращает (текст, доля площади под изображениями).
+    max_chars: перестать читать страницы, как только пригодный текст набрал столько символов.
+    Возвращает (страницы, общее число страниц).
+    """
+    import pdfplumber
+    pages = []
+    collected = 0
+    with pdfplumber.open(file_path) as pdf:
+        for page in pdf.pages[start:]:
+            text = page.extract_text() or ""
+            page_area = float(page.width * page.height) or 1.0
+            image_area = sum(
+                max(0.0, float(img["x1"] - img["x0"])) * max(0.0, float(img["bottom"] - img["top"]))
+                for img in page.images
+            )
+            image_coverage = min(1.0, image_area / page_area)
+            pages.append((text, image_coverage))
+            if not page_needs_ocr(text, image_coverage):
+                collected += len(text.strip())
+            if max_chars and collected >= max_chars:
+                break
+        return pages, len(pdf.pages)
+
+
+def pdf_page_count(file_path: str) -> int:
+    """Число страниц PDF без чтения их содержимого"""
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def page_needs_ocr(text: str, image_coverage: float) -> bool:
+    """
+    Нужен ли OCR странице: текстового слоя почти нет, или страница — скан
+    (изображение на большей её части) с редкими надписями поверх.
+    """
+    chars = len(text.strip())
+    if chars < OCR_MIN_PAGE_CHARS:
+        return True
+    return image_coverage >= OCR_IMAGE_COVERAGE and chars < OCR_MIN_PAGE_CHARS * 4
+
+
+def read_docx_paragraphs(file_path: str) -> List[str]:
+    """Тексты всех абзацев DOCX, включая пустые (выполняется в процессе пула)"""
+    from docx import Document
+    return [p.text for p in Document(file_path).paragraphs]
+
+
+def read_xlsx_text(file_path: str, max_chars: Optional[int] = None) -> str:
+    """
+    Текст XLSX построчно (выполняется в процессе пула). Книга открывается в режиме
+    read_only: строки читаются потоком из XML, лист целиком в память не загружается.
+    max_chars: перестать читать, как только набрано столько символов.
+    """
+    from openpyxl import load_workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    lines = []
+    collected = 0
+    try:
+        for sheet in workbook.worksheets:
+            for row in sheet.iter_rows(values_only=True):
+                cells = [str(value).strip() for value in row if value is not None and str(value).strip()]
+                if not cells:
+                    continue
+                line = " ".join(cells)
+                lines.append(line)
+                collected += len(line)
+                if max_chars and collected >= max_chars:
+                    return "\n".join(lines)
+    finally:
+        workbook.close()
+    return "\n".join(lines)
+
+
+@dataclass
+class PdfPage:
+    """Страница PDF: текстовый слой и, если он непригоден, результат OCR"""
+    index: int
+    text: str
+    image_coverage: float
+    needs_ocr: bool
+    ocr_text: Optional[str] = None
+    ocr_resolution: Optional[int] = None
+    ocr_confidence: Optional[float] = None
+    ocr_fields_only: bool = False  # распознаны только области с полями
+
+    def is_resolved(self, fields_only: bool = False) -> bool:
+        """Есть ли у страницы текст; для полного текста OCR «только полей» недостаточно"""
+        if not self.needs_ocr:
+            return True
+        return self.ocr_text is not None and (fields_only or not self.ocr_fields_only)
+
+    @property
+    def effective_text(self) -> str:
+        return self.ocr_text if self.needs_ocr else self.text
+
+
+class PdfDocument:
+    """
+    PDF, страницы которого читаются лениво и не более одного раза.
+    Решение «текстовый слой или OCR» принимается для каждой страницы отдельно,
+    поэтому в смешанных PDF распознаются только сканированные страницы.
+    """
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.page_count: Optional[int] = None
+        self._pages: List[PdfPage] = []  # прочитанные страницы, по порядку
+        self._lock = threading.Lock()
+
+    def _all_pages_read(self) -> bool:
+        return self.page_count is not None and len(self._pages) >= self.page_count
+
+    def _text_layer_chars(self) -> int:
+        return sum(len(p.text.strip()) for p in self._pages if not p.needs_ocr)
+
+    def _read_pages(self, max_chars: Optional[int] = None):
+        """Дочитывает текстовый слой следующих страниц, пока пригодный текст не наберёт max_chars символов"""
+        if self._all_pages_read():
+            return
+        collected = self._text_layer_chars()
+        if max_chars and collected >= max_chars:
+            return
+        pages, self.page_count = get_execution_layer().call_cpu(
+            read_pdf_page_texts, self.file_path, len(self._pages),
+            max_chars - collected if max_chars else None
+        )
+        for text, image_coverage in pages:
+            self._pages.append(PdfPage(
+                index=len(self._pages),
+                text=text,
+                image_coverage=image_coverage,
+                needs_ocr=page_needs_ocr(text, image_coverage)
+            ))
+
+    def _ocr_pages(self, max_chars: Optional[int] = None, fields_only: bool = False):
+        """Распознаёт прочитанные страницы без пригодного текстового слоя (параллельно)"""
+        pending = [p for p in self._pages if not p.is_resolved(fields_only)]
+        if not pending:
+            return
+        # Если текстовый слой уже дал max_chars, распознаём только сканы внутри прочитанного начала
+        remaining = max_chars - self._text_layer_chars() if max_chars else None
+        if remaining is not None and remaining <= 0:
+            remaining = None
+        logging.info(f"[PDF] OCR страниц без текстового слоя{' (только поля)' if fields_only else ''}: "
+                     f"{[p.index + 1 for p in pending]}")
+        results = ocr_pdf_pages(self.file_path, [p.index for p in pending], max_chars=remaining,
+                                fields_only=fields_only)
+        for page, result in zip(pending, results):
+            page.ocr_fields_only = fields_only
+            page.ocr_text = result.text
+            page.ocr_resolution = result.resolution
+            page.ocr_confidence = result.confidence
+
+    def page_texts(self, max_chars: Optional[int] = None, fields_only: bool = False) -> List[str]:
+        """
+        Тексты страниц по порядку: текстовый слой или OCR — для каждой страницы своё.
+        max_chars: вернуть только столько первых страниц, сколько нужно для max_chars символов.
+        fields_only: для сканов достаточно текста областей с полями (шапка, реквизиты, итоги).
+        """
+        with self._lock:
+            self._read_pages(max_chars)
+            self._ocr_pages(max_chars, fields_only)
+            texts = []
+            for page in self._pages:
+                # Нераспознанная страница прерывает непрерывное начало документа
+                if not page.is_resolved(fields_only):
+                    break
+                texts.append(page.effective_text)
+            return texts
+
+    def boundary_texts(self) -> List[str]:
+        """
+        Тексты всех страниц для поиска границ документов пачки (splitter смотрит только
+        на верхние и нижние строки): текстовый слой или уже распознанный текст, а для
+        нераспознанных сканов — OCR только полос заголовка и номера страницы.
+        Этот текст неполный и в страницы не сохраняется: полный OCR по-прежнему ленивый.
+        """
+        with self._lock:
+            self._read_pages()
+            scans = [p.index for p in self._pages if p.needs_ocr and p.ocr_text is None]
+            if scans:
+                logging.info(f"[PDF] OCR заголовков страниц для поиска границ документов: {[i + 1 for i in scans]}")
+            headers = dict(zip(scans, ocr_pdf_boundaries(self.file_path, scans))) if scans else {}
+            return [headers[p.index] if p.index in headers else p.effective_text for p in self._pages]
+
+    @property
+    def pages(self) -> List[PdfPage]:
+        """Прочитанные страницы (для диагностики)"""
+        return list(self._pages)
+
+    @property
+    def has_fields_only_pages(self) -> bool:
+        """Есть ли страницы, распознанные только по областям с полями"""
+        return any(p.needs_ocr and p.ocr_fields_only for p in self._pages)
+
+    def ocr_stats(self) -> List[dict]:
+        """Разрешение и уверенность OCR по распознанным страницам"""
+        return [
+            {'page': p.index + 1, 'dpi': p.ocr_resolution, 'confidence': p.ocr_confidence,
+             'fields_only': p.ocr_fields_only}
+            for p in self._pages if p.needs_ocr and p.ocr_text is not None
+        ]
+
+    def text(self, max_chars: Optional[int] = None, fields_only: bool = False) -> str:
+        """Текст документа (или его начало длиной не меньше max_chars)"""
+        return "\n".join(self.page_texts(max_chars, fields_only)).strip()
+
+    @property
+    def first_page_text(self) -> str:
+        pages = self.page_texts(max_chars=1)
+        return pages[0] if pages else ""
+
+    @property
+    def requisites_text(self) -> str:
+        """Страницы с реквизитами сторон"""
+        return "".join(text + "\n" for text in self.page_texts() if "реквизит" in text.lower())
+
+    def contract_text(self) -> str:
+        """Первая страница и страницы с реквизитами — всё, что нужно для договора"""
+        return (self.first_page_text + "\n" + self.requisites_text).strip()
+
+
+class DocxDocument:
+    """DOCX, разобранный один раз"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._paragraphs: Optional[List[str]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def paragraphs(self) -> List[str]:
+        with self._lock:
+            if self._paragraphs is None:
+                self._paragraphs = get_execution_layer().call_cpu(read_docx_paragraphs, self.file_path)
+            return self._paragraphs
+
+    def text(self, max_chars: Optional[int] = None) -> str:
+        """Непустые абзацы; max_chars — остановиться, как только набрано столько символов"""
+        paragraphs = []
+        collected = 0
+        for text in self.paragraphs:
+            if not text.strip():
+                continue
+            paragraphs.append(text)
+            collected += len(text)
+            if max_chars and collected >= max_chars:
+                break
+        return "\n".join(paragraphs)
+
+    def contract_text(self) -> str:
+        """Первые абзацы и абзацы с реквизитами"""
+        first_paragraphs = [p for p in self.paragraphs[:CONTRACT_FIRST_PARAGRAPHS] if p.strip()]
+        requisites = [p for p in self.paragraphs if "реквизит" in p.lower()]
+        return ("\n".join(first_paragraphs) + "\n" + "\n".join(requisites)).strip()
+
+
+_DOCUMENT_TYPES = {"pdf": PdfDocument, "docx": DocxDocument}
+_documents: "OrderedDict[str, Tuple[tuple, object]]" = OrderedDict()
+_documents_lock = threading.Lock()
+
+
+def _file_signature(file_path: str) -> tuple:
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def load_document(file_path: str):
+    """
+    Возвращает разобранный документ для файла, переиспользуя уже созданный объект.
+    Для неподдерживаемых форматов возвращает None.
+    """
+    document_cls = _DOCUMENT_TYPES.get(file_path.rsplit(".", 1)[-1].lower())
+    if document_cls is None:
+        return None
+    key = os.path.abspath(file_path)
+    signature = _file_signature(file_path)
+    with _documents_lock:
+        cached = _documents.get(key)
+        if cached and cached[0] == signature:
+            _documents.move_to_end(key)
+            return cached[1]
+        document = document_cls(file_path)
+        _documents[key] = (signature, document)
+        while len(_documents) > DOCUMENT_CACHE_SIZE:
+            _documents.popitem(last=False)
+        return document
+
+
+def release_document(file_path: str):
+    """Освобождает разобранный документ, когда задача завершена"""
+    with _documents_lock:
+        _documents.pop(os.path.abspath(file_path), None)
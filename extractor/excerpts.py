@@ -0,0 +1,92 @@
+"""
+Выдержки из текста документа для LLM вокруг якорей недостающих полей.
+
+Вместо окон по MAX_CHARS символов с шагом 500 (соседние окна на три четверти
+совпадают, во многих нет ни одного поля) LLM получает заголовок документа и
+фрагменты вокруг якорей только тех полей, которые у него спрашивают: «ИНН»,
+«итого», «№», «от <дата>», роли сторон (поставщик, покупатель…), реквизиты.
+Перекрывающиеся фрагменты сливаются и упаковываются в окна не длиннее MAX_CHARS.
+"""
+import re
+from typing import Dict, List, Set, Tuple
+
+from .scanner import COUNTERPARTY_ROLES, DATE_RE, INN_KEYWORDS, TEXT_DATE_RE, TOTAL_KEYWORDS
+
+HEADER_CHARS = 300     # заголовок (тип, номер, дата) попадает в первое окно всегда
+EXCERPT_BEFORE = 60    # символов до якоря
+EXCERPT_AFTER = 160    # и после него: «Поставщик: ООО "…", ИНН …, адрес»
+EXCERPT_MAX_HITS = 5   # вхождений одного якоря (в длинном договоре «№» встречается сотни раз)
+SEPARATOR = " … "
+
+REQUISITES = r"реквизит|р/с|расч[её]тный сч[её]т|бик|кпп|огрн"
+# Якоря полей (шаблоны по тексту в нижнем регистре); каждый шаблон ограничен EXCERPT_MAX_HITS
+FIELD_ANCHORS: Dict[str, List[str]] = {
+    "inn": ["|".join(INN_KEYWORDS), REQUISITES],
+    "counterparty": [
+        "|".join(role.lower() for role in COUNTERPARTY_ROLES),
+        r"\b(?:ооо|оао|зао|пао|ао|ип)\b|общество с ограниченной|акционерное общество|предприниматель",
+        REQUISITES,
+    ],
+    "doc_number": [r"№", r"\bn\s?\d"],
+    "date": [r"\bот\s+\d", DATE_RE.pattern, TEXT_DATE_RE.pattern],
+    "amount": ["|".join(re.escape(kw) for kw in TOTAL_KEYWORDS), r"сумм\w*", r"ндс"],
+    "contract_number": [r"договор\w*\s*(?:№|n\b)|contract|соглашени\w*"],
+    "subject": [r"предмет|наименование|оказан\w* услуг|выполнен\w* работ|поставк\w* товар"],
+}
+FIELD_ANCHOR_RES = {field: [re.compile(pattern) for pattern in patterns] for field, patterns in FIELD_ANCHORS.items()}
+
+
+def anchor_spans(clean: str, fields: List[str]) -> Tuple[List[Tuple[int, int]], Set[str]]:
+    """
+    Слитые отрезки [start, end) текста вокруг якорей полей (и заголовок).
+    Возвращает (отрезки по порядку, поля без единого якоря в тексте).
+    """
+    lower = clean.lower()
+    spans = [(0, min(len(clean), HEADER_CHARS))]
+    unanchored = set()
+    for field in fields:
+        found = False
+        for pattern in FIELD_ANCHOR_RES.get(field, []):
+            for hit, m in enumerate(pattern.finditer(lower)):
+                if hit == EXCERPT_MAX_HITS:
+                    break
+                spans.append((max(0, m.start() - EXCERPT_BEFORE), min(len(clean), m.end() + EXCERPT_AFTER)))
+                found = True
+        if not found:
+            unanchored.add(field)
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged, unanchored
+
+
+def plan_excerpt_windows(clean: str, fields: List[str], max_chars: int,
+                         max_windows: int) -> Tuple[List[str], int, Set[str]]:
+    """
+    Окна для LLM из выдержек вокруг якорей полей: не больше max_windows окон
+    по max_chars символов. Возвращает (окна, сколько символов текста в них попало,
+    поля без якорей).
+    """
+    spans, unanchored = anchor_spans(clean, fields)
+    # Отрезок длиннее окна режется на части
+    parts = [(part_start, min(end, part_start + max_chars))
+             for start, end in spans for part_start in range(start, end, max_chars)]
+    windows: List[str] = []
+    current: List[str] = []
+    size = 0
+    covered = 0
+    for start, end in parts:
+        if current and size + len(SEPARATOR) + end - start > max_chars:
+            windows.append(SEPARATOR.join(current))
+            current, size = [], 0
+            if len(windows) == max_windows:
+                break
+        size += end - start + (len(SEPARATOR) if current else 0)
+        current.append(clean[start:end])
+        covered += end - start
+    if current:
+        windows.append(SEPARATOR.join(current))
+    return windows, covered, unanchored
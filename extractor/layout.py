@@ -0,0 +1,118 @@
+"""
+Разметка страницы для OCR только нужных областей.
+
+Для быстрого пути нужны шапка («Счёт № … от …»), реквизиты с ИНН и строка
+«Итого / Всего к оплате». Дешёвый проход OpenCV по уже подготовленному серому
+изображению находит линии таблицы и блоки текста; распознаются только области
+над таблицей, сразу под ней и внизу страницы — тело таблицы пропускается.
+"""
+import logging
+from typing import List, Optional, Tuple
+
+# Доли высоты страницы
+HEADER_BAND = 0.3   # шапка и реквизиты, если таблица не найдена
+TOTALS_BAND = 0.15  # строки «Итого» под таблицей
+FOOTER_BAND = 0.25  # подписи и реквизиты внизу страницы
+# Если области занимают большую часть страницы, выгоднее распознать её целиком
+MAX_REGIONS_AREA = 0.8
+
+Box = Tuple[int, int, int, int]  # x, y, w, h
+
+
+def _binarize(gray):
+    import cv2
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    return binary
+
+
+def table_line_mask(binary):
+    """Длинные горизонтальные и вертикальные линии (сетка таблицы)"""
+    import cv2
+    height, width = binary.shape
+    horizontal = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (max(10, width // 8), 1)))
+    vertical = cv2.morphologyEx(binary, cv2.MORPH_OPEN, cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(10, height // 20))))
+    return cv2.bitwise_or(horizontal, vertical)
+
+
+def find_table(lines) -> Optional[Tuple[int, int]]:
+    """Вертикальные границы (top, bottom) самой большой сетки таблицы или None"""
+    import cv2
+    height, width = lines.shape
+    contours, _ = cv2.findContours(lines, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    grids = [cv2.boundingRect(c) for c in contours]
+    grids = [(x, y, w, h) for x, y, w, h in grids if w >= width // 3 and h >= height // 30]
+    if not grids:
+        return None
+    x, y, w, h = max(grids, key=lambda box: box[2] * box[3])
+    return y, y + h
+
+
+def find_text_blocks(binary, lines=None) -> List[Box]:
+    """Блоки текста: символы, слитые дилатацией в строки (без линий таблицы)"""
+    import cv2
+    height, width = binary.shape
+    text = cv2.subtract(binary, lines) if lines is not None else binary
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, width // 50), max(1, height // 300)))
+    merged = cv2.dilate(text, kernel)
+    contours, _ = cv2.findContours(merged, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = [cv2.boundingRect(c) for c in contours]
+    # Отбрасываем точки и шум
+    return [(x, y, w, h) for x, y, w, h in boxes if h >= height // 200 and w >= width // 100]
+
+
+def _bands(height: int, table: Optional[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Горизонтальные полосы страницы, где ожидаются поля, уже слитые между собой"""
+    footer = (height - int(height * FOOTER_BAND), height)
+    if table:
+        top, bottom = table
+        bands = [(0, top), (bottom, min(height, bottom + int(height * TOTALS_BAND))), footer]
+    else:
+        bands = [(0, int(height * HEADER_BAND)), footer]
+    merged = []
+    for start, end in sorted(bands):
+        if end <= start:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def field_regions(gray) -> List[Box]:
+    """
+    Области страницы с полями быстрого пути, сверху вниз.
+    Пустой список — разметка не дала выигрыша, страницу нужно распознать целиком.
+    """
+    height, width = gray.shape[:2]
+    binary = _binarize(gray)
+    lines = table_line_mask(binary)
+    table = find_table(lines)
+    blocks = find_text_blocks(binary, lines)
+    if not blocks:
+        return []
+    pad = max(2, height // 100)
+    regions = []
+    for start, end in _bands(height, table):
+        # Обрезаем полосу по блокам текста в ней: поля страницы не распознаём
+        inside = [(x, y, w, h) for x, y, w, h in blocks if y < end and y + h > start]
+        if not inside:
+            continue
+        x0 = max(0, min(x for x, _, _, _ in inside) - pad)
+        x1 = min(width, max(x + w for x, _, w, _ in inside) + pad)
+        y0 = max(0, max(start, min(y for _, y, _, _ in inside)) - pad)
+        y1 = min(height, min(end, max(y + h for _, y, _, h in inside)) + pad)
+        regions.append((x0, y0, x1 - x0, y1 - y0))
+    area = sum(w * h for _, _, w, h in regions)
+    logging.info(
+        f"[OCR][layout] table={table} regions={len(regions)} "
+        f"area={area / float(height * width):.0%}"
+    )
+    if not regions or area > MAX_REGIONS_AREA * height * width:
+        return []
+    return regions
+
+
+def crop_regions(gray, regions: List[Box]) -> list:
+    """Вырезает области (срезы NumPy, без копирования)"""
+    return [gray[y:y + h, x:x + w] for x, y, w, h in regions]
@@ -0,0 +1,283 @@
+"""
+OCR страниц сканированных документов.
+
+Страницы PDF растеризуются и распознаются параллельно в пуле процессов
+(execution.get_execution_layer), результат собирается в порядке страниц.
+Движок OCR (extractor.ocr_backends, OCR_BACKEND) создаётся один раз на процесс пула;
+бэкенды с пакетной обработкой получают страницы пакетами.
+"""
+import logging
+import os
+from collections import deque
+from typing import Iterable, List, Optional
+
+from execution import get_execution_layer
+from .layout import crop_regions, field_regions
+from .preprocess import parse_steps, preprocess
+from .ocr_backends import OCR_BACKEND, OcrResult, backend_class, get_backend
+from .ocr_cache import get_ocr_cache, image_key
+
+# Страница распознаётся сначала с OCR_RESOLUTION; если средняя уверенность движка
+# по словам ниже OCR_MIN_CONFIDENCE — повторно с OCR_MAX_RESOLUTION
+OCR_RESOLUTION = int(os.getenv("OCR_RESOLUTION", "200"))
+OCR_MAX_RESOLUTION = int(os.getenv("OCR_MAX_RESOLUTION", "400"))
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "70"))
+# Сколько страниц одного документа распознаётся одновременно: большой скан не занимает весь пул
+OCR_PAGE_CONCURRENCY = int(os.getenv("OCR_PAGE_CONCURRENCY", "0"))  # 0 — половина пула
+# Режим «только поля»: распознаются шапка, реквизиты и итоги (extractor.layout),
+# вся страница — только если быстрому пути не хватило полей
+OCR_FIELDS_ONLY = os.getenv("OCR_FIELDS_ONLY", "0") == "1"
+# Для границ документов в пачке достаточно верхних строк страницы (заголовок «Счёт № … от …»)
+# и нижних (номер «Страница 2 из 5») — доли высоты страницы
+BOUNDARY_TOP_BAND = 0.2
+BOUNDARY_BOTTOM_BAND = 0.08
+# Каталог для диагностических PNG; по умолчанию изображения на диск не пишутся
+OCR_DEBUG_DIR = os.getenv("OCR_DEBUG_DIR", "")
+
+
+def page_concurrency() -> int:
+    """Лимит одновременно распознаваемых страниц одного документа"""
+    if OCR_PAGE_CONCURRENCY > 0:
+        return OCR_PAGE_CONCURRENCY
+    return max(1, get_execution_layer().cpu_workers // 2)
+
+
+def render_pdf_page_gray(file_path: str, page_index: int, resolution: int = OCR_RESOLUTION):
+    """
+    Растеризует страницу PDF сразу в серый NumPy-массив поверх буфера pdfium,
+    без кодирования в PNG и обратно. Возвращает (bitmap, array): bitmap держит буфер живым.
+    """
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        bitmap = pdf[page_index].render(scale=resolution / 72, grayscale=True)
+        return bitmap, bitmap.to_numpy()
+    finally:
+        pdf.close()
+
+
+def dump_debug_image(gray, name: str):
+    """Сохраняет изображение для ручной проверки OCR (только если задан OCR_DEBUG_DIR)"""
+    if not OCR_DEBUG_DIR:
+        return None
+    import cv2
+    os.makedirs(OCR_DEBUG_DIR, exist_ok=True)
+    png_path = os.path.join(OCR_DEBUG_DIR, f"{name}_{os.getpid()}.png")
+    cv2.imwrite(png_path, gray)
+    logging.info(f"[OCR] Saved {png_path} for manual OCR test")
+    return png_path
+
+
+def page_preprocess_steps(resolution: int) -> str:
+    """Шаги предобработки страницы PDF: повторная отрисовка с большим разрешением не уменьшается обратно"""
+    steps = parse_steps()
+    if resolution > OCR_RESOLUTION:
+        steps = [step for step in steps if step != "scale"]
+    return ",".join(steps)
+
+
+def _prepare_pdf_page(file_path: str, page_index: int, resolution: int):
+    import numpy as np
+    bitmap, rendered = render_pdf_page_gray(file_path, page_index, resolution)
+    gray, _ = preprocess(rendered, page_preprocess_steps(resolution))
+    # Шаги вроде обрезки возвращают срез буфера pdfium — копируем до его освобождения
+    if np.shares_memory(gray, rendered):
+        gray = gray.copy()
+    bitmap.close()
+    dump_debug_image(gray, f"ocr_page_{page_index+1}_{resolution}dpi")
+    return gray
+
+
+def _page_images(gray, fields_only: bool) -> list:
+    """Изображения для распознавания: области с полями или вся страница"""
+    if fields_only:
+        regions = field_regions(gray)
+        if regions:
+            return crop_regions(gray, regions)
+    return [gray]
+
+
+def _merge_results(results: List[OcrResult]) -> OcrResult:
+    """Объединяет результаты областей одной страницы (уверенность взвешивается длиной текста)"""
+    text = "\n".join(result.text.strip() for result in results if result.text.strip())
+    weighted = [(result.confidence, len(result.text.strip())) for result in results
+                if result.confidence is not None and result.text.strip()]
+    total = sum(weight for _, weight in weighted)
+    confidence = sum(conf * weight for conf, weight in weighted) / total if total else None
+    if confidence is None and any(result.confidence is not None for result in results):
+        confidence = 0.0
+    return OcrResult(text=text, confidence=confidence)
+
+
+def _recognize_cached(images: list, source: str) -> List[OcrResult]:
+    """Распознаёт изображения, которых ещё нет в кэше OCR; остальные берёт из кэша"""
+    backend = get_backend()
+    cache = get_ocr_cache()
+    keys = [image_key(image, backend.cache_key) for image in images] if cache else [None] * len(images)
+    cached = {}
+    if cache:
+        try:
+            cached = cache.get_many(keys)
+        except Exception as e:
+            logging.error(f"[OCR][cache] Ошибка чтения: {e}")
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    fresh = {}
+    if missing:
+        try:
+            fresh = dict(zip(missing, backend.recognize_batch([images[i] for i in missing])))
+        except Exception as e:
+            logging.error(f"[{source}][OCR] Ошибка бэкенда {OCR_BACKEND}: {e}")
+            # Пустой результат ошибки в кэш не попадает
+            return [OcrResult(text=cached[key].text, confidence=cached[key].confidence) if key in cached
+                    else OcrResult(text='') for key in keys]
+    if cache:
+        logging.info(f"[{source}][OCR][cache] hits={len(images) - len(missing)} misses={len(missing)}")
+        try:
+            # Пустой текст не кэшируется: это может быть и сбой движка, а запись жила бы до вытеснения
+            cache.put_many([(keys[i], result) for i, result in fresh.items() if result.text.strip()])
+        except Exception as e:
+            logging.error(f"[OCR][cache] Ошибка записи: {e}")
+    # Из кэша — копии: разрешение проставляется на результат конкретной страницы
+    return [fresh[i] if i in fresh else OcrResult(text=cached[key].text, confidence=cached[key].confidence)
+            for i, key in enumerate(keys)]
+
+
+def _recognize(images_per_page: List[list], source: str) -> List[OcrResult]:
+    """Распознаёт изображения всех страниц одним пакетом и собирает результат по страницам"""
+    flat = [image for images in images_per_page for image in images]
+    flat_results = _recognize_cached(flat, source)
+    results = []
+    offset = 0
+    for images in images_per_page:
+        page_results = flat_results[offset:offset + len(images)]
+        offset += len(images)
+        results.append(page_results[0] if len(page_results) == 1 else _merge_results(page_results))
+    return results
+
+
+def _recognize_pdf_pages_at(file_path: str, page_indices: List[int], resolution: int,
+                            fields_only: bool = False) -> List[OcrResult]:
+    images = [_page_images(_prepare_pdf_page(file_path, page_index, resolution), fields_only)
+              for page_index in page_indices]
+    results = _recognize(images, source="PDF")
+    for result in results:
+        result.resolution = resolution
+    return results
+
+
+def ocr_pdf_page_batch(file_path: str, page_indices: List[int], resolution: int = OCR_RESOLUTION,
+                       fields_only: bool = False) -> List[OcrResult]:
+    """
+    Растеризует и распознаёт пакет страниц PDF за один вызов бэкенда (выполняется в процессе пула).
+    Чистые сканы распознаются с низким разрешением; страницы перерисовываются
+    с OCR_MAX_RESOLUTION, только если уверенность ниже OCR_MIN_CONFIDENCE.
+    fields_only: распознать только области с полями (шапка, реквизиты, итоги).
+    """
+    results = _recognize_pdf_pages_at(file_path, page_indices, resolution, fields_only)
+    if resolution < OCR_MAX_RESOLUTION:
+        low = [i for i, result in enumerate(results)
+               if result.confidence is not None and result.confidence < OCR_MIN_CONFIDENCE]
+        if low:
+            retries = _recognize_pdf_pages_at(file_path, [page_indices[i] for i in low], OCR_MAX_RESOLUTION, fields_only)
+            for i, retry in zip(low, retries):
+                if retry.confidence is None or retry.confidence >= results[i].confidence:
+                    results[i] = retry
+    for page_index, result in zip(page_indices, results):
+        # Структурированная запись для подбора порога по реальным документам
+        logging.info(
+            f"[PDF][OCR] page={page_index+1} backend={OCR_BACKEND} fields_only={fields_only} dpi={result.resolution} "
+            f"confidence={result.confidence if result.confidence is None else round(result.confidence, 1)} "
+            f"threshold={OCR_MIN_CONFIDENCE}"
+        )
+    return results
+
+
+def _boundary_bands(gray) -> list:
+    height = gray.shape[0]
+    return [gray[:max(1, int(height * BOUNDARY_TOP_BAND))], gray[height - max(1, int(height * BOUNDARY_BOTTOM_BAND)):]]
+
+
+def ocr_pdf_boundary_batch(file_path: str, page_indices: List[int], resolution: int = OCR_RESOLUTION) -> List[str]:
+    """Текст верхней и нижней полос страниц PDF (выполняется в процессе пула)"""
+    images = [_boundary_bands(_prepare_pdf_page(file_path, page_index, resolution)) for page_index in page_indices]
+    return [result.text for result in _recognize(images, source="PDF")]
+
+
+def ocr_pdf_boundaries(file_path: str, page_indices: Iterable[int]) -> List[str]:
+    """
+    Распознаёт только полосы заголовка и номера страницы (для поиска границ документов пачки)
+    пакетами параллельно; возвращает тексты в порядке page_indices, ошибка пакета даёт пустой текст.
+    """
+    execution = get_execution_layer()
+    batch_size = backend_class().batch_size
+    order = list(page_indices)
+    batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    futures = [execution.submit_cpu(ocr_pdf_boundary_batch, file_path, batch) for batch in batches]
+    texts = []
+    for batch, future in zip(batches, futures):
+        try:
+            texts.extend(future.result())
+        except Exception as e:
+            logging.error(f"[PDF][OCR] Ошибка распознавания заголовков страниц {[i + 1 for i in batch]}: {e}")
+            texts.extend('' for _ in batch)
+    return texts
+
+
+def ocr_pdf_page(file_path: str, page_index: int, resolution: int = OCR_RESOLUTION,
+                 fields_only: bool = False) -> OcrResult:
+    """Растеризует и распознаёт одну страницу PDF"""
+    return ocr_pdf_page_batch(file_path, [page_index], resolution, fields_only)[0]
+
+
+def ocr_image_file(file_path: str, fields_only: bool = False) -> OcrResult:
+    """Распознаёт изображение (JPG): декодируется сразу в серый массив"""
+    import cv2
+    gray = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        raise ValueError(f"Не удалось прочитать изображение: {file_path}")
+    gray, _ = preprocess(gray)
+    dump_debug_image(gray, "ocr_image")
+    result = _recognize([_page_images(gray, fields_only)], source="JPG")[0]
+    logging.info(f"[JPG][OCR] backend={OCR_BACKEND} fields_only={fields_only} confidence={result.confidence}")
+    return result
+
+
+def ocr_pdf_pages(file_path: str, page_indices: Iterable[int], max_in_flight: Optional[int] = None,
+                  max_chars: Optional[int] = None, fields_only: bool = False) -> List[OcrResult]:
+    """
+    Распознаёт страницы PDF параллельно, держа в работе не более max_in_flight страниц
+    (для пакетного бэкенда — пакетов по batch_size страниц).
+    Возвращает результаты в порядке page_indices; ошибка страницы даёт пустой текст.
+    max_chars: остановиться, как только распознанные по порядку страницы дали столько символов
+    (остальные страницы не распознаются и в результат не попадают)
+    fields_only: распознавать только области с полями
+    """
+    execution = get_execution_layer()
+    batch_size = backend_class().batch_size
+    limit = max(1, (max_in_flight or page_concurrency()) // batch_size)
+    order = list(page_indices)
+    pending = deque(order[i:i + batch_size] for i in range(0, len(order), batch_size))
+    in_flight = deque()
+    results = {}
+    collected = 0
+    while pending or in_flight:
+        while pending and len(in_flight) < limit:
+            batch = pending.popleft()
+            in_flight.append((batch, execution.submit_cpu(ocr_pdf_page_batch, file_path, batch, OCR_RESOLUTION, fields_only)))
+        # Ждём самый ранний пакет: окно сдвигается по порядку страниц
+        batch, future = in_flight.popleft()
+        try:
+            batch_results = future.result()
+        except Exception as e:
+            logging.error(f"[PDF][OCR] Ошибка распознавания страниц {[i + 1 for i in batch]}: {e}")
+            batch_results = [OcrResult(text='') for _ in batch]
+        for page_index, result in zip(batch, batch_results):
+            results[page_index] = result
+            collected += len(result.text.strip())
+        if max_chars and collected >= max_chars:
+            # Текста достаточно: ещё не начатые страницы снимаем с очереди пула
+            for _, pending_future in in_flight:
+                pending_future.cancel()
+            logging.info(f"[PDF][OCR] Ранняя остановка после {len(results)} из {len(order)} страниц")
+            break
+    return [results[i] for i in order if i in results]
@@ -0,0 +1,203 @@
+"""
+Движки OCR.
+
+Бэкенд выбирается переменной OCR_BACKEND и создаётся один раз на процесс пула:
+- tesseract — Tesseract через tesserocr (или pytesseract, если tesserocr не установлен);
+- doctr — docTR на CPU; несколько страниц распознаются за один проход модели.
+Все бэкенды принимают серые NumPy-массивы (uint8) и возвращают OcrResult.
+"""
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+OCR_BACKEND = os.getenv("OCR_BACKEND", "tesseract")
+OCR_CONFIG = r'--oem 3 --psm 6'
+OCR_LANG = 'rus'
+# Архитектуры и размер пакета docTR
+DOCTR_DET_ARCH = os.getenv("DOCTR_DET_ARCH", "db_resnet50")
+DOCTR_RECO_ARCH = os.getenv("DOCTR_RECO_ARCH", "crnn_vgg16_bn")
+DOCTR_BATCH_SIZE = int(os.getenv("DOCTR_BATCH_SIZE", "4"))
+
+
+@dataclass
+class OcrResult:
+    """Результат OCR изображения: текст, средняя уверенность по словам (0–100) и разрешение"""
+    text: str
+    confidence: Optional[float] = None
+    resolution: Optional[int] = None
+
+
+class OcrBackend:
+    """Интерфейс движка OCR"""
+    name = ""
+    # Сколько страниц имеет смысл отдавать движку за один вызов recognize_batch
+    batch_size = 1
+
+    @property
+    def cache_key(self) -> str:
+        """Движок и его настройки: входят в ключ кэша OCR"""
+        return self.name
+
+    def recognize(self, gray) -> OcrResult:
+        """Распознаёт изображение; сбой движка — исключение (такой результат не кэшируется)"""
+        raise NotImplementedError
+
+    def recognize_batch(self, images: Sequence) -> List[OcrResult]:
+        return [self.recognize(gray) for gray in images]
+
+
+def _text_from_data(data: dict) -> OcrResult:
+    """Собирает текст по строкам и среднюю уверенность из результата image_to_data"""
+    lines = {}
+    confidences = []
+    for i, word in enumerate(data["text"]):
+        conf = float(data["conf"][i])
+        # conf = -1 у блоков/строк без слова
+        if conf < 0 or not word.strip():
+            continue
+        confidences.append(conf)
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+    text = "\n".join(" ".join(words) for _, words in sorted(lines.items()))
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return OcrResult(text=text, confidence=confidence)
+
+
+class TesseractBackend(OcrBackend):
+    """
+    Tesseract. Если установлен tesserocr, процесс держит один экземпляр C API
+    с загруженной моделью OCR_LANG; иначе — pytesseract и subprocess.
+    """
+    name = "tesseract"
+
+    def __init__(self, lang: str = OCR_LANG):
+        self.lang = lang
+        self.api = None
+        self._lock = threading.Lock()
+        try:
+            from tesserocr import PyTessBaseAPI, OEM, PSM
+            # Соответствует OCR_CONFIG: --oem 3 --psm 6
+            self.api = PyTessBaseAPI(lang=lang, oem=OEM.DEFAULT, psm=PSM.SINGLE_BLOCK)
+            logging.info(f"[OCR] Инициализирован движок tesserocr ({lang}) в процессе {os.getpid()}")
+        except Exception as e:
+            logging.warning(f"[OCR] tesserocr недоступен, используется pytesseract: {e}")
+
+    @property
+    def cache_key(self) -> str:
+        return f"{self.name}:{self.lang}:{OCR_CONFIG}"
+
+    def recognize(self, gray) -> OcrResult:
+        if self.api is not None:
+            try:
+                return self._recognize_api(gray)
+            except Exception as engine_e:
+                logging.error(f"[OCR] Ошибка tesserocr: {engine_e}")
+        return self._recognize_pytesseract(gray)
+
+    def _recognize_api(self, gray) -> OcrResult:
+        """Серый NumPy-массив передаётся в Tesseract без кодирования"""
+        import numpy as np
+        gray = np.ascontiguousarray(gray)
+        height, width = gray.shape[:2]
+        with self._lock:
+            self.api.SetImageBytes(gray.tobytes(), width, height, 1, gray.strides[0])
+            text = self.api.GetUTF8Text()
+            confidence = float(self.api.MeanTextConf())
+            self.api.Clear()
+        return OcrResult(text=text, confidence=confidence)
+
+    def _recognize_pytesseract(self, gray) -> OcrResult:
+        import pytesseract
+        import traceback
+        import subprocess
+        import tempfile
+        import cv2
+        logging.info(f"[OCR] config: {OCR_CONFIG}")
+        try:
+            # Сначала пробуем pytesseract; image_to_data даёт уверенность по каждому слову
+            data = pytesseract.image_to_data(gray, lang=self.lang, config=OCR_CONFIG, output_type=pytesseract.Output.DICT)
+            return _text_from_data(data)
+        except Exception as ocr_e:
+            logging.error(f"[OCR] Ошибка pytesseract: {ocr_e}")
+            logging.error(traceback.format_exc())
+            # Пробуем через subprocess: ему нужен файл на диске, уверенность неизвестна
+            try:
+                with tempfile.NamedTemporaryFile(suffix=".png") as tmp:
+                    cv2.imwrite(tmp.name, gray)
+                    result = subprocess.run([
+                        'tesseract', tmp.name, 'stdout', '-l', self.lang, '--oem', '3', '--psm', '6'
+                    ], capture_output=True, text=True)
+            except Exception as sub_e:
+                logging.error(f"[OCR][subprocess] Ошибка: {sub_e}")
+                logging.error(traceback.format_exc())
+                # Сбой движка — исключение, а не пустой текст: пустой результат неотличим от пустой страницы
+                raise RuntimeError(f"Tesseract недоступен: {ocr_e}; {sub_e}") from sub_e
+            logging.error(f"[OCR][subprocess] stderr: {result.stderr}")
+            if result.returncode != 0:
+                raise RuntimeError(f"tesseract завершился с кодом {result.returncode}: {result.stderr.strip()}")
+            return OcrResult(text=result.stdout)
+
+
+class DoctrBackend(OcrBackend):
+    """docTR на CPU: детектор и распознаватель прогоняют пакет страниц за один forward pass"""
+    name = "doctr"
+    batch_size = DOCTR_BATCH_SIZE
+
+    def __init__(self):
+        from doctr.models import ocr_predictor
+        self.model = ocr_predictor(det_arch=DOCTR_DET_ARCH, reco_arch=DOCTR_RECO_ARCH, pretrained=True)
+        self._lock = threading.Lock()
+        logging.info(f"[OCR] Инициализирован docTR ({DOCTR_DET_ARCH}/{DOCTR_RECO_ARCH}) в процессе {os.getpid()}")
+
+    @property
+    def cache_key(self) -> str:
+        return f"{self.name}:{DOCTR_DET_ARCH}:{DOCTR_RECO_ARCH}"
+
+    def recognize(self, gray) -> OcrResult:
+        return self.recognize_batch([gray])[0]
+
+    def recognize_batch(self, images: Sequence) -> List[OcrResult]:
+        import numpy as np
+        # docTR ждёт RGB (H, W, 3); серый канал повторяется без перекодирования
+        pages = [np.repeat(gray[:, :, None], 3, axis=2) for gray in images]
+        with self._lock:
+            document = self.model(pages)
+        results = []
+        for page in document.pages:
+            lines = []
+            confidences = []
+            for block in page.blocks:
+                for line in block.lines:
+                    lines.append(" ".join(word.value for word in line.words))
+                    confidences.extend(word.confidence for word in line.words)
+            confidence = 100.0 * sum(confidences) / len(confidences) if confidences else 0.0
+            results.append(OcrResult(text="\n".join(lines), confidence=confidence))
+        return results
+
+
+BACKENDS = {backend.name: backend for backend in (TesseractBackend, DoctrBackend)}
+
+_backends: Dict[str, OcrBackend] = {}
+_backends_lock = threading.Lock()
+
+
+def backend_class(name: Optional[str] = None):
+    """Класс бэкенда по имени (по умолчанию OCR_BACKEND), без загрузки модели"""
+    name = (name or OCR_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Неизвестный OCR_BACKEND: {name} (доступны: {', '.join(BACKENDS)})")
+    return BACKENDS[name]
+
+
+def get_backend(name: Optional[str] = None) -> OcrBackend:
+    """Бэкенд текущего процесса: создаётся (и загружает модель) один раз"""
+    cls = backend_class(name)
+    backend = _backends.get(cls.name)
+    if backend is None:
+        with _backends_lock:
+            backend = _backends.get(cls.name)
+            if backend is None:
+                backend = _backends[cls.name] = cls()
+    return backend
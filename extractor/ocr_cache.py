@@ -0,0 +1,142 @@
+"""
+Дисковый кэш результатов OCR.
+
+Ключ — хэш байтов подготовленного изображения (после предобработки), его размеров
+и конфигурации движка, поэтому одинаковые страницы из разных PDF, повторные
+загрузки и пересланные копии распознаются один раз. Хранилище — SQLite:
+процессы пула читают и пишут его одновременно. Размер ограничен OCR_CACHE_MAX_MB,
+при превышении удаляются давно не использованные записи (LRU).
+
+SQLite в режиме WAL работает только на локальном диске одной машины, поэтому
+по умолчанию кэш лежит во временном каталоге контейнера, а не на общем томе data/:
+у каждого воркера свой кэш. OCR_CACHE_DIR можно направить на локальный том
+контейнера, чтобы кэш переживал перезапуск, но не на каталог, общий для воркеров.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from .ocr_backends import OcrResult
+
+# Пусто — кэш выключен; только локальный для контейнера каталог
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ocr_cache"))
+OCR_CACHE_MAX_MB = int(os.getenv("OCR_CACHE_MAX_MB", "512"))
+# После вытеснения кэш занимает не больше этой доли лимита
+EVICT_TO = 0.9
+
+
+def image_key(gray, engine_key: str) -> str:
+    """Ключ кэша: байты изображения, его форма и конфигурация движка"""
+    import numpy as np
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(engine_key.encode("utf-8"))
+    digest.update(repr(gray.shape).encode("ascii"))
+    digest.update(np.ascontiguousarray(gray).data)
+    return digest.hexdigest()
+
+
+class OcrCache:
+    """Кэш текст/уверенность по ключу изображения с вытеснением LRU"""
+
+    def __init__(self, directory: str = OCR_CACHE_DIR, max_bytes: int = OCR_CACHE_MAX_MB * 1024 * 1024):
+        self.path = os.path.join(directory, "ocr_cache.sqlite")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS ocr_cache (
+                key TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                confidence REAL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_used ON ocr_cache(last_used)")
+        self._conn.commit()
+
+    def get_many(self, keys: List[str]) -> Dict[str, OcrResult]:
+        """Найденные в кэше результаты; время использования найденных записей обновляется"""
+        if not keys:
+            return {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            placeholders = ",".join("?" * len(unique))
+            rows = self._conn.execute(
+                f"SELECT key, text, confidence FROM ocr_cache WHERE key IN ({placeholders})", unique
+            ).fetchall()
+            if rows:
+                now = time.time()
+                self._conn.executemany("UPDATE ocr_cache SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key, _, _ in rows])
+                self._conn.commit()
+        found = {key: OcrResult(text=text, confidence=confidence) for key, text, confidence in rows}
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items: List[Tuple[str, OcrResult]]):
+        """Сохраняет результаты и при необходимости вытесняет старые записи"""
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, result.text, result.confidence, len(result.text.encode("utf-8")) + len(key), now)
+                for key, result in items]
+        with self._lock:
+            self._conn.executemany('''
+                INSERT OR REPLACE INTO ocr_cache (key, text, confidence, size, last_used)
+                VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            self._conn.commit()
+            self._evict()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        to_free = total - int(self.max_bytes * EVICT_TO)
+        freed = 0
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM ocr_cache ORDER BY last_used"):
+            victims.append((key,))
+            freed += size
+            if freed >= to_free:
+                break
+        self._conn.executemany("DELETE FROM ocr_cache WHERE key = ?", victims)
+        self._conn.commit()
+        logging.info(f"[OCR][cache] Вытеснено записей: {len(victims)} ({freed} байт)")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_cache").fetchone()
+        return {"entries": count, "bytes": size, "hits": self.hits, "misses": self.misses}
+
+
+_cache: Optional[OcrCache] = None
+_cache_pid: Optional[int] = None
+_cache_lock = threading.Lock()
+
+
+def get_ocr_cache() -> Optional[OcrCache]:
+    """Кэш текущего процесса (соединение SQLite не переживает fork) или None, если выключен"""
+    global _cache, _cache_pid
+    if not OCR_CACHE_DIR:
+        return None
+    with _cache_lock:
+        if _cache is None or _cache_pid != os.getpid():
+            try:
+                _cache = OcrCache()
+                _cache_pid = os.getpid()
+            except Exception as e:
+                logging.error(f"[OCR][cache] Кэш недоступен: {e}")
+                return None
+        return _cache
@@ -0,0 +1,189 @@
+"""
+Предобработка изображений перед OCR (NumPy/OpenCV).
+
+Шаги выполняются в порядке OCR_PREPROCESS_STEPS, каждый замеряется отдельно:
+- crop — обрезка до листа документа и полей с текстом;
+- deskew — выравнивание наклона (поиск угла по профилю проекции строк);
+- scale — уменьшение до целевой высоты строчных букв (OCR_TARGET_XHEIGHT);
+- enhance — контраст (CLAHE) и подавление шума;
+- binarize — адаптивная бинаризация (неравномерное освещение на фото).
+По умолчанию включён только enhance (как до появления шагов): остальные
+включаются после замера точности на своих документах (benchmark_ocr.py --steps).
+Шаг scale не применяется к повторной отрисовке страницы с OCR_MAX_RESOLUTION,
+иначе повышение разрешения для неуверенных страниц сводилось бы на нет.
+"""
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+OCR_PREPROCESS_STEPS = os.getenv("OCR_PREPROCESS_STEPS", "enhance")
+# Высота строчных букв, px; крупнее — изображение уменьшается (не увеличивается никогда)
+OCR_TARGET_XHEIGHT = int(os.getenv("OCR_TARGET_XHEIGHT", "30"))
+MAX_SKEW_ANGLE = 15.0  # градусов; поворот на 90° (ориентация) не исправляется
+CROP_PADDING = 0.01    # доля стороны, оставляемая вокруг текста
+PAPER_SEARCH_SIZE = 1000  # px, большая сторона копии для поиска листа
+# Для оценки наклона хватает выборки пикселей текста
+DESKEW_SAMPLE = 200_000
+
+
+def _ink_mask(gray):
+    """Пиксели текста (True) по порогу Отсу"""
+    import cv2
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    return binary
+
+
+def crop_document(gray):
+    """
+    Обрезает фон вокруг листа (фото с телефона) и пустые поля вокруг текста.
+    Границы текста ищутся по проекциям строк и столбцов, без обхода контуров символов.
+    """
+    import cv2
+    import numpy as np
+    height, width = gray.shape
+    # Лист — крупнейшая светлая область; ищем её на уменьшенной копии
+    # и обрезаем, только если вокруг листа есть фон
+    factor = min(1.0, PAPER_SEARCH_SIZE / float(max(height, width)))
+    small = cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA) if factor < 1.0 else gray
+    blurred = cv2.GaussianBlur(small, (0, 0), 3)
+    _, paper = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    contours, _ = cv2.findContours(paper, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if contours:
+        x, y, w, h = (int(v / factor) for v in cv2.boundingRect(max(contours, key=cv2.contourArea)))
+        if 0.2 < (w * h) / float(width * height) < 0.95:
+            gray = gray[y:y + h, x:x + w]
+            height, width = gray.shape
+    ink = _ink_mask(gray) > 0
+    # Строки/столбцы, где текста больше шума (0.2% длины)
+    rows = np.flatnonzero(ink.sum(axis=1) > max(1, width // 500))
+    cols = np.flatnonzero(ink.sum(axis=0) > max(1, height // 500))
+    if rows.size == 0 or cols.size == 0:
+        return gray
+    pad_y, pad_x = int(height * CROP_PADDING), int(width * CROP_PADDING)
+    top, bottom = max(0, rows[0] - pad_y), min(height, rows[-1] + 1 + pad_y)
+    left, right = max(0, cols[0] - pad_x), min(width, cols[-1] + 1 + pad_x)
+    return gray[top:bottom, left:right]
+
+
+def estimate_skew(gray) -> float:
+    """
+    Угол наклона строк, градусы. Для каждого кандидата пиксели текста проецируются
+    на ось, перпендикулярную строкам: при верном угле гистограмма самая «резкая».
+    """
+    import numpy as np
+    ys, xs = np.nonzero(_ink_mask(gray))
+    if ys.size < 100:
+        return 0.0
+    if ys.size > DESKEW_SAMPLE:
+        pick = np.random.default_rng(0).choice(ys.size, DESKEW_SAMPLE, replace=False)
+        ys, xs = ys[pick], xs[pick]
+    ys = ys.astype(np.float32)
+    xs = xs.astype(np.float32)
+
+    def best(angles):
+        scores = []
+        for angle in angles:
+            theta = np.deg2rad(angle)
+            projected = ys * np.cos(theta) - xs * np.sin(theta)
+            projected = (projected - projected.min()).astype(np.int32)
+            hist = np.bincount(projected)
+            scores.append(float(np.sum(np.diff(hist).astype(np.float64) ** 2)))
+        return float(angles[int(np.argmax(scores))])
+
+    coarse = best(np.arange(-MAX_SKEW_ANGLE, MAX_SKEW_ANGLE + 0.01, 1.0))
+    return best(np.arange(coarse - 1.0, coarse + 1.01, 0.1))
+
+
+def deskew(gray):
+    """Поворачивает изображение так, чтобы строки стали горизонтальными"""
+    import cv2
+    import numpy as np
+    angle = estimate_skew(gray)
+    if abs(angle) < 0.1:
+        return gray
+    height, width = gray.shape
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    # Холст расширяется, чтобы углы страницы не обрезались
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    new_width = int(height * sin + width * cos)
+    new_height = int(height * cos + width * sin)
+    matrix[0, 2] += new_width / 2 - width / 2
+    matrix[1, 2] += new_height / 2 - height / 2
+    logging.info(f"[OCR][preprocess] deskew angle={angle:.1f}")
+    return cv2.warpAffine(gray, matrix, (new_width, new_height), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=255).astype(np.uint8)
+
+
+def estimate_x_height(gray) -> Optional[float]:
+    """Медианная высота символов (компонент связности разумного размера), px"""
+    import cv2
+    import numpy as np
+    count, _, stats, _ = cv2.connectedComponentsWithStats(_ink_mask(gray), connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    glyphs = heights[(areas >= 10) & (heights >= 4) & (heights <= gray.shape[0] // 10)]
+    if glyphs.size < 20:
+        return None
+    return float(np.median(glyphs))
+
+
+def scale_to_x_height(gray):
+    """Уменьшает изображение, если буквы крупнее OCR_TARGET_XHEIGHT (фото, высокое разрешение)"""
+    import cv2
+    x_height = estimate_x_height(gray)
+    if not x_height or x_height <= OCR_TARGET_XHEIGHT:
+        return gray
+    factor = OCR_TARGET_XHEIGHT / x_height
+    logging.info(f"[OCR][preprocess] x_height={x_height:.0f} scale={factor:.2f}")
+    return cv2.resize(gray, None, fx=factor, fy=factor, interpolation=cv2.INTER_AREA)
+
+
+def enhance_gray(gray):
+    """Контраст (CLAHE) и подавление шума для серого изображения (NumPy, uint8)"""
+    import cv2
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    gray = clahe.apply(gray)
+    return cv2.medianBlur(gray, 3)
+
+
+def binarize(gray):
+    """Адаптивная бинаризация: порог считается по окрестности, тени на фото не съедают текст"""
+    import cv2
+    block = max(15, (min(gray.shape) // 50) | 1)
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block, 15)
+
+
+STEPS = {
+    "crop": crop_document,
+    "deskew": deskew,
+    "scale": scale_to_x_height,
+    "enhance": enhance_gray,
+    "binarize": binarize,
+}
+
+
+def parse_steps(steps: Optional[str] = None) -> List[str]:
+    names = [name.strip() for name in (OCR_PREPROCESS_STEPS if steps is None else steps).split(",") if name.strip()]
+    unknown = [name for name in names if name not in STEPS]
+    if unknown:
+        raise ValueError(f"Неизвестные шаги OCR_PREPROCESS_STEPS: {unknown} (доступны: {', '.join(STEPS)})")
+    return names
+
+
+def preprocess(gray, steps: Optional[str] = None) -> Tuple[object, Dict[str, float]]:
+    """
+    Прогоняет серое изображение через шаги предобработки.
+    Возвращает (изображение, время каждого шага в мс).
+    """
+    timings = {}
+    original_shape = gray.shape
+    for name in parse_steps(steps):
+        started = time.perf_counter()
+        gray = STEPS[name](gray)
+        timings[name] = (time.perf_counter() - started) * 1000
+    logging.info(
+        f"[OCR][preprocess] {original_shape[1]}x{original_shape[0]} -> {gray.shape[1]}x{gray.shape[0]} "
+        + " ".join(f"{name}={ms:.1f}ms" for name, ms in timings.items())
+    )
+    return gray, timings
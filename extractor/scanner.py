@@ -0,0 +1,280 @@
+"""
+Сканер текста документа для быстрого пути извлечения полей.
+
+Шаблоны компилируются один раз при импорте. Текст приводится к нижнему регистру
+один раз, и все ключевые слова-якоря (ИНН, итого, договор, счёт…) находятся
+одним общим шаблоном (префиксное дерево слов) с позициями, в том числе вложенные
+(«к оплате» внутри «сумма к оплате»). Кандидаты в даты, ИНН, суммы и номера
+собираются за один проход по позициям, с которых они могут начинаться (цифра, «№», «N»):
+в каждой проверяются шаблоны подходящих классов. Общий шаблон-альтернация здесь
+не годится — совпадения классов перекрываются («01.02» внутри даты — тоже кандидат
+в сумму). Дальше extract_fields_fast выбирает значения по позициям, не пересматривая текст.
+"""
+import re
+from bisect import bisect_left
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+# Ключевые слова рядом с датой документа по его типу
+DATE_KEYWORDS = {
+    "акт": ["акт", "акта"],
+    "договор": ["договор", "contract"],
+    "счёт": ["счёт", "счет", "invoice"],
+    "упд": ["упд", "универсальный передаточный"],
+    "накладная": ["накладная"],
+}
+# Дальше этого расстояния от якоря дата не считается «рядом» (берётся первая дата)
+DATE_MAX_DISTANCE = 99999
+# Перед ИНН (в пределах INN_CONTEXT символов)
+INN_KEYWORDS = ["инн", "inn", "налогопл"]
+INN_CONTEXT = 20
+# Около суммы (в пределах AMOUNT_CONTEXT символов с каждой стороны)
+TOTAL_KEYWORDS = ["итого", "всего к оплате", "к оплате", "сумма к оплате", "amount due"]
+TAX_KEYWORDS = ["с ндс", "без ндс", "nds", "налог"]
+QUANTITY_KEYWORDS = [" шт", "кол-во", "ед."]
+AMOUNT_CONTEXT = 30
+# Заголовки, после которых (в пределах DOC_NUMBER_CONTEXT символов) ищется «№»
+DOC_NUMBER_KEYWORDS = ["счёт", "счет", "акт", "накладная", "упд", "invoice", "contract", "договор"]
+DOC_NUMBER_CONTEXT = 30
+
+ANCHOR_KEYWORDS = sorted(
+    {kw for kws in DATE_KEYWORDS.values() for kw in kws}
+    | set(INN_KEYWORDS) | set(TOTAL_KEYWORDS) | set(TAX_KEYWORDS)
+    | set(QUANTITY_KEYWORDS) | set(DOC_NUMBER_KEYWORDS)
+)
+
+
+def _trie_pattern(words: List[str]) -> str:
+    """
+    Альтернация слов в виде префиксного дерева: «акт|акта|амount» -> «а(?:кт(?:а)?|mount)».
+    В каждой позиции проверяется один символ, а не все слова по очереди
+    (по сути автомат Ахо–Корасик средствами re); совпадает самое длинное слово.
+    """
+    branches: Dict[str, List[str]] = {}
+    optional = False
+    for word in words:
+        if not word:
+            optional = True
+            continue
+        branches.setdefault(word[0], []).append(word[1:])
+    if not branches:
+        return ""
+    pattern = "(?:" + "|".join(re.escape(char) + _trie_pattern(rest) for char, rest in sorted(branches.items())) + ")"
+    return pattern + "?" if optional else pattern
+
+
+# В позиции совпадает самый длинный якорь, более короткие в той же позиции — его префиксы
+# («акт» в «акта»). Поиск продолжается со следующего символа, а не с конца совпадения,
+# чтобы найти и вложенные якоря («к оплате» внутри «сумма к оплате»)
+ANCHOR_RE = re.compile(_trie_pattern(ANCHOR_KEYWORDS))
+ANCHOR_PREFIXES = {kw: [other for other in ANCHOR_KEYWORDS if kw.startswith(other)] for kw in ANCHOR_KEYWORDS}
+
+CLEAN_RE = re.compile(r'[^\w\d\s.,:;!?@#№\-_/\\()\[\]{}"\'\n]', flags=re.UNICODE)
+DATE_RE = re.compile(r"\b\d{2}[./]\d{2}[./]\d{4}\b")
+TEXT_DATE_RE = re.compile(r"\b\d{2} [а-я]+ \d{4}\b")
+INN_RE = re.compile(r"\b\d{10}\b|\b\d{12}\b")
+AMOUNT_RE = re.compile(r"\b\d{1,3}(?:[\s\.\,]\d{3})*(?:[\.,]\d{2})?\b")
+NUMBER_RE = re.compile(r"№\s*([A-Za-zА-Яа-я0-9\-_/]{3,})")
+LATIN_NUMBER_RE = re.compile(r"\bN\s*([A-Za-zА-Яа-я0-9\-_/]{3,})")
+# Любой кандидат начинается с цифры на границе слова, с «№» или с «N» на границе слова:
+# текст проходится один раз по этим позициям, шаблоны классов проверяются только в них
+TOKEN_START_RE = re.compile(r"[\dN№](?<!\w[\dN])")
+# Классы кандидатов по первому символу: (поле TextScan, шаблон, группа значения)
+DIGIT_TOKENS = [("dates", DATE_RE, 0), ("text_dates", TEXT_DATE_RE, 0), ("inns", INN_RE, 0), ("amounts", AMOUNT_RE, 0)]
+NUMBER_TOKENS = [("numbers", NUMBER_RE, 1)]
+LATIN_NUMBER_TOKENS = [("latin_numbers", LATIN_NUMBER_RE, 1)]
+
+# Роли сторон: после них в строке — название контрагента
+COUNTERPARTY_ROLES = ["Заказчик", "Исполнитель", "Поставщик", "Получатель", "Продавец", "Покупатель", "Контрагент"]
+# Контрагент: первый сработавший шаблон по порядку
+COUNTERPARTY_RES = [re.compile(pat) for pat in (
+    r"(Общество с ограниченной ответственностью [\"'«][^\"'»]+[\"'»])",
+    r"(Акционерное общество [\"'«][^\"'»]+[\"'»])",
+    r"(Публичное акционерное общество [\"'«][^\"'»]+[\"'»])",
+    r"(Индивидуальный предприниматель [А-ЯЁ][а-яё]+ [А-ЯЁ][а-яё]+)",
+    r"(ООО\s+[\"'«][^\"'»]+[\"'»])",
+    r"(АО\s+[\"'«][^\"'»]+[\"'»])",
+    r"(ПАО\s+[\"'«][^\"'»]+[\"'»])",
+    r"(ИП\s+[А-ЯЁ][а-яё]+\s[А-ЯЁ][а-яё]+)",
+    *(rf"({role}:?\s*.+)" for role in COUNTERPARTY_ROLES),
+)]
+# Обрезка названия контрагента после запятой/скобки/конца строки
+COUNTERPARTY_END_RE = re.compile(r'[\n\r,\(\)]')
+# Номер договора: первый сработавший шаблон по порядку
+CONTRACT_NUMBER_RES = [re.compile(pat) for pat in (
+    r"Договор\s*№\s*([A-Za-zА-Яа-я0-9\-_/]+)",
+    r"Contract\s*No\.?\s*([A-Za-zА-Яа-я0-9\-_/]+)",
+    r"Соглашение\s*№\s*([A-Za-zА-Яа-я0-9\-_/]+)",
+    r"№\s*([A-Za-zА-Яа-я0-9\-_/]+)",
+    r"N\s*([A-Za-zА-Яа-я0-9\-_/]+)",
+)]
+
+
+class Candidate(NamedTuple):
+    """Найденное значение и его позиция в очищенном тексте"""
+    start: int
+    end: int
+    value: str
+
+
+@dataclass
+class TextScan:
+    """
+    Результат сканирования: кандидаты по классам и позиции якорей.
+    Позиции якорей и кандидатов каждого класса отсортированы (так их находит сканер),
+    поэтому «ближайший якорь» и «есть ли якорь в окне» ищутся бисекцией,
+    а не сравнением каждого кандидата с каждым якорем.
+    """
+    text: str
+    lower: str
+    dates: List[Candidate] = field(default_factory=list)
+    inns: List[Candidate] = field(default_factory=list)
+    amounts: List[Candidate] = field(default_factory=list)
+    numbers: List[Candidate] = field(default_factory=list)        # «№ 123», value — сам номер
+    latin_numbers: List[Candidate] = field(default_factory=list)  # «N 123»
+    anchors: Dict[str, List[int]] = field(default_factory=dict)   # якорь -> позиции начала
+    number_starts: List[int] = field(init=False)
+
+    def __post_init__(self):
+        self.number_starts = [number.start for number in self.numbers]
+
+    def anchor_positions(self, keyword: str) -> List[int]:
+        return self.anchors.get(keyword, [])
+
+    def has_anchor(self, keywords: Iterable[str], left: int, right: int) -> bool:
+        """Есть ли якорь из keywords целиком внутри text[left:right]"""
+        for kw in keywords:
+            positions = self.anchors.get(kw)
+            if positions:
+                # Достаточно проверить первое вхождение не левее left
+                i = bisect_left(positions, left)
+                if i < len(positions) and positions[i] + len(kw) <= right:
+                    return True
+        return False
+
+    def nearest_date(self, keywords: List[str]) -> Optional[Candidate]:
+        """
+        Дата, ближайшая к одному из якорей keywords (по началу). При равном расстоянии
+        выигрывает более ранний якорь (в порядке keywords, затем по позиции),
+        для одного якоря — более ранний кандидат в списке dates.
+        """
+        import numpy as np
+        kw_positions = [pos for kw in keywords for pos in self.anchor_positions(kw)]
+        if not kw_positions or not self.dates:
+            return None
+        # dates — сначала числовые, затем текстовые даты; сортируем по позиции
+        starts = np.array([date.start for date in self.dates])
+        order = np.argsort(starts, kind="stable")
+        sorted_starts = starts[order]
+        anchors = np.array(kw_positions)
+        # Для каждого якоря — ближайшие даты слева и справа
+        right = np.searchsorted(sorted_starts, anchors, side="left")
+        left = right - 1
+        right_idx = order[np.minimum(right, len(order) - 1)]
+        left_idx = order[np.maximum(left, 0)]
+        right_dist = np.where(right < len(order), starts[right_idx] - anchors, DATE_MAX_DISTANCE)
+        left_dist = np.where(left >= 0, anchors - starts[left_idx], DATE_MAX_DISTANCE)
+        take_left = (left_dist < right_dist) | ((left_dist == right_dist) & (left_idx < right_idx))
+        dist = np.where(take_left, left_dist, right_dist)
+        index = np.where(take_left, left_idx, right_idx)
+        best = int(np.argmin(dist))  # первый из равных
+        if dist[best] >= DATE_MAX_DISTANCE:
+            return None
+        return self.dates[int(index[best])]
+
+    def amount_scores(self):
+        """
+        Баллы кандидатов в сумму (NumPy-вектор): +3 за «итого»/«к оплате» в окне
+        ±AMOUNT_CONTEXT символов, +1 за упоминание НДС, −1 за «шт»/«кол-во».
+        """
+        import numpy as np
+        starts = np.array([amount.start for amount in self.amounts], dtype=np.int64)
+        ends = np.array([amount.end for amount in self.amounts], dtype=np.int64)
+        left = np.maximum(0, starts - AMOUNT_CONTEXT)
+        right = np.minimum(len(self.text), ends + AMOUNT_CONTEXT)
+
+        def near(keywords):
+            hit = np.zeros(len(self.amounts), dtype=bool)
+            for kw in keywords:
+                positions = self.anchors.get(kw)
+                if positions:
+                    # Вхождения с началом в [left, right - len(kw)]
+                    positions = np.array(positions)
+                    hit |= np.searchsorted(positions, right - len(kw), side="right") > np.searchsorted(positions, left, side="left")
+            return hit
+
+        return 3 * near(TOTAL_KEYWORDS) + near(TAX_KEYWORDS) - near(QUANTITY_KEYWORDS).astype(np.int64)
+
+    def number_after(self, pos: int, limit: int = DOC_NUMBER_CONTEXT) -> Optional[str]:
+        """Номер «№ …» в пределах limit символов после pos"""
+        # Без «№» в окне шаблон не совпадёт — проверяем по отсортированным позициям
+        i = bisect_left(self.number_starts, pos)
+        if i == len(self.number_starts) or self.number_starts[i] >= pos + limit:
+            return None
+        m = NUMBER_RE.search(self.text, pos, pos + limit)
+        return m.group(1) if m else None
+
+
+def clean_text(text: str) -> str:
+    # Удаляем лишние пробелы, пустые строки, оставляем только буквы, цифры, знаки препинания
+    text = CLEAN_RE.sub('', text)
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    return ' '.join(lines)
+
+
+def scan_text(clean: str) -> TextScan:
+    """Сканирует очищенный текст (clean_text): кандидаты и якоря с позициями"""
+    lower = clean.lower()
+    anchors: Dict[str, List[int]] = {}
+    m = ANCHOR_RE.search(lower)
+    while m:
+        for kw in ANCHOR_PREFIXES[m.group()]:
+            anchors.setdefault(kw, []).append(m.start())
+        m = ANCHOR_RE.search(lower, m.start() + 1)
+
+    found: Dict[str, List[Candidate]] = {name: [] for name, _, _ in DIGIT_TOKENS + NUMBER_TOKENS + LATIN_NUMBER_TOKENS}
+    # Кандидаты одного класса не перекрываются (как у finditer): следующий — не раньше конца предыдущего
+    resume = dict.fromkeys(found, 0)
+    for start in TOKEN_START_RE.finditer(clean):
+        pos = start.start()
+        char = clean[pos]
+        tokens = NUMBER_TOKENS if char == "№" else LATIN_NUMBER_TOKENS if char == "N" else DIGIT_TOKENS
+        for name, pattern, group in tokens:
+            if pos < resume[name]:
+                continue
+            m = pattern.match(clean, pos)
+            if m:
+                found[name].append(Candidate(pos, m.end(), m.group(group)))
+                resume[name] = m.end()
+    return TextScan(
+        text=clean,
+        lower=lower,
+        # Сначала даты вида 01.02.2024, затем «1 февраля 2024»
+        dates=found["dates"] + found["text_dates"],
+        inns=found["inns"],
+        amounts=found["amounts"],
+        numbers=found["numbers"],
+        latin_numbers=found["latin_numbers"],
+        anchors=anchors,
+    )
+
+
+def find_counterparty(clean: str) -> Optional[str]:
+    for pat in COUNTERPARTY_RES:
+        m = pat.search(clean)
+        if m:
+            val = m.group(1).strip()
+            val = COUNTERPARTY_END_RE.split(val)[0].strip()
+            if 3 < len(val) < 100:
+                return val
+    return None
+
+
+def find_contract_number(clean: str) -> Optional[str]:
+    for pat in CONTRACT_NUMBER_RES:
+        m = pat.search(clean)
+        if m:
+            val = m.group(1).strip()
+            if 2 < len(val) < 50:
+                return val
+    return None
@@ -0,0 +1,91 @@
+"""
+Разделение пачки сканов на отдельные документы.
+
+Бухгалтерия часто сканирует договор, несколько счетов и актов в один PDF.
+Страница считается началом нового документа по заголовку в её верхних строках
+(«Счёт № … от …», «Акт», «Договор»…) и по сбросу нумерации страниц
+(«Страница 1 из 3»); страница с номером больше 1 — продолжение предыдущего.
+"""
+import logging
+import os
+import re
+from typing import List, Optional, Tuple
+
+SPLIT_BUNDLES = os.getenv("SPLIT_BUNDLES", "1") == "1"
+HEADER_LINES = 8  # заголовок документа ищется в первых строках страницы
+
+# Заголовок документа в начале строки
+TITLE_RE = re.compile(
+    r"^\s*(?:счет[-\s]фактура|счёт[-\s]фактура|счет на оплату|счёт на оплату|счет|счёт|акт|"
+    r"товарная накладная|товарно-транспортная накладная|накладная|"
+    r"универсальный передаточный документ|упд|договор|invoice|contract)\b",
+    re.IGNORECASE
+)
+# «№ 123 от 01.02.2024» / «№ 123 от 1 февраля 2024»
+NUMBER_DATE_RE = re.compile(r"№\s*[\w\-/]+\s+от\s+\d", re.IGNORECASE)
+# Номер страницы: «Страница 2», «стр. 2 из 5», «Лист 2», «2 из 5», «Page 2 of 5»
+PAGE_NUMBER_RE = re.compile(
+    r"(?:страница|стр\.|лист|page)\s*(\d{1,3})(?:\s*(?:из|of)\s*\d{1,3})?|\b(\d{1,3})\s+из\s+\d{1,3}\b",
+    re.IGNORECASE
+)
+# Приложения и продолжения относятся к предыдущему документу
+CONTINUATION_RE = re.compile(r"^\s*(?:приложение|продолжение|окончание)\b", re.IGNORECASE)
+
+
+def page_number(text: str) -> Optional[int]:
+    """Номер страницы, напечатанный на ней (ищется в первых и последних строках)"""
+    lines = [line for line in text.splitlines() if line.strip()]
+    for line in lines[:3] + lines[-3:]:
+        m = PAGE_NUMBER_RE.search(line)
+        if m:
+            return int(m.group(1) or m.group(2))
+    return None
+
+
+def starts_document(text: str) -> bool:
+    """Начинается ли на странице новый документ"""
+    number = page_number(text)
+    if number is not None and number > 1:
+        return False
+    header = [line for line in text.splitlines() if line.strip()][:HEADER_LINES]
+    if any(CONTINUATION_RE.match(line) for line in header[:2]):
+        return False
+    titled = any(TITLE_RE.match(line) for line in header)
+    numbered = any(NUMBER_DATE_RE.search(line) for line in header)
+    # Заголовок с «№ … от» — уверенно; одна из примет — только вместе со сбросом нумерации
+    return (titled and numbered) or (number == 1 and (titled or numbered))
+
+
+def split_ranges(page_texts: List[str]) -> List[Tuple[int, int]]:
+    """Диапазоны страниц [start, end) отдельных документов пачки"""
+    if not page_texts:
+        return []
+    starts = [0] + [i for i in range(1, len(page_texts)) if starts_document(page_texts[i])]
+    ends = starts[1:] + [len(page_texts)]
+    return list(zip(starts, ends))
+
+
+def write_pdf_parts(file_path: str, ranges: List[Tuple[int, int]], dest_dir: str, prefix: str,
+                    indices: Optional[List[int]] = None) -> List[str]:
+    """
+    Сохраняет диапазоны страниц отдельными PDF (выполняется в процессе пула).
+    indices: номера документов пачки для имён файлов (по умолчанию 0..len(ranges)-1).
+    """
+    import pypdfium2 as pdfium
+    source = pdfium.PdfDocument(file_path)
+    paths = []
+    try:
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        for i, (start, end) in zip(range(len(ranges)) if indices is None else indices, ranges):
+            part = pdfium.PdfDocument.new()
+            try:
+                part.import_pages(source, list(range(start, end)))
+                path = os.path.join(dest_dir, f"{prefix}_{stem}_part{i + 1}.pdf")
+                part.save(path)
+                paths.append(path)
+            finally:
+                part.close()
+    finally:
+        source.close()
+    logging.info(f"[PDF] {file_path} разделён на {len(paths)} документов: {ranges}")
+    return paths
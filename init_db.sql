@@ -16,10 +16,14 @@ CREATE TABLE IF NOT EXISTS documents (
     contract_number VARCHAR(100),
     storage_path TEXT NOT NULL,
     telegram_user_id BIGINT,
+    content_hash VARCHAR(64), -- SHA-256 исходного файла для дедупликации
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Для баз, созданных до появления дедупликации
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64);
+
 -- Создание таблицы контрагентов
 CREATE TABLE IF NOT EXISTS counterparties (
     id SERIAL PRIMARY KEY,
@@ -63,6 +67,7 @@ CREATE INDEX IF NOT EXISTS idx_documents_inn ON documents(inn);
 CREATE INDEX IF NOT EXISTS idx_documents_doc_type ON documents(doc_type);
 CREATE INDEX IF NOT EXISTS idx_documents_date ON documents(date);
 CREATE INDEX IF NOT EXISTS idx_documents_contract_number ON documents(contract_number);
+CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents(content_hash);
 
 CREATE INDEX IF NOT EXISTS idx_business_chains_contract_number ON business_chains(contract_number);
 CREATE INDEX IF NOT EXISTS idx_business_chains_counterparty ON business_chains(counterparty);
@@ -128,9 +133,11 @@ END;
 $$ language 'plpgsql';
 
 -- Создание триггеров для автоматического обновления updated_at
+DROP TRIGGER IF EXISTS update_documents_updated_at ON documents;
 CREATE TRIGGER update_documents_updated_at BEFORE UPDATE ON documents
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+DROP TRIGGER IF EXISTS update_business_chains_updated_at ON business_chains;
 CREATE TRIGGER update_business_chains_updated_at BEFORE UPDATE ON business_chains
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
@@ -154,4 +161,53 @@ CREATE TABLE IF NOT EXISTS llm_cache (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
-CREATE INDEX IF NOT EXISTS idx_llm_cache_prompt_hash ON llm_cache(prompt_hash);
\ No newline at end of file
+CREATE INDEX IF NOT EXISTS idx_llm_cache_prompt_hash ON llm_cache(prompt_hash);
+
+-- Очередь задач обработки документов (общая для нескольких воркеров и хостов)
+-- Скрипт идемпотентен: при старте бот и воркеры применяют его к существующей базе (PostgresStorage._init_database)
+-- Задачи забираются через SELECT ... FOR UPDATE SKIP LOCKED; visible_at — окончание аренды
+CREATE TABLE IF NOT EXISTS processing_tasks (
+    id UUID PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    filename VARCHAR(255) NOT NULL,
+    file_path TEXT NOT NULL,
+    content_hash VARCHAR(64),
+    status VARCHAR(20) NOT NULL DEFAULT 'pending', -- pending, processing, completed, failed, validation_failed
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    visible_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_by VARCHAR(255),
+    result JSONB,
+    error TEXT,
+    validation_errors JSONB,
+    validation_warnings JSONB,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    completed_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_processing_tasks_claim ON processing_tasks(status, visible_at);
+CREATE INDEX IF NOT EXISTS idx_processing_tasks_user_id ON processing_tasks(user_id, created_at);
+-- Поиск того же файла среди задач, которые ещё обрабатываются (дедупликация при постановке)
+CREATE INDEX IF NOT EXISTS idx_processing_tasks_active_hash ON processing_tasks(user_id, content_hash)
+    WHERE status IN ('pending', 'processing');
+
+DROP TRIGGER IF EXISTS update_processing_tasks_updated_at ON processing_tasks;
+CREATE TRIGGER update_processing_tasks_updated_at BEFORE UPDATE ON processing_tasks
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
+COMMENT ON TABLE processing_tasks IS 'Надёжная очередь задач обработки документов';
+
+-- Уведомления пользователям от воркеров; отправляет их процесс бота
+CREATE TABLE IF NOT EXISTS task_notifications (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    message TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    delivered_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_task_notifications_pending ON task_notifications(id) WHERE delivered_at IS NULL;
+
+COMMENT ON TABLE task_notifications IS 'Очередь уведомлений пользователям от воркеров обработки';
@@ -371,7 +371,8 @@ class DocumentStorage:
         }
 
 # Импортируем PostgreSQL хранилище
-from .postgres_storage import postgres_storage
+from .postgres_storage import postgres_storage, compute_file_hash
+from .task_queue import PostgresTaskQueue, task_queue
 
 # Глобальный экземпляр хранилища (PostgreSQL)
 storage = postgres_storage 
\ No newline at end of file
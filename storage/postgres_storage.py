@@ -1,5 +1,6 @@
 import os
 import shutil
+import hashlib
 import logging
 import psycopg2
 from psycopg2.extras import RealDictCursor
@@ -9,6 +10,19 @@ from typing import Dict, List, Optional, Tuple
 from contextlib import contextmanager
 import re
 
+# Схема базы: применяется при каждом запуске, все операторы идемпотентны
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "init_db.sql"
+# Ключ pg_advisory_xact_lock: бот и воркеры, стартующие одновременно, применяют схему по очереди
+SCHEMA_LOCK_ID = 7314002
+
+def compute_file_hash(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Считает SHA-256 файла потоково, не загружая его в память целиком"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 class PostgresStorage:
     def __init__(self, base_path: str = "data/documents", db_url: str = None):
         self.base_path = Path(base_path)
@@ -45,13 +59,24 @@ class PostgresStorage:
                 conn.close()
     
     def _init_database(self):
-        """Проверяет подключение к базе данных"""
+        """
+        Проверяет подключение к базе данных и применяет схему init_db.sql.
+        docker-entrypoint-initdb.d выполняет её только на пустом томе, поэтому новые
+        таблицы и столбцы (очередь задач, content_hash) существующей базе добавляются здесь.
+        """
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cursor:
                     cursor.execute("SELECT version();")
                     version = cursor.fetchone()
                     logging.info(f"Подключение к PostgreSQL: {version[0]}")
+                    if SCHEMA_PATH.exists():
+                        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_ID,))
+                        cursor.execute(SCHEMA_PATH.read_text(encoding="utf-8"))
+                        conn.commit()
+                        logging.info(f"Схема базы данных применена: {SCHEMA_PATH}")
+                    else:
+                        logging.warning(f"Файл схемы не найден: {SCHEMA_PATH}")
         except Exception as e:
             logging.error(f"Ошибка инициализации базы данных: {e}")
             raise
@@ -106,6 +131,16 @@ class PostgresStorage:
         logging.warning(f"Не удалось распарсить дату: {date_str}")
         return None
     
+    def _format_russian_date(self, value) -> Optional[str]:
+        """Дата из PostgreSQL в русском формате: date(2024, 3, 12) -> 12.03.2024"""
+        return value.strftime("%d.%m.%Y") if value is not None else None
+    
+    def _format_russian_amount(self, value) -> Optional[str]:
+        """Сумма из PostgreSQL в русском формате: Decimal("1570134.00") -> 1 570 134,00"""
+        if value is None:
+            return None
+        return f"{value:,.2f}".replace(",", " ").replace(".", ",")
+    
     def _parse_russian_amount(self, amount_str: str) -> float:
         """
         Парсит русскую сумму в числовое значение для PostgreSQL
@@ -152,10 +187,13 @@ class PostgresStorage:
             logging.warning(f"Не удалось распарсить сумму: {amount_str}")
             return 0.0
     
-    def save_document(self, file_path: str, doc_data: Dict, telegram_user_id: int) -> int:
+    def save_document(self, file_path: str, doc_data: Dict, telegram_user_id: int,
+                      content_hash: Optional[str] = None) -> int:
         """
         Сохраняет документ в соответствующую папку и записывает в БД
         
+        content_hash: SHA-256 исходного файла, по нему находятся повторно присланные документы
+        
         Returns:
             int: ID документа в базе данных
         """
@@ -190,14 +228,14 @@ class PostgresStorage:
                     INSERT INTO documents (
                         filename, original_filename, doc_type, counterparty, inn, 
                         doc_number, date, amount, subject, contract_number, 
-                        storage_path, telegram_user_id
-                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        storage_path, telegram_user_id, content_hash
+                    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
                     RETURNING id
                 ''', (
                     new_filename, original_filename, doc_type, counterparty,
                     doc_data.get('inn'), doc_data.get('doc_number'), parsed_date,
                     parsed_amount, doc_data.get('subject'), doc_data.get('contract_number'),
-                    str(target_path), telegram_user_id
+                    str(target_path), telegram_user_id, content_hash
                 ))
                 
                 doc_id = cursor.fetchone()[0]
@@ -219,6 +257,34 @@ class PostgresStorage:
         logging.info(f"Документ сохранён: {target_path} (ID: {doc_id})")
         return doc_id
     
+    def find_document_by_hash(self, content_hash: str) -> Optional[Dict]:
+        """
+        Ищет ранее сохранённый документ с тем же содержимым
+        
+        Returns:
+            Dict: {'doc_id': ..., 'fields': {...}} или None
+        """
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute('''
+                    SELECT id, doc_type, counterparty, inn, doc_number, date, amount,
+                           subject, contract_number
+                    FROM documents
+                    WHERE content_hash = %s
+                    ORDER BY id
+                    LIMIT 1
+                ''', (content_hash,))
+                row = cursor.fetchone()
+        if not row:
+            return None
+        row = dict(row)
+        doc_id = row.pop('id')
+        # Дата и сумма приводятся к виду только что извлечённых полей: «12.03.2024», «11 900,00»
+        row['date'] = self._format_russian_date(row['date'])
+        row['amount'] = self._format_russian_amount(row['amount'])
+        fields = {k: (str(v) if v is not None else None) for k, v in row.items()}
+        return {'doc_id': doc_id, 'fields': fields}
+    
     def _sanitize_filename(self, filename: str) -> str:
         """Создаёт безопасное имя файла/папки"""
         import re
@@ -364,6 +430,17 @@ class PostgresStorage:
                 
                 return chain_dict
     
+    def get_labelled_documents(self, limit: int = None) -> List[Dict]:
+        """Тип и путь к файлу сохранённых документов (обучающая выборка классификатора), новые первыми"""
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute('''
+                    SELECT id, doc_type, storage_path FROM documents
+                    ORDER BY created_at DESC
+                    LIMIT %s
+                ''', (limit,))
+                return [dict(row) for row in cursor.fetchall()]
+
     def get_database_stats(self) -> Dict:
         """Получает статистику базы данных"""
         with self.get_connection() as conn:
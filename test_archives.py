@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Тест потокового чтения ZIP (extractor.archives): имена в cp866, пропуск
+неподдерживаемых элементов, лимиты размера и повтор задачи архива.
+"""
+
+import os
+import tempfile
+import zipfile
+
+from extractor import archives
+from extractor.archives import iter_archive_members
+
+MB = 1024 * 1024
+
+
+class Cp866Info(zipfile.ZipInfo):
+    """Элемент, как его пишут архиваторы Windows: имя в cp866 без флага UTF-8"""
+
+    def _encodeFilenameFlags(self):
+        return self.filename.encode("cp866"), self.flag_bits
+
+
+def make_zip(path, entries):
+    """entries: (имя, содержимое или размер в байтах, имя в cp866)"""
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data, cp866 in entries:
+            data = b"\0" * data if isinstance(data, int) else data
+            archive.writestr(Cp866Info(name) if cp866 else zipfile.ZipInfo(name), data)
+
+
+def read_archive(entries, already_queued=None):
+    """Перебирает архив во временном каталоге: (элементы, пропущенные, файлы на диске)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        zip_path = os.path.join(tmp, "upload.zip")
+        make_zip(zip_path, entries)
+        dest_dir = os.path.join(tmp, "out")
+        os.makedirs(dest_dir)
+        skipped = []
+        members = list(iter_archive_members(zip_path, dest_dir, "t", skipped, already_queued=already_queued))
+        return members, skipped, sorted(os.listdir(dest_dir))
+
+
+def test_cp866_names():
+    """Кириллица в cp866 без флага UTF-8 и в UTF-8 читается одинаково"""
+    print("🧪 Имена в cp866...")
+    members, skipped, files = read_archive([
+        ("Документы/Счёт № 15.pdf", b"%PDF-1.4", True),
+        ("Акт сверки.xlsx", b"PK", False),
+    ])
+    assert [m.filename for m in members] == ["Счёт № 15.pdf", "Акт сверки.xlsx"], members
+    assert files == ["t_0_Счёт № 15.pdf", "t_1_Акт сверки.xlsx"] and not skipped
+    print("✅ Совпадает")
+
+
+def test_unsupported_skipped():
+    """Служебные файлы macOS, скрытые файлы, каталоги и неподдерживаемые форматы не ставятся в очередь"""
+    print("🧪 Пропуск элементов...")
+    members, skipped, files = read_archive([
+        ("scans/", b"", False),
+        ("__MACOSX/scans/._act.pdf", b"meta", False),
+        (".DS_Store", b"meta", False),
+        ("notes.txt", b"text", False),
+        ("inner.zip", b"PK", False),
+        ("scans/act.PDF", b"%PDF-1.4", False),
+    ])
+    assert [(m.index, m.filename) for m in members] == [(0, "act.PDF")], members
+    assert skipped == ["._act.pdf", ".DS_Store", "notes.txt", "inner.zip"], skipped
+    assert files == ["t_0_act.PDF"]
+    print("✅ Совпадает")
+
+
+def test_size_limits():
+    """Элемент больше ZIP_MAX_MEMBER_MB пропускается; после ZIP_MAX_TOTAL_MB архив дальше не распаковывается"""
+    print("🧪 Лимиты размера...")
+    member_mb, total_mb = archives.ZIP_MAX_MEMBER_MB, archives.ZIP_MAX_TOTAL_MB
+    archives.ZIP_MAX_MEMBER_MB, archives.ZIP_MAX_TOTAL_MB = 2, 5
+    try:
+        members, skipped, files = read_archive([
+            ("a.pdf", 3 * MB, False),
+            ("b.pdf", 2 * MB, False),
+            ("c.pdf", 2 * MB, False),
+            ("d.pdf", MB + MB // 2, False),
+            ("e.pdf", MB // 2, False),
+        ])
+    finally:
+        archives.ZIP_MAX_MEMBER_MB, archives.ZIP_MAX_TOTAL_MB = member_mb, total_mb
+    # a — больше лимита элемента; b, c — 4 МБ; d не умещается в оставшийся 1 МБ — дальше стоп
+    assert [m.filename for m in members] == ["b.pdf", "c.pdf"], members
+    assert skipped == ["a.pdf", "d.pdf", "e.pdf"], skipped
+    assert files == ["t_1_b.pdf", "t_2_c.pdf"], files
+    print("✅ Совпадает")
+
+
+def test_already_queued_resume():
+    """Повтор задачи архива: поставленные ранее элементы не распаковываются, но остаются в списке с теми же номерами"""
+    print("🧪 Повтор задачи архива...")
+    entries = [(f"doc{i}.pdf", f"%PDF {i}".encode(), False) for i in range(4)]
+    first, _, _ = read_archive(entries)
+    members, skipped, files = read_archive(entries, already_queued=lambda index: index < 2)
+    assert [(m.index, m.filename) for m in members] == [(m.index, m.filename) for m in first]
+    assert [m.file_path is None for m in members] == [True, True, False, False]
+    assert [m.content_hash for m in members[2:]] == [m.content_hash for m in first[2:]]
+    assert files == ["t_2_doc2.pdf", "t_3_doc3.pdf"] and not skipped
+    print("✅ Совпадает")
+
+
+def test_resume_counts_queued_size():
+    """При повторе элементы, поставленные в очередь ранее, учитываются в ZIP_MAX_TOTAL_MB"""
+    print("🧪 Общий лимит при повторе...")
+    entries = [(f"doc{i}.pdf", 2 * MB, False) for i in range(4)]
+    member_mb, total_mb = archives.ZIP_MAX_MEMBER_MB, archives.ZIP_MAX_TOTAL_MB
+    archives.ZIP_MAX_MEMBER_MB, archives.ZIP_MAX_TOTAL_MB = 2, 5
+    try:
+        first, first_skipped, _ = read_archive(entries)
+        members, skipped, files = read_archive(entries, already_queued=lambda index: index < 2)
+    finally:
+        archives.ZIP_MAX_MEMBER_MB, archives.ZIP_MAX_TOTAL_MB = member_mb, total_mb
+    # doc0, doc1 — 4 МБ из 5; doc2 не умещается ни в первой попытке, ни при повторе
+    assert [m.filename for m in first] == ["doc0.pdf", "doc1.pdf"] and first_skipped == ["doc2.pdf", "doc3.pdf"]
+    assert [(m.filename, m.file_path) for m in members] == [("doc0.pdf", None), ("doc1.pdf", None)], members
+    assert skipped == ["doc2.pdf", "doc3.pdf"] and not files, (skipped, files)
+    print("✅ Совпадает")
+
+
+def test_corrupt_member_removed():
+    """Повреждённый элемент пропускается, недописанный файл не остаётся на диске"""
+    print("🧪 Повреждённый элемент...")
+    with tempfile.TemporaryDirectory() as tmp:
+        zip_path = os.path.join(tmp, "upload.zip")
+        with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as archive:
+            archive.writestr("broken.pdf", b"\0" * (3 * MB))
+            archive.writestr("ok.pdf", b"%PDF-1.4")
+        # Портим байт в конце данных broken.pdf: CRC не сойдётся после записи первых мегабайт
+        with zipfile.ZipFile(zip_path) as archive:
+            info = archive.getinfo("broken.pdf")
+        data_offset = info.header_offset + 30 + len(info.filename.encode()) + len(info.extra)
+        with open(zip_path, "r+b") as f:
+            f.seek(data_offset + info.file_size - 1)
+            f.write(b"\1")
+        dest_dir = os.path.join(tmp, "out")
+        os.makedirs(dest_dir)
+        skipped = []
+        members = list(iter_archive_members(zip_path, dest_dir, "t", skipped))
+        files = sorted(os.listdir(dest_dir))
+    assert [m.filename for m in members] == ["ok.pdf"] and skipped == ["broken.pdf"], (members, skipped)
+    assert files == ["t_1_ok.pdf"], files
+    print("✅ Совпадает")
+
+
+def main():
+    test_cp866_names()
+    test_unsupported_skipped()
+    test_size_limits()
+    test_already_queued_resume()
+    test_resume_counts_queued_size()
+    test_corrupt_member_removed()
+    print("\n🎉 Все тесты пройдены")
+
+
+if __name__ == "__main__":
+    main()
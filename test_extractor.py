@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Тест быстрого пути извлечения полей (extract_fields_fast).
+
+Ожидаемые значения корпуса зафиксированы по прежней реализации (регулярки
+по всему тексту, сравнение каждой даты с каждым ключевым словом): выбор
+полей сканером и поиском ближайшего якоря должен с ней совпадать.
+Опрос LLM по окнам (_ask_windows) проверяется с подменённым query_ollama.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+import extractor
+from extractor import extract_fields_fast, extract_fields_scored, fields_for_llm, clean_text, MAX_CHARS
+from extractor.excerpts import plan_excerpt_windows
+from extractor.scanner import DATE_KEYWORDS, TOTAL_KEYWORDS, TAX_KEYWORDS, QUANTITY_KEYWORDS
+
+CORPUS = [
+    ("счёт", """СЧЕТ НА ОПЛАТУ № 2024-117 от 12.03.2024
+Поставщик: ООО "Ромашка", ИНН 7701234567, КПП 770101001
+Покупатель: ООО «Вектор», ИНН 5012345678
+№ Наименование Кол-во Ед. Цена Сумма
+1 Бумага А4 10 шт 350,00 3 500,00
+2 Картридж 2 шт 4 200,00 8 400,00
+Итого: 11 900,00
+В том числе НДС 20%: 1 983,33
+Всего к оплате: 11 900,00 руб.""",
+     {'inn': '7701234567', 'counterparty': 'ООО "Ромашка"', 'doc_number': '2024-117',
+      'date': '12.03.2024', 'amount': '20', 'contract_number': '2024-117'}),
+    ("акт", """Акт № 45 от 31 марта 2024
+об оказании услуг по договору № Д-12/2023 от 10.01.2023
+Исполнитель: ИП Петров Сергей, ИНН 773301234567
+Заказчик: АО «Газпромторг»
+Услуги оказаны полностью, претензий нет.
+Итого без НДС 150 000,00""",
+     {'inn': '773301234567', 'counterparty': 'ИП Петров Сергей', 'doc_number': 'Д-12/2023',
+      'date': '31 марта 2024', 'amount': '150 000,00'}),
+    ("упд", """Универсальный передаточный документ
+Счёт-фактура № УТ-889 от 05.02.2024
+Статус 1
+Продавец: ПАО «Сталь» ИНН/КПП 7705123456/770501001
+Покупатель: ООО "Техно"
+Всего к оплате 1 234 567,89 с НДС""",
+     {'inn': '7705123456', 'counterparty': 'ООО "Техно"', 'doc_number': 'УТ-889',
+      'date': '05.02.2024', 'amount': '1 234 567,89', 'contract_number': 'УТ-889'}),
+    ("накладная", """ТОВАРНАЯ НАКЛАДНАЯ № ТН-77 от 14.05.2024
+Грузоотправитель: ООО «Склад»
+Кол-во 120 шт, масса 1.250 кг
+Итого 98 400,00
+Дата отгрузки 15.05.2024""",
+     {'doc_number': 'ТН-77', 'date': '14.05.2024', 'amount': '15.05', 'contract_number': 'ТН-77'}),
+    ("договор", """ДОГОВОР ПОСТАВКИ № П-2024/15
+г. Москва 20 января 2024
+Общество с ограниченной ответственностью "Альфа", именуемое Поставщик, ИНН 7712345678,
+и Акционерное общество «Бета», именуемое Покупатель, заключили настоящий договор:
+1. Поставка производится до 01.03.2024.
+2. Оплата в течение 10 дней, сумма договора 2 500 000,00 руб. с НДС.
+3. Договор действует до 31.12.2024.""",
+     {'inn': '7712345678', 'counterparty': 'Общество с ограниченной ответственностью "Альфа"',
+      'doc_number': 'П-2024/15', 'date': '31.12.2024', 'amount': '2 500 000,00', 'contract_number': 'П-2024/15'}),
+    ("договор", """Contract No. C-778 dated 01.04.2024
+Supplier INN 7709876543
+Amount due 15 000.00""",
+     {'inn': '7709876543', 'date': '01.04.2024', 'amount': '15 000.00', 'contract_number': 'C-778'}),
+    (None, """Письмо 01.06.2024
+Просим оплатить N 5567 до 10.06.2024
+Контрагент: ООО Гамма, Москва""",
+     {'counterparty': 'Контрагент: ООО Гамма', 'doc_number': '5567', 'date': '01.06.2024',
+      'amount': '01.06', 'contract_number': '5567'}),
+    ("иной", "Справка № 12 от 02.02.2024, налогоплательщик 500100732259, сумма 99,00",
+     {'inn': '500100732259', 'date': '02.02.2024', 'amount': '12'}),
+    ("счёт", "", {}),
+    ("акт", "Настоящий акт составлен в двух экземплярах", {}),
+    ("счёт", "Счет выставлен согласно прайсу, срок 5 дней. Ссылка № 778-A",
+     {'doc_number': '778-A', 'amount': '5', 'contract_number': '778-A'}),
+    ("счёт", "Счёт № 5 тел. 9161234567 ИНН 7701234567 сумма 500,00",
+     {'inn': '7701234567', 'amount': '5'}),
+    # Даты на равном расстоянии от «акт»: выигрывает первая найденная
+    ("акт", "01 марта 2024 акт 01.02.2024 акт 02.03.2024",
+     {'date': '01.02.2024', 'amount': '01'}),
+]
+
+
+def long_contract(paragraphs, seed):
+    """Длинный договор с сотнями дат и сумм (как из DOCX)"""
+    rng = random.Random(seed)
+    words = ("стороны обязуются выполнить работы в соответствии с техническим заданием "
+             "условиями настоящего порядке сроки оплаты приемки результатов ответственность").split()
+    lines = ['ДОГОВОР № Д-45/2024 от 15.01.2024',
+             'ООО "Ромашка", ИНН 7701234567, именуемое Заказчик, и ООО «Вектор» ИНН 5012345678']
+    for i in range(paragraphs):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(10, 40)))
+        extra = rng.choice([
+            "", f" до {rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.2024",
+            f" в размере {rng.randint(1, 999)} {rng.randint(100, 999)},00 руб. с НДС",
+            " согласно акта сдачи-приемки", f" по счету № {rng.randint(100, 999)}",
+            f" {rng.randint(10, 28)} марта 2024 года", " Кол-во 5 шт",
+        ])
+        lines.append(f"{i + 1}. {text}{extra}.")
+    lines.append("Итого по договору: 1 234 567,89 руб. с НДС")
+    return "\n".join(lines)
+
+
+LONG_CORPUS = [
+    (300, 1, "договор", '15.01.2024', '1 234 567,89', '921'),
+    (300, 1, "акт", '17.07.2024', '1 234 567,89', '921'),
+    (300, 1, "счёт", '23 марта 2024', '1 234 567,89', '921'),
+    (1000, 2, "договор", '15.01.2024', '271 562,00', '365'),
+    (1000, 2, "акт", '11 марта 2024', '271 562,00', '365'),
+    (1000, 2, "счёт", '03.02.2024', '271 562,00', '365'),
+]
+
+
+def reference_date(text, doc_type):
+    """Прежний выбор даты: каждое ключевое слово сравнивается с каждой датой"""
+    clean = clean_text(text)
+    dates = [(m.start(), m.group(0)) for pat in (r"\b\d{2}[./]\d{2}[./]\d{4}\b", r"\b\d{2} [а-я]+ \d{4}\b")
+             for m in re.finditer(pat, clean)]
+    best, best_dist = None, 99999
+    for kw in DATE_KEYWORDS.get(doc_type, []):
+        for m in re.finditer(kw, clean.lower()):
+            for pos, value in dates:
+                if abs(pos - m.start()) < best_dist:
+                    best_dist, best = abs(pos - m.start()), value
+    return best or (dates[0][1] if dates else "-")
+
+
+def reference_amount(text):
+    """Прежний выбор суммы: ключевые слова в окне ±30 символов вокруг каждого числа"""
+    clean = clean_text(text)
+    candidates = []
+    for m in re.finditer(r"\b\d{1,3}(?:[\s\.\,]\d{3})*(?:[\.,]\d{2})?\b", clean):
+        ctx = clean[max(0, m.start() - 30):min(len(clean), m.end() + 30)].lower()
+        score = 3 * any(k in ctx for k in TOTAL_KEYWORDS) + any(k in ctx for k in TAX_KEYWORDS) \
+            - any(k in ctx for k in QUANTITY_KEYWORDS)
+        candidates.append((score, m.group(0)))
+    candidates.sort(key=lambda x: x[0], reverse=True)
+    return candidates[0][1] if candidates else "-"
+
+
+def test_fast_path_corpus():
+    """Поля документов корпуса совпадают с зафиксированными"""
+    print("🧪 Корпус быстрого пути...")
+    for doc_type, text, expected in CORPUS:
+        result = extract_fields_fast(text, doc_type=doc_type)
+        found = {k: v for k, v in result.items() if v != "-"}
+        assert found == expected, f"{doc_type}: {found} != {expected}"
+    print(f"✅ Документов: {len(CORPUS)}")
+
+
+def test_fast_path_long_documents():
+    """Длинные договоры: дата, сумма и номер совпадают с зафиксированными и с прежним алгоритмом"""
+    print("🧪 Длинные документы...")
+    for paragraphs, seed, doc_type, date, amount, doc_number in LONG_CORPUS:
+        text = long_contract(paragraphs, seed)
+        result = extract_fields_fast(text, doc_type=doc_type)
+        assert (result["date"], result["amount"], result["doc_number"]) == (date, amount, doc_number), result
+        assert result["date"] == reference_date(text, doc_type)
+        assert result["amount"] == reference_amount(text)
+    print(f"✅ Документов: {len(LONG_CORPUS)}")
+
+
+def test_fast_path_random_texts():
+    """Случайные тексты из фрагментов реквизитов: дата и сумма совпадают с прежним алгоритмом"""
+    print("🧪 Случайные тексты...")
+    rng = random.Random(0)
+    fragments = ["Счёт", "акт", "акта", "Договор", "УПД", "Накладная", "№ 123", "от 01.02.2024", "15 января 2024",
+                 "02.03.2023", "ИНН 7701234567", "Итого:", "к оплате", "12 345,00", "99,00", "5", "с НДС",
+                 "10 шт", "Кол-во", "ед.", "x", "\n"]
+    for _ in range(2000):
+        text = " ".join(rng.choice(fragments) for _ in range(rng.randint(0, 40)))
+        doc_type = rng.choice(list(DATE_KEYWORDS))
+        result = extract_fields_fast(text, doc_type=doc_type)
+        assert result["date"] == reference_date(text, doc_type), text
+        assert result["amount"] == reference_amount(text), text
+    print("✅ Совпадает")
+
+
+def test_field_confidence():
+    """LLM спрашивается только о неуверенных полях: ИНН с неверной контрольной суммой, сумма без «итого»"""
+    print("🧪 Уверенность полей...")
+    text = """Универсальный передаточный документ
+Счёт-фактура № УТ-889 от 05.02.2024
+Продавец: ПАО «Сталь» ИНН/КПП {inn}/770501001
+Покупатель: ООО "Техно"
+Всего к оплате 1 234 567,89 с НДС"""
+    fields, confidence = extract_fields_scored(text.format(inn="7707083893"), doc_type="упд")
+    assert fields["inn"] == "7707083893" and confidence["inn"] == 1.0
+    assert fields_for_llm(confidence, "упд") == []
+    _, confidence = extract_fields_scored(text.format(inn="7705123456"), doc_type="упд")
+    assert fields_for_llm(confidence, "упд") == ["inn"]
+    act = "Акт № 45-А от {date}\nИсполнитель: ООО «Вектор»\n{total}"
+    _, confidence = extract_fields_scored(act.format(date="31.03.2024", total="Услуги оказаны, 5 шт"), doc_type="акт")
+    assert fields_for_llm(confidence, "акт") == ["amount"], confidence
+    _, confidence = extract_fields_scored(act.format(date="31.13.2024", total="Итого: 1 500,00"), doc_type="акт")
+    assert fields_for_llm(confidence, "акт") == ["date"], confidence
+    print("✅ Совпадает")
+
+
+def test_llm_excerpts():
+    """LLM получает заголовок и выдержки вокруг якорей: итог в конце длинного договора попадает в окна"""
+    print("🧪 Выдержки для LLM...")
+    clean = clean_text(long_contract(1000, 2))
+    windows, covered, unanchored = plan_excerpt_windows(clean, ["amount", "inn"], MAX_CHARS, 10)
+    assert windows[0].startswith("ДОГОВОР № Д-45/2024 от 15.01.2024")
+    assert any("Итого по договору: 1 234 567,89" in window for window in windows)
+    assert all(len(window) <= MAX_CHARS for window in windows)
+    assert covered < len(clean) // 20 and not unanchored
+    # Короткий документ целиком в одном окне; поле без якорей отмечено
+    clean = clean_text(CORPUS[0][1])
+    windows, covered, unanchored = plan_excerpt_windows(clean, ["amount", "contract_number"], MAX_CHARS, 10)
+    assert windows == [clean] and covered == len(clean) and unanchored == {"contract_number"}
+    print("✅ Совпадает")
+
+
+class FakeOllama:
+    """Подмена query_ollama: ответ и задержка по тексту окна, каждый запрос записывается"""
+
+    def __init__(self, answers, delays=None):
+        self.answers = answers
+        self.delays = delays or {}
+        self.sent = []
+        self.lock = threading.Lock()
+
+    def __call__(self, prompt):
+        window_text = prompt[prompt.rindex('"', 0, -1) + 1:-1]
+        with self.lock:
+            self.sent.append(window_text)
+        time.sleep(self.delays.get(window_text, 0))
+        return json.dumps(self.answers.get(window_text, {}), ensure_ascii=False)
+
+
+def ask_windows(fake, texts, fields, in_flight):
+    """_ask_windows с подменённым query_ollama и ограничением параллельности"""
+    saved = extractor.query_ollama, extractor.LLM_MAX_IN_FLIGHT
+    extractor.query_ollama, extractor.LLM_MAX_IN_FLIGHT = fake, in_flight
+    try:
+        windows = [(str(i), text) for i, text in enumerate(texts)]
+        return extractor._ask_windows("Извлеки поля:\n", windows, fields, {"amount": "-", "date": "-"})
+    finally:
+        extractor.query_ollama, extractor.LLM_MAX_IN_FLIGHT = saved
+
+
+def test_llm_windows_early_stop():
+    """Как только поля найдены, оставшиеся окна не отправляются"""
+    print("🧪 Окна LLM: ранняя остановка...")
+    texts = [f"окно {i}" for i in range(10)]
+    fake = FakeOllama({"окно 0": {"amount": "1 500,00", "date": "31.03.2024"}},
+                      delays={text: 0.2 for text in texts[1:]})
+    result, answered = ask_windows(fake, texts, ["amount", "date"], in_flight=2)
+    assert (result["amount"], result["date"]) == ("1 500,00", "31.03.2024"), result
+    assert answered == 1 and fake.sent == texts[:2], (answered, fake.sent)
+    print("✅ Отправлено окон: 2 из 10")
+
+
+def test_llm_windows_earlier_wins():
+    """Раннее окно побеждает при расхождении, даже если ответило последним"""
+    print("🧪 Окна LLM: порядок объединения...")
+    texts = ["заголовок", "приложение", "реквизиты"]
+    fake = FakeOllama({
+        "заголовок": {"amount": "1 500,00"},
+        "приложение": {"amount": "99,00", "date": "01.01.2020"},
+        "реквизиты": {"date": "31.03.2024"},
+    }, delays={"заголовок": 0.2})
+    result, answered = ask_windows(fake, texts, ["amount", "date"], in_flight=3)
+    assert (result["amount"], result["date"]) == ("1 500,00", "01.01.2020"), result
+    assert answered == 3
+    print("✅ Совпадает")
+
+
+def test_llm_windows_sent_once():
+    """Каждое окно отправляется ровно один раз, не больше LLM_MAX_IN_FLIGHT одновременно"""
+    print("🧪 Окна LLM: каждое окно один раз...")
+    texts = [f"окно {i}" for i in range(7)]
+    fake = FakeOllama({}, delays={text: 0.01 * (i % 3) for i, text in enumerate(texts)})
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def counted(prompt):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        try:
+            return fake(prompt)
+        finally:
+            with lock:
+                running[0] -= 1
+
+    result, answered = ask_windows(counted, texts, ["amount", "date"], in_flight=3)
+    assert sorted(fake.sent) == sorted(texts) and answered == len(texts), fake.sent
+    assert peak[0] <= 3 and result == {"amount": "-", "date": "-"}, (peak, result)
+    print(f"✅ Окон: {len(texts)}, одновременно не больше {peak[0]}")
+
+
+def main():
+    test_fast_path_corpus()
+    test_fast_path_long_documents()
+    test_fast_path_random_texts()
+    test_field_confidence()
+    test_llm_excerpts()
+    test_llm_windows_early_stop()
+    test_llm_windows_earlier_wins()
+    test_llm_windows_sent_once()
+    print("\n🎉 Все тесты пройдены")
+
+
+if __name__ == "__main__":
+    main()
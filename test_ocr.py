@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Тест OCR на синтетических изображениях: бэкенды (extractor.ocr_backends),
+разметка «только поля» (extractor.layout) и шаги предобработки (extractor.preprocess).
+
+Tesseract и docTR не нужны: движок подменяется бэкендом, который записывает
+переданные изображения, а разбор ответа docTR проверяется на подставной модели.
+"""
+
+import os
+import tempfile
+import threading
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+from extractor import ocr, ocr_backends, ocr_cache, preprocess as preprocess_module
+from extractor.layout import MAX_REGIONS_AREA, crop_regions, field_regions
+from extractor.ocr_backends import DoctrBackend, OcrBackend, OcrResult, backend_class, _text_from_data
+from extractor.preprocess import (
+    OCR_TARGET_XHEIGHT, binarize, crop_document, deskew, estimate_skew, estimate_x_height,
+    parse_steps, preprocess, scale_to_x_height
+)
+
+TABLE_TOP, TABLE_BOTTOM = 500, 1300
+
+
+def write(gray, lines, top, scale=1.0, left=80, step=None):
+    """Строки текста шрифтом OpenCV (распознавать его никто не будет — важны только пиксели)"""
+    step = step or int(40 * scale)
+    for i, line in enumerate(lines):
+        cv2.putText(gray, line, (left, top + i * step), cv2.FONT_HERSHEY_SIMPLEX, scale, 0, 2, cv2.LINE_AA)
+    return gray
+
+
+def invoice_page(width=1600, height=2200):
+    """Счёт: шапка с реквизитами, таблица товаров, «Итого» под таблицей, подписи внизу"""
+    gray = np.full((height, width), 255, np.uint8)
+    write(gray, ["INVOICE No 2024-117 dated 12.03.2024", "Supplier: Romashka LLC, INN 7701234567",
+                 "Buyer: Vector LLC, INN 5012345678"], 120)
+    rows = 16
+    for row in range(rows + 1):
+        y = TABLE_TOP + row * (TABLE_BOTTOM - TABLE_TOP) // rows
+        cv2.line(gray, (80, y), (1520, y), 0, 2)
+    for x in (80, 200, 900, 1100, 1300, 1520):
+        cv2.line(gray, (x, TABLE_TOP), (x, TABLE_BOTTOM), 0, 2)
+    for row in range(rows):
+        y = TABLE_TOP + row * (TABLE_BOTTOM - TABLE_TOP) // rows + 35
+        write(gray, [str(row + 1)], y, scale=0.8, left=100)
+        write(gray, ["Paper A4 office"], y, scale=0.8, left=220)
+        write(gray, ["350.00"], y, scale=0.8, left=1120)
+    write(gray, ["Total: 11 900.00", "VAT 20%: 1 983.33"], 1360)
+    write(gray, ["Director ______ Petrov", "Accountant ______ Ivanova"], 1950)
+    return gray
+
+
+def text_page(size=1400, lines=20):
+    gray = np.full((size, size), 255, np.uint8)
+    return write(gray, ["Supplier Romashka LLC INN 7701234567 invoice"] * lines, 200, left=150, step=50)
+
+
+class RecordingBackend(OcrBackend):
+    """Движок-подмена: запоминает размеры изображений каждого вызова recognize_batch"""
+    name = "recording"
+    batch_size = 2
+    calls = []
+
+    def recognize_batch(self, images):
+        RecordingBackend.calls.append([image.shape for image in images])
+        return [OcrResult(text=f"область {image.shape[0]}x{image.shape[1]}", confidence=90.0 - i)
+                for i, image in enumerate(images)]
+
+
+class FlakyBackend(OcrBackend):
+    """Движок-подмена с заданным исходом: сбой, пустой текст или распознанный текст"""
+    name = "flaky"
+    outcome = "raise"
+    calls = 0
+
+    def recognize_batch(self, images):
+        FlakyBackend.calls += 1
+        if FlakyBackend.outcome == "raise":
+            raise RuntimeError("движок OCR недоступен")
+        text = "" if FlakyBackend.outcome == "empty" else "Счёт № 117"
+        return [OcrResult(text=text, confidence=None if not text else 91.0) for _ in images]
+
+
+class FakeBackend:
+    """
+    Подключает бэкенд-подмену вместо OCR_BACKEND на время теста.
+    Кэш OCR выключен или, если задан cache_dir, создаётся в этом каталоге.
+    """
+
+    def __init__(self, backend=None, cache_dir=""):
+        self.backend = backend or RecordingBackend
+        self.cache_dir = cache_dir
+
+    def __enter__(self):
+        self.saved = ocr_backends.OCR_BACKEND, ocr_cache.OCR_CACHE_DIR, ocr_cache._cache, ocr_cache._cache_pid
+        ocr_backends.BACKENDS[self.backend.name] = self.backend
+        ocr_backends.OCR_BACKEND, ocr_cache.OCR_CACHE_DIR = self.backend.name, self.cache_dir
+        ocr_cache._cache, ocr_cache._cache_pid = (ocr_cache.OcrCache(self.cache_dir), os.getpid()) if self.cache_dir else (None, None)
+        self.backend.calls = [] if isinstance(self.backend.calls, list) else 0
+        return self.backend
+
+    def __exit__(self, *exc):
+        ocr_backends.OCR_BACKEND, ocr_cache.OCR_CACHE_DIR, ocr_cache._cache, ocr_cache._cache_pid = self.saved
+        ocr_backends.BACKENDS.pop(self.backend.name, None)
+        ocr_backends._backends.pop(self.backend.name, None)
+
+
+def test_backend_registry():
+    """Бэкенд выбирается по имени без загрузки модели; неизвестное имя — ошибка"""
+    print("🧪 Реестр бэкендов OCR...")
+    assert backend_class("DocTR") is DoctrBackend and backend_class("tesseract").batch_size == 1
+    try:
+        backend_class("abbyy")
+    except ValueError as e:
+        assert "tesseract" in str(e) and "doctr" in str(e)
+    else:
+        raise AssertionError("неизвестный бэкенд принят")
+    print("✅ Совпадает")
+
+
+def test_tesseract_data():
+    """Ответ image_to_data собирается по строкам; уверенность — среднее по словам без служебных блоков"""
+    print("🧪 Разбор ответа Tesseract...")
+    data = {
+        "text": ["", "Счёт", "№", "117", "", "ИНН", "7701234567", " "],
+        "conf": [-1, 96, 90, 84, -1, 95, 75, 30],
+        "block_num": [1, 1, 1, 1, 1, 2, 2, 2],
+        "par_num": [1, 1, 1, 1, 1, 1, 1, 1],
+        "line_num": [0, 1, 1, 1, 0, 1, 1, 1],
+    }
+    result = _text_from_data(data)
+    assert result.text == "Счёт № 117\nИНН 7701234567", result.text
+    assert result.confidence == 88.0, result.confidence
+    assert _text_from_data({"text": [], "conf": [], "block_num": [], "par_num": [], "line_num": []}).confidence == 0.0
+    print("✅ Совпадает")
+
+
+def test_doctr_batch():
+    """docTR получает пакет страниц RGB за один вызов; уверенность приводится к шкале 0–100"""
+    print("🧪 Пакетный docTR...")
+    received = []
+
+    def model(pages):
+        received.append([page.shape for page in pages])
+        word = lambda value, confidence: SimpleNamespace(value=value, confidence=confidence)
+        line = lambda *words: SimpleNamespace(words=list(words))
+        return SimpleNamespace(pages=[
+            SimpleNamespace(blocks=[SimpleNamespace(lines=[line(word("Акт", 0.9), word("№45", 0.7))])]),
+            SimpleNamespace(blocks=[]),
+        ])
+
+    backend = DoctrBackend.__new__(DoctrBackend)
+    backend.model, backend._lock = model, threading.Lock()
+    results = backend.recognize_batch([np.zeros((40, 30), np.uint8), np.zeros((20, 10), np.uint8)])
+    assert received == [[(40, 30, 3), (20, 10, 3)]], received
+    assert results[0].text == "Акт №45" and round(results[0].confidence, 6) == 80.0
+    assert results[1].text == "" and results[1].confidence == 0.0
+    print("✅ Совпадает")
+
+
+def test_failed_ocr_not_cached():
+    """Сбой движка и пустой текст не попадают в кэш OCR: следующая загрузка страницы распознаёт её заново"""
+    print("🧪 Сбой OCR и кэш...")
+    page = text_page()
+    with tempfile.TemporaryDirectory() as tmp:
+        with FakeBackend(FlakyBackend, cache_dir=tmp) as backend:
+            cache = ocr_cache.get_ocr_cache()
+            rows = lambda: cache._conn.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()[0]
+            for outcome in ("raise", "empty"):
+                backend.outcome = outcome
+                assert ocr._recognize([[page]], source="TEST")[0].text == ""
+                assert rows() == 0, outcome
+            backend.outcome = "text"
+            assert ocr._recognize([[page]], source="TEST")[0].text == "Счёт № 117" and rows() == 1
+            calls = backend.calls
+            assert ocr._recognize([[page]], source="TEST")[0].text == "Счёт № 117" and backend.calls == calls
+            cache._conn.close()
+
+    # Tesseract без tesserocr, pytesseract и бинарника: исключение, а не пустой текст
+    import pytesseract
+    import subprocess
+    saved = pytesseract.image_to_data, subprocess.run
+
+    def missing(*args, **kwargs):
+        raise FileNotFoundError("tesseract")
+
+    pytesseract.image_to_data = subprocess.run = missing
+    try:
+        tesseract = ocr_backends.TesseractBackend.__new__(ocr_backends.TesseractBackend)
+        tesseract.lang, tesseract.api, tesseract._lock = "rus", None, threading.Lock()
+        try:
+            tesseract.recognize(page)
+        except RuntimeError as e:
+            assert "Tesseract" in str(e)
+        else:
+            raise AssertionError("сбой Tesseract вернул результат")
+    finally:
+        pytesseract.image_to_data, subprocess.run = saved
+    print("✅ Совпадает")
+
+
+def test_field_regions():
+    """Счёт: распознаются шапка, «Итого» под таблицей и подписи; тело таблицы пропускается"""
+    print("🧪 Разметка «только поля»...")
+    page = invoice_page()
+    regions = field_regions(page)
+    assert len(regions) == 3, regions
+    (_, header_y, _, header_h), (_, totals_y, _, _), (_, footer_y, _, footer_h) = regions
+    assert header_y + header_h <= TABLE_TOP and TABLE_BOTTOM <= totals_y < 1400 and footer_y + footer_h > 2000
+    assert all(y + h <= TABLE_TOP or y >= TABLE_BOTTOM for _, y, _, h in regions), regions
+    assert sum(w * h for _, _, w, h in regions) < MAX_REGIONS_AREA * page.size / 4
+    crops = crop_regions(page, regions)
+    assert all(np.shares_memory(crop, page) for crop in crops)
+    assert [crop.shape for crop in crops] == [(h, w) for _, _, w, h in regions]
+    # Пустая страница: разметке не за что зацепиться — распознаётся целиком
+    assert field_regions(np.full((500, 400), 255, np.uint8)) == []
+    print(f"✅ Областей: {len(regions)}")
+
+
+def test_fields_only_ocr():
+    """В режиме «только поля» движок получает области одним пакетом, текст собирается по порядку"""
+    print("🧪 OCR изображения «только поля»...")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "scan.jpg")
+        cv2.imwrite(path, invoice_page())
+        with FakeBackend() as backend:
+            regions = ocr.ocr_image_file(path, fields_only=True)
+            regions_calls = backend.calls
+            backend.calls = []
+            full = ocr.ocr_image_file(path, fields_only=False)
+            full_calls = backend.calls
+    assert len(regions_calls) == 1 and len(regions_calls[0]) >= 2, regions_calls
+    assert regions.text.splitlines() == [f"область {h}x{w}" for h, w in regions_calls[0]]
+    assert 88.0 <= regions.confidence <= 90.0
+    assert len(full_calls) == 1 and len(full_calls[0]) == 1 and full.text == "область {}x{}".format(*full_calls[0][0])
+    region_area = sum(h * w for h, w in regions_calls[0])
+    assert region_area < full_calls[0][0][0] * full_calls[0][0][1] / 2
+    print(f"✅ Площадь областей: {region_area / float(full_calls[0][0][0] * full_calls[0][0][1]):.0%} страницы")
+
+
+def test_preprocess_steps():
+    """Шаги разбираются из строки, неизвестный шаг — ошибка; время замеряется по каждому шагу"""
+    print("🧪 Шаги предобработки...")
+    assert parse_steps(" crop, binarize ,") == ["crop", "binarize"] and parse_steps("") == []
+    try:
+        parse_steps("crop,sharpen")
+    except ValueError as e:
+        assert "sharpen" in str(e)
+    else:
+        raise AssertionError("неизвестный шаг принят")
+    page = text_page()
+    gray, timings = preprocess(page, "crop,enhance,binarize")
+    assert list(timings) == ["crop", "enhance", "binarize"] and all(ms >= 0 for ms in timings.values())
+    assert gray.shape[0] < page.shape[0] and gray.shape[1] < page.shape[1]
+    assert set(np.unique(binarize(page))) <= {0, 255}
+    unchanged, timings = preprocess(page, "")
+    assert unchanged is page and timings == {}
+    print("✅ Совпадает")
+
+
+def test_crop_deskew_scale():
+    """Фото листа на тёмном фоне обрезается, наклон 5° выравнивается, крупный текст уменьшается"""
+    print("🧪 Обрезка, наклон, масштаб...")
+    photo = np.full((2000, 1500), 60, np.uint8)
+    photo[300:1700, 250:1250] = 255
+    write(photo, ["Invoice 117"] * 5, 800, left=500)
+    cropped = crop_document(photo)
+    assert cropped.shape[0] < 400 and cropped.shape[1] < 400 and cropped.min() == 0 and cropped.max() == 255
+
+    page = text_page()
+    rotated = cv2.warpAffine(page, cv2.getRotationMatrix2D((700, 700), 5, 1.0), page.shape[::-1], borderValue=255)
+    assert abs(abs(estimate_skew(rotated)) - 5.0) <= 0.2, estimate_skew(rotated)
+    assert abs(estimate_skew(deskew(rotated))) <= 0.2
+    assert deskew(page) is page
+
+    large = write(np.full((2200, 1600), 255, np.uint8), ["Paper A4 office supplies"] * 12, 200, scale=3.0, step=150)
+    scaled = scale_to_x_height(large)
+    assert estimate_x_height(large) > OCR_TARGET_XHEIGHT and scaled.shape[0] < large.shape[0]
+    assert estimate_x_height(scaled) <= OCR_TARGET_XHEIGHT * 1.1, estimate_x_height(scaled)
+    assert scale_to_x_height(page) is page
+    print("✅ Совпадает")
+
+
+def test_escalated_render_keeps_resolution():
+    """Шаг scale уменьшает обычную отрисовку, но не повторную с OCR_MAX_RESOLUTION"""
+    print("🧪 Повышенное разрешение и масштаб...")
+    from PIL import Image
+    scan = write(np.full((1100, 850), 255, np.uint8), ["Paper A4 office"] * 8, 150, scale=2.0, step=110)
+    saved = preprocess_module.OCR_PREPROCESS_STEPS
+    preprocess_module.OCR_PREPROCESS_STEPS = "scale,enhance"
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "scan.pdf")
+            Image.fromarray(scan).save(path, resolution=100)
+            assert ocr.page_preprocess_steps(ocr.OCR_RESOLUTION) == "scale,enhance"
+            assert ocr.page_preprocess_steps(ocr.OCR_MAX_RESOLUTION) == "enhance"
+            base = ocr._prepare_pdf_page(path, 0, ocr.OCR_RESOLUTION)
+            escalated = ocr._prepare_pdf_page(path, 0, ocr.OCR_MAX_RESOLUTION)
+    finally:
+        preprocess_module.OCR_PREPROCESS_STEPS = saved
+    factor = ocr.OCR_MAX_RESOLUTION / 100.0
+    assert escalated.shape == (round(1100 * factor), round(850 * factor)), escalated.shape
+    assert base.shape[0] < 1100 * ocr.OCR_RESOLUTION / 100.0, base.shape
+    print(f"✅ {ocr.OCR_RESOLUTION} dpi: {base.shape[1]}x{base.shape[0]}, "
+          f"{ocr.OCR_MAX_RESOLUTION} dpi: {escalated.shape[1]}x{escalated.shape[0]}")
+
+
+def main():
+    test_backend_registry()
+    test_tesseract_data()
+    test_doctr_batch()
+    test_failed_ocr_not_cached()
+    test_field_regions()
+    test_fields_only_ocr()
+    test_preprocess_steps()
+    test_crop_deskew_scale()
+    test_escalated_render_keeps_resolution()
+    print("\n🎉 Все тесты пройдены")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Обучение модели типа документа на сохранённых документах.
+
+Тексты извлекаются из файлов documents.storage_path так же, как при обработке
+(первые MAX_CHARS символов, OCR берётся из кэша), метки — documents.doc_type.
+Точность считается на отложенной выборке и сравнивается с классификацией по
+ключевым словам; затем модель обучается на всех документах и сохраняется в
+CLASSIFIER_MODEL_PATH (по умолчанию data/doc_type_model.pkl, рядом с индексом RAG).
+
+    python train_classifier.py --limit 5000
+    python train_classifier.py --evaluate   # сохранённая модель на тех же документах, без переобучения
+
+--evaluate показывает точность на документах, на которых модель обучалась
+(оценка сверху), рядом с точностью на отложенной выборке, сохранённой при обучении.
+"""
+
+import argparse
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from classifier import CLASSIFIER_MODEL_PATH, DocTypeModel, classify_by_keywords, normalize_doc_type, train_model
+from extractor import MAX_CHARS, process_file_with_classification
+
+
+def load_text(path):
+    try:
+        text, _ = process_file_with_classification(path)
+    except Exception as e:
+        logging.warning(f"Не удалось извлечь текст {path}: {e}")
+        return None
+    return text[:MAX_CHARS] if text and text.strip() else None
+
+
+def load_samples(limit, workers):
+    """Тексты и метки сохранённых документов, файлы которых ещё на диске"""
+    from storage import storage
+    rows = [row for row in storage.get_labelled_documents(limit) if os.path.exists(row['storage_path'])]
+    print(f"Документов с файлами: {len(rows)}, извлекаю текст...")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        texts = list(pool.map(load_text, [row['storage_path'] for row in rows]))
+    samples = [(text, normalize_doc_type(row['doc_type'])) for row, text in zip(rows, texts) if text]
+    return [text for text, _ in samples], [label for _, label in samples]
+
+
+def accuracy(expected, predicted):
+    return sum(e == p for e, p in zip(expected, predicted)) / len(expected) if expected else 0.0
+
+
+def report(texts, labels, predicted, title="Точность модели"):
+    """Точность модели и ключевых слов, затем по типам"""
+    keywords = [classify_by_keywords(text).doc_type for text in texts]
+    print(f"{title}: {accuracy(labels, predicted):.1%}, ключевых слов: {accuracy(labels, keywords):.1%} "
+          f"(документов: {len(labels)})")
+    for doc_type, count in sorted(Counter(labels).items(), key=lambda item: -item[1]):
+        rows = [i for i, label in enumerate(labels) if label == doc_type]
+        print(f"  {doc_type:<14} {count:>6}  модель {accuracy([doc_type] * count, [predicted[i] for i in rows]):>6.1%}"
+              f"  ключевые слова {accuracy([doc_type] * count, [keywords[i] for i in rows]):>6.1%}")
+
+
+def holdout_split(labels, test_size):
+    """
+    Индексы (обучение, отложенная выборка) или None, если документов слишком мало.
+    Редкие типы (один документ) не разделить по стратам — они идут только в обучение.
+    Если в отложенную выборку не помещается по документу каждого типа, выборка
+    делится без стратификации.
+    """
+    from sklearn.model_selection import train_test_split
+    counts = Counter(labels)
+    rare = [i for i, label in enumerate(labels) if counts[label] < 2]
+    common = [i for i, label in enumerate(labels) if counts[label] >= 2]
+    if len(common) < 2:
+        return None
+    try:
+        train_idx, test_idx = train_test_split(common, test_size=test_size, random_state=0,
+                                               stratify=[labels[i] for i in common])
+    except ValueError as e:
+        print(f"Стратифицированная выборка невозможна ({e}), делю без стратификации")
+        train_idx, test_idx = train_test_split(common, test_size=test_size, random_state=0)
+    train_idx += rare
+    if len({labels[i] for i in train_idx}) < 2:
+        return None
+    return train_idx, test_idx
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Обучение модели типа документа')
+    parser.add_argument('--limit', type=int, help='Сколько последних документов взять (по умолчанию все)')
+    parser.add_argument('--test-size', type=float, default=0.2, help='Доля отложенной выборки для оценки')
+    parser.add_argument('--workers', type=int, default=4, help='Потоков извлечения текста')
+    parser.add_argument('--output', default=CLASSIFIER_MODEL_PATH, help='Куда сохранить модель')
+    parser.add_argument('--evaluate', action='store_true', help='Только оценить сохранённую модель')
+    args = parser.parse_args()
+
+    texts, labels = load_samples(args.limit, args.workers)
+    print(f"Обучающих документов: {len(texts)}: {dict(Counter(labels))}")
+    if len(set(labels)) < 2:
+        print("Нужны документы хотя бы двух типов")
+        return
+
+    if args.evaluate:
+        model = DocTypeModel.load(args.output)
+        print(f"Модель {args.output}: {model.info}")
+        if 'holdout_accuracy' in model.info:
+            print(f"Точность на отложенной выборке при обучении: {model.info['holdout_accuracy']:.1%}")
+        # Модель обучена на всех документах, поэтому это точность на обучающих данных, а не оценка качества
+        report(texts, labels, model.predict_many(texts), title="Точность на обучающих документах")
+        return
+
+    info = {}
+    split = holdout_split(labels, args.test_size)
+    if split is None:
+        print("Документов слишком мало для отложенной выборки: модель обучается без оценки")
+    else:
+        train_idx, test_idx = split
+        model = train_model([texts[i] for i in train_idx], [labels[i] for i in train_idx])
+        test_texts, test_labels = [texts[i] for i in test_idx], [labels[i] for i in test_idx]
+        predicted = model.predict_many(test_texts)
+        report(test_texts, test_labels, predicted, title="Точность на отложенной выборке")
+        info['holdout_accuracy'] = round(accuracy(test_labels, predicted), 4)
+
+    started = time.perf_counter()
+    model = train_model(texts, labels, info=info)
+    print(f"Модель обучена на всех документах за {time.perf_counter() - started:.1f} с")
+    model.save(args.output)
+    print(f"Модель сохранена: {args.output}")
+
+
+if __name__ == "__main__":
+    main()